@@ -0,0 +1,1089 @@
+"""
+Tests for the text adventure demo. Run them with:
+
+    python -m pytest test_textadventuredemo.py
+
+or, without pytest installed:
+
+    python -m unittest test_textadventuredemo
+"""
+
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import unittest
+
+import textadventuredemo
+from textadventuredemo import (DESC, DESCWORDS, DIRECTION_INDEX, EXIT_DIRECTIONS, GROUND, MAX_QUANTITY, NORTH, NO_EXIT,
+                               SHOP_STOCK, START_MONEY, UP, WORLD_CACHE_MIN_ROOMS, CommandStats, Economy, FuzzyIndex,
+                               GameSession, ItemBag, MemorySink, RenderCache, Response, Router, Scheduler,
+                               SessionRecorder, SharedWorldCmd, TextAdventureCmd, WorldState, closestWords,
+                               compileWorld, compileWorldCached, completeDirections, completeItemWords,
+                               correctDirection, editDistance, encodeOutput, gameWorld, getAllDescWords,
+                               getAllFirstDescWords, getAllItemsMatchingDesc, getFirstItemMatchingDesc, getSearchIndex,
+                               isEdible, loadGame, openWorldFile, packVarint, parseNounPhrase, readRecording,
+                               renderLocation, replayRecording, runBatch, setExit, startSimulation, stopSimulation,
+                               unpackVarint, validateWorld, writeWorldFile)
+from textadventurebench import generateWorld
+from textadventureserver import PROMPT, GameServer, stripTelnetCommands
+from textadventureshards import ShardRouter, partitionRooms
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def bagOf(*names):
+    """Returns an ItemBag of the items in the built-in world with these names."""
+    return ItemBag(gameWorld.items, [gameWorld.itemId(name) for name in names])
+
+
+class ItemBagTests(unittest.TestCase):
+    def test_counts(self):
+        anvil, donut = gameWorld.itemId('Anvil'), gameWorld.itemId('Donut')
+        bag = bagOf('Anvil', 'Anvil', 'Donut')
+        self.assertEqual(len(bag), 3)
+        self.assertEqual(bag.count(anvil), 2)
+        self.assertEqual(list(bag.distinct()), [anvil, donut])
+        self.assertEqual(list(bag), [anvil, anvil, donut])
+        bag.add(anvil, 3)
+        bag.remove(anvil, 4)
+        self.assertEqual(bag.count(anvil), 1)
+        self.assertRaises(ValueError, bag.remove, anvil, 2)
+        self.assertRaises(ValueError, bag.remove, gameWorld.itemId('Bagel'))
+
+    def test_lookup(self):
+        bag = bagOf('Anvil', 'Donut', 'Sword')
+        self.assertEqual(getFirstItemMatchingDesc('anvil', bag), gameWorld.itemId('Anvil'))
+        self.assertEqual(getAllItemsMatchingDesc('longsword', bag), [gameWorld.itemId('Sword')])
+        self.assertIsNone(getFirstItemMatchingDesc('bagel', bag))
+        self.assertEqual(getAllItemsMatchingDesc('bagel', bag), [])
+
+    def test_the_index_follows_the_counts(self):
+        anvil = gameWorld.itemId('Anvil')
+        bag = bagOf('Anvil', 'Anvil')
+        bag.remove(anvil)
+        self.assertEqual(getFirstItemMatchingDesc('anvil', bag), anvil) # one is still there
+        bag.remove(anvil)
+        self.assertIsNone(getFirstItemMatchingDesc('anvil', bag))
+        self.assertEqual(getAllDescWords(bag), [])
+        bag.add(gameWorld.itemId('Donut'))
+        self.assertEqual(getAllFirstDescWords(bag), ['donut'])
+
+    def test_the_index_is_made_when_needed(self):
+        anvil, donut = gameWorld.itemId('Anvil'), gameWorld.itemId('Donut')
+        bag = bagOf('Anvil', 'Sword')
+        self.assertIsNone(bag._descIndex) # nothing has looked anything up yet
+        self.assertEqual(getFirstItemMatchingDesc('anvil', bag), anvil)
+        bag.remove(anvil)
+        bag.add(donut)
+        self.assertIsNone(getFirstItemMatchingDesc('anvil', bag))
+        self.assertEqual(getFirstItemMatchingDesc('donut', bag), donut)
+        self.assertIsNone(bagOf().copy()._descIndex)
+
+
+class CompletionTests(unittest.TestCase):
+    def test_prefixes(self):
+        bag = bagOf('Sword', 'War Axe', 'Chainmail T-Shirt', 'Silly Glasses')
+        self.assertEqual(completeItemWords('s', 'look s', [bag]), ['silly', 'stupid', 'sword'])
+        self.assertEqual(completeItemWords('wa', 'look wa', [bag]), ['war'])
+        self.assertEqual(completeItemWords('x', 'look x', [bag]), [])
+
+    def test_first_words_and_filters(self):
+        bag = bagOf('Sword', 'Donut', 'Bagel', 'Bagel')
+        self.assertEqual(completeItemWords('', 'eat ', [bag], isEdible), ['donut', 'bagel'])
+        self.assertEqual(completeItemWords('', 'look ', [bag]), ['sword', 'donut', 'bagel'])
+        self.assertEqual(completeItemWords('', 'look sword ', [bag]), []) # already complete
+
+    def test_several_bags_give_each_word_once(self):
+        self.assertEqual(completeItemWords('d', 'look d', [bagOf('Donut'), bagOf('Donut')]), ['donut'])
+
+    def test_directions(self):
+        self.assertEqual(completeDirections(''), ['down', 'east', 'north', 'south', 'up', 'west'])
+        self.assertEqual(completeDirections('u'), ['up'])
+        self.assertEqual(completeDirections('x'), [])
+
+
+class CompileWorldTests(unittest.TestCase):
+    def test_ids_and_exits(self):
+        world = compileWorld(textadventuredemo.world, textadventuredemo.objects)
+        self.assertEqual([room.name for room in world.rooms], list(textadventuredemo.world))
+        self.assertEqual([item.name for item in world.items], list(textadventuredemo.objects))
+        square = world.rooms[world.roomId('Town Square')]
+        self.assertEqual(world.rooms[square.exits[DIRECTION_INDEX['north']]].name, 'North Y Street')
+        self.assertEqual(square.exits[DIRECTION_INDEX['up']], NO_EXIT)
+
+    def test_items(self):
+        world = compileWorld(textadventuredemo.world, textadventuredemo.objects)
+        anvil = world.items[world.itemId('Anvil')]
+        self.assertFalse(anvil.takeable) # filled in from the objects dictionary
+        self.assertFalse(anvil.edible) # the default
+        self.assertEqual(anvil.descWords, ('anvil',))
+        store = world.rooms[world.roomId('Used Anvils Store')]
+        self.assertEqual(store.ground.count(anvil.id), 4)
+        self.assertIn(anvil.id, store.shop)
+
+
+class RenderCacheTests(unittest.TestCase):
+    def test_least_recently_used_is_dropped(self):
+        cache = RenderCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_areas_are_rendered_again_when_they_change(self):
+        state = WorldState(gameWorld)
+        loc = gameWorld.roomId('Town Square')
+        anvil = gameWorld.itemId('Anvil')
+        before = renderLocation(loc, state.ground(loc))
+        self.assertIs(renderLocation(loc, state.ground(loc)), before) # from the cache
+        state.groundForUpdate(loc).add(anvil)
+        self.assertIn(gameWorld.items[anvil].groundDesc, renderLocation(loc, state.ground(loc)))
+        state.groundForUpdate(loc).remove(anvil)
+        self.assertEqual(renderLocation(loc, state.ground(loc)), before)
+
+        room = gameWorld.rooms[loc]
+        exits = room.exits
+        up = DIRECTION_INDEX['up']
+        room.exits = exits[:up] + (gameWorld.roomId('Bakery'),) + exits[up + 1:]
+        try:
+            self.assertIn('Up: Bakery', renderLocation(loc, state.ground(loc)))
+        finally:
+            room.exits = exits
+        self.assertEqual(renderLocation(loc, state.ground(loc)), before)
+
+
+class BatchTests(unittest.TestCase):
+    def test_script(self):
+        out = io.StringIO()
+        timings = runBatch(['look', '# a comment', '', 'inventory', 'quit', 'look'], out=out)
+        self.assertEqual(sorted(timings), ['inventory', 'look', 'quit']) # nothing after quit is run
+        self.assertEqual(timings['look'][0], 1)
+        transcript = out.getvalue()
+        self.assertIn('> inventory', transcript)
+        self.assertIn('Town Square', transcript)
+        self.assertNotIn('a comment', transcript)
+
+    def test_no_echo(self):
+        out = io.StringIO()
+        runBatch(['inventory'], out=out, echo=False)
+        self.assertNotIn('> inventory', out.getvalue())
+
+    def test_scripts_share_one_player(self):
+        directory = tempfile.mkdtemp()
+        try:
+            scripts = [os.path.join(directory, name) for name in ('first.txt', 'second.txt')]
+            with open(scripts[0], 'w') as script:
+                script.write('drop donut\nnorth\n')
+            with open(scripts[1], 'w') as script:
+                script.write('inventory\nlook\n')
+            transcript = subprocess.run([sys.executable, textadventuredemo.__file__, '--batch'] + scripts,
+                                        capture_output=True, text=True, check=True).stdout
+        finally:
+            shutil.rmtree(directory)
+        second = transcript[transcript.index('> inventory'):]
+        self.assertNotIn('Donut', second) # it was dropped by the first script
+        self.assertIn('North Y Street', second[second.index('> look'):])
+
+
+def play(cmdObj, *lines):
+    """Runs the commands in lines for cmdObj's player, and returns what they
+    displayed."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for line in lines:
+            cmdObj.postcmd(cmdObj.onecmd(line), line)
+    return out.getvalue()
+
+
+class SessionTests(unittest.TestCase):
+    def test_players_in_one_world_state_share_the_ground(self):
+        state = WorldState(gameWorld)
+        alice = TextAdventureCmd(GameSession(state))
+        bob = TextAdventureCmd(GameSession(state))
+        square = gameWorld.roomId('Town Square')
+        donut = gameWorld.itemId('Donut')
+        play(alice, 'drop donut')
+        self.assertIn('donut', play(bob, 'look donut').lower())
+        play(bob, 'take donut')
+        self.assertEqual(bob.session.inventory.count(donut), 2)
+        self.assertEqual(alice.session.inventory.count(donut), 0)
+        self.assertNotIn(donut, state.ground(square))
+
+    def test_the_compiled_world_is_not_changed(self):
+        square = gameWorld.roomId('Town Square')
+        before = sorted(gameWorld.rooms[square].ground.items())
+        state = WorldState(gameWorld)
+        self.assertIs(state.ground(square), gameWorld.rooms[square].ground)
+        play(TextAdventureCmd(GameSession(state)), 'drop sword')
+        self.assertIsNot(state.ground(square), gameWorld.rooms[square].ground) # copied on the first change
+        self.assertIn(gameWorld.itemId('Sword'), state.ground(square))
+        self.assertEqual(sorted(gameWorld.rooms[square].ground.items()), before)
+
+    def test_separate_world_states_are_private(self):
+        alice = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        carol = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        play(alice, 'drop donut', 'north')
+        self.assertEqual(carol.session.location, gameWorld.roomId('Town Square'))
+        self.assertNotIn(gameWorld.itemId('Donut'), carol.session.state.ground(carol.session.location))
+
+
+async def readUntil(reader, marker):
+    """Returns what reader receives up to and including marker (or until the
+    connection closes)."""
+    data = b''
+    while marker not in data:
+        chunk = await asyncio.wait_for(reader.read(4096), 5)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class GameServerTests(unittest.TestCase):
+    def test_players_share_the_world(self):
+        async def play():
+            server = GameServer()
+            listener = await asyncio.start_server(server.handleConnection, '127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            try:
+                aliceReader, aliceWriter = await asyncio.open_connection('127.0.0.1', port)
+                bobReader, bobWriter = await asyncio.open_connection('127.0.0.1', port)
+                welcome = await readUntil(aliceReader, PROMPT)
+                await readUntil(bobReader, PROMPT)
+                aliceWriter.write(b'drop donut\r\n')
+                await readUntil(aliceReader, PROMPT)
+                bobWriter.write(b'take donut\r\nquit\r\n')
+                transcript = await readUntil(bobReader, b'Thanks for playing!')
+                aliceWriter.close()
+                bobWriter.close()
+                return welcome, transcript
+            finally:
+                listener.close()
+                await listener.wait_closed()
+
+        welcome, transcript = asyncio.run(play())
+        self.assertIn(b'Town Square\r\n', welcome)
+        self.assertIn(b'You take', transcript)
+        self.assertIn(b'Thanks for playing!', transcript)
+
+    def test_telnet_commands_are_removed(self):
+        self.assertEqual(stripTelnetCommands(b'look\r\n'), b'look\r\n')
+        self.assertEqual(stripTelnetCommands(b'\xff\xfb\x01lo\xff\xf1ok'), b'look')
+        self.assertEqual(stripTelnetCommands(b'a\xff\xffb'), b'a\xffb')
+
+
+class DispatchTests(unittest.TestCase):
+    def test_abbreviations(self):
+        table = TextAdventureCmd.commandTable
+        self.assertIs(table['inventory'], TextAdventureCmd.do_inventory)
+        self.assertIs(table['inve'], TextAdventureCmd.do_inventory)
+        self.assertIs(table['qu'], TextAdventureCmd.do_quit)
+        self.assertIs(table['lo'], TextAdventureCmd.do_look)
+        self.assertNotIn('l', table) # it could be "look" or "list"
+
+    def test_dispatch(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            cmdObj.dispatch('north')
+            self.assertEqual(cmdObj.session.location, gameWorld.roomId('North Y Street'))
+            cmdObj.dispatch('SO')
+            self.assertEqual(cmdObj.session.location, gameWorld.roomId('Town Square'))
+            self.assertTrue(cmdObj.dispatch('quit'))
+
+    def test_unknown_commands(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        self.assertIn('I do not understand', play(cmdObj, 'xyzzy'))
+
+
+class PathTests(unittest.TestCase):
+    def test_paths(self):
+        self.assertEqual(textadventuredemo.path('Town Square', 'Town Square'), [])
+        self.assertEqual(textadventuredemo.path('Town Square', 'Bakery'), ['north', 'east'])
+        route = textadventuredemo.path('Bakery', 'Observation Deck')
+        loc = gameWorld.roomId('Bakery')
+        for direction in route:
+            loc = gameWorld.rooms[loc].exits[EXIT_DIRECTIONS.index(direction)]
+        self.assertEqual(loc, gameWorld.roomId('Observation Deck'))
+
+    def test_no_way_there(self):
+        world = compileWorld(textadventuredemo.world, textadventuredemo.objects)
+        square = world.roomId('Town Square')
+        for direction, destination in zip(EXIT_DIRECTIONS, world.rooms[square].exits):
+            if destination != NO_EXIT:
+                setExit(world, square, direction, NO_EXIT)
+        self.assertIsNone(world.router.path(square, world.roomId('Bakery')))
+        self.assertIsNotNone(world.router.path(world.roomId('Bakery'), square)) # the way in is still there
+
+    def test_goto(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        play(cmdObj, 'goto bakery')
+        self.assertEqual(cmdObj.session.location, gameWorld.roomId('Bakery'))
+        self.assertIn('no area called', play(cmdObj, 'goto nowhere at all').lower())
+        self.assertEqual(cmdObj.session.location, gameWorld.roomId('Bakery'))
+
+
+def playerState(session):
+    """Returns what a test compares between two sessions: where the player
+    is, what they carry, their money, and the ground that has changed."""
+    return (session.location, sorted(session.inventory.items()), session.money,
+            {loc: sorted(ground.items()) for loc, ground in session.state.changedGround.items() if len(ground)})
+
+
+class GameTestCase(unittest.TestCase):
+    """Runs commands in a temporary directory, so that the files the game
+    writes don't end up in the real one."""
+    commands = ['drop donut', 'north', 'take sign', 'west', 'take picks', 'drop sword',
+                'south', 'west', 'buy anvil', 'buy 2 anvils', 'sell anvil', 'eat picks', 'drop anvil']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saveDirectory = textadventuredemo.SAVE_DIRECTORY
+        textadventuredemo.SAVE_DIRECTORY = self.directory
+        self.cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+
+    def tearDown(self):
+        if self.cmdObj.session.journal is not None:
+            self.cmdObj.session.journal.close()
+        textadventuredemo.SAVE_DIRECTORY = self.saveDirectory
+        shutil.rmtree(self.directory)
+
+    def play(self, commands):
+        return play(self.cmdObj, *commands)
+
+
+class SaveTests(GameTestCase):
+    def test_save_load_and_journal_replay(self):
+        self.play(['take sign', 'north', 'save test'])
+        self.play(self.commands)
+        self.cmdObj.session.journal.flush()
+        restored = loadGame(os.path.join(self.directory, 'test.sav'))
+        restored.journal.close()
+        self.assertEqual(playerState(restored), playerState(self.cmdObj.session))
+
+    def test_restore_brings_back_the_journaled_game(self):
+        self.play(['save test'] + self.commands)
+        before = playerState(self.cmdObj.session)
+        self.play(['restore test'])
+        self.assertEqual(playerState(self.cmdObj.session), before)
+
+    def test_half_written_journal_record_is_ignored(self):
+        self.play(['save test'] + self.commands)
+        self.cmdObj.session.journal.close()
+        self.cmdObj.session.journal = None
+        with open(os.path.join(self.directory, 'test.sav.journal'), 'ab') as journal:
+            journal.write(b'\x01\x02')
+        restored = loadGame(os.path.join(self.directory, 'test.sav'))
+        restored.journal.close()
+        self.assertEqual(playerState(restored), playerState(self.cmdObj.session))
+
+    def test_broken_save_files_are_refused(self):
+        self.play(['save test'])
+        filename = os.path.join(self.directory, 'test.sav')
+        with open(filename, 'rb') as saveFile:
+            data = saveFile.read()
+        for broken in (data[:10], data[:-3], b'XXXX' + data[4:]):
+            with open(filename, 'wb') as saveFile:
+                saveFile.write(broken)
+            with self.assertRaises(ValueError):
+                loadGame(filename)
+
+
+class WorldFileTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'test.world')
+        writeWorldFile(self.filename, textadventuredemo.world, textadventuredemo.objects)
+        self.mapped = openWorldFile(self.filename, cacheSize=4)
+
+    def tearDown(self):
+        self.mapped.mm.close()
+        shutil.rmtree(self.directory)
+
+    def test_write_and_open(self):
+        mapped = self.mapped
+        self.assertEqual(len(mapped.rooms), len(gameWorld.rooms))
+        self.assertEqual(mapped.fingerprint(), gameWorld.fingerprint())
+        for loc, room in enumerate(gameWorld.rooms):
+            self.assertEqual(mapped.roomName(loc), room.name)
+            self.assertEqual(mapped.roomId(room.name), loc)
+            self.assertEqual(mapped.roomExits(loc), room.exits)
+            self.assertEqual(sorted(mapped.rooms[loc].ground.items()), sorted(room.ground.items()))
+        for item in gameWorld.items:
+            self.assertEqual(mapped.itemId(item.name), item.id)
+            self.assertEqual(mapped.items[item.id].descWords, item.descWords)
+        self.assertEqual(mapped.router.path(mapped.roomId('Bakery'), mapped.roomId('Observation Deck')),
+                         gameWorld.router.path(gameWorld.roomId('Bakery'), gameWorld.roomId('Observation Deck')))
+
+    def test_playing_a_mapped_world(self):
+        commands = ['north', 'take sign', 'west', 'look', 'south', 'west', 'buy anvil', 'inventory']
+        fromDicts = play(TextAdventureCmd(GameSession(WorldState(gameWorld))), *commands)
+        fromFile = play(TextAdventureCmd(GameSession(WorldState(self.mapped))), *commands)
+        self.assertEqual(fromFile, fromDicts)
+
+    def test_routing_uses_the_stored_incoming_exits(self):
+        compiled = compileWorld(textadventuredemo.world, textadventuredemo.objects)
+        mapped = self.mapped
+        for loc in range(len(compiled.rooms)):
+            self.assertEqual(mapped.incomingExits(loc), compiled.incomingExits(loc))
+        square, bakery = compiled.roomId('Town Square'), compiled.roomId('Bakery')
+        self.assertEqual(mapped.router.path(bakery, square), compiled.router.path(bakery, square))
+        self.assertEqual(len(mapped.rooms.cache), 0) # no rooms were read to find the way
+
+        for world in (compiled, mapped):
+            setExit(world, square, 'up', bakery)
+            setExit(world, bakery, 'down', NO_EXIT)
+        self.assertEqual(mapped.router.path(square, bakery), ['up'])
+        for loc in range(len(compiled.rooms)):
+            self.assertEqual(sorted(mapped.incomingExits(loc)), sorted(compiled.incomingExits(loc)))
+            self.assertEqual(mapped.router.path(loc, square), compiled.router.path(loc, square))
+
+
+class GenerateWorldTests(unittest.TestCase):
+    def test_same_seed_same_world(self):
+        self.assertEqual(generateWorld(seed=3, roomCount=50), generateWorld(seed=3, roomCount=50))
+        self.assertNotEqual(generateWorld(seed=3, roomCount=50), generateWorld(seed=4, roomCount=50))
+
+    def test_every_room_can_be_reached(self):
+        worldDict, objectsDict, startLocation = generateWorld(seed=1, roomCount=200)
+        generated = compileWorld(worldDict, objectsDict)
+        self.assertEqual(len(generated.rooms), 200)
+        start = generated.roomId(startLocation)
+        for loc, room in enumerate(generated.rooms):
+            for direction, destination in enumerate(room.exits):
+                if destination != NO_EXIT:
+                    self.assertEqual(generated.rooms[destination].exits[direction ^ 1], loc) # exits go both ways
+            self.assertIsNotNone(generated.router.path(start, loc))
+
+
+class WorldCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.directory, 'world.cache')
+        self.worldDict, self.objectsDict, startLocation = generateWorld(seed=2, roomCount=WORLD_CACHE_MIN_ROOMS)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameWorld(self, first, second):
+        self.assertEqual([(room.name, room.desc, room.exits, list(room.ground.items())) for room in first.rooms],
+                         [(room.name, room.desc, room.exits, list(room.ground.items())) for room in second.rooms])
+        self.assertEqual([item.descWords for item in first.items], [item.descWords for item in second.items])
+        self.assertEqual(dict(first.router.tables), dict(second.router.tables))
+
+    def test_the_cache_is_used(self):
+        compiled = compileWorldCached(self.worldDict, self.objectsDict, self.cacheFile)
+        self.assertTrue(os.path.exists(self.cacheFile))
+        self.assertSameWorld(compiled, compileWorld(self.worldDict, self.objectsDict))
+        compileWorldBefore = textadventuredemo.compileWorld
+        textadventuredemo.compileWorld = None # so the test fails if the world is compiled again
+        try:
+            cached = compileWorldCached(self.worldDict, self.objectsDict, self.cacheFile)
+        finally:
+            textadventuredemo.compileWorld = compileWorldBefore
+        self.assertSameWorld(cached, compiled)
+
+    def test_changing_the_dictionaries_makes_the_cache_again(self):
+        compileWorldCached(self.worldDict, self.objectsDict, self.cacheFile)
+        changed = copy.deepcopy(self.worldDict)
+        firstRoom = next(iter(changed))
+        changed[firstRoom][DESC] = 'A freshly painted room.'
+        recompiled = compileWorldCached(changed, self.objectsDict, self.cacheFile)
+        self.assertEqual(recompiled.rooms[0].desc, 'A freshly painted room.')
+        self.assertSameWorld(compileWorldCached(changed, self.objectsDict, self.cacheFile), recompiled)
+
+    def test_small_worlds_are_not_cached(self):
+        compiled = compileWorldCached(textadventuredemo.world, textadventuredemo.objects, self.cacheFile)
+        self.assertFalse(os.path.exists(self.cacheFile))
+        self.assertSameWorld(compiled, gameWorld)
+
+
+class StatsTests(unittest.TestCase):
+    def test_commands_are_counted(self):
+        stats = CommandStats()
+        stats.enable(TextAdventureCmd)
+        try:
+            play(TextAdventureCmd(GameSession(WorldState(gameWorld))), 'look', 'look', 'inventory')
+        finally:
+            stats.disable()
+        self.assertEqual(stats.handlers['do_look'].calls, 2)
+        self.assertEqual(stats.handlers['do_inventory'].calls, 1)
+        self.assertEqual(stats.handlers['onecmd'].calls, 3)
+        self.assertEqual(sorted(json.loads(stats.toJson())), ['do_inventory', 'do_look', 'onecmd'])
+
+    def test_disable_puts_the_methods_back(self):
+        table = dict(TextAdventureCmd.commandTable)
+        stats = CommandStats()
+        stats.enable(TextAdventureCmd)
+        self.assertTrue(hasattr(TextAdventureCmd.onecmd, '__wrapped__'))
+        stats.disable()
+        self.assertEqual(TextAdventureCmd.commandTable, table)
+        self.assertFalse(hasattr(TextAdventureCmd.onecmd, '__wrapped__'))
+
+    def test_subclass_commands_are_counted(self):
+        class QuietCmd(TextAdventureCmd):
+            def do_look(self, arg):
+                """Look around without seeing anything."""
+                self.response.say('Nothing to see.')
+
+        stats = CommandStats()
+        stats.enable(TextAdventureCmd)
+        try:
+            cmdObj = QuietCmd(GameSession(WorldState(gameWorld)), sink=MemorySink())
+            cmdObj.onecmd('look')
+            cmdObj.onecmd('inventory')
+        finally:
+            stats.disable()
+        self.assertEqual(stats.handlers['do_look'].calls, 1)
+        self.assertEqual(stats.handlers['do_inventory'].calls, 1)
+        self.assertEqual(stats.handlers['onecmd'].calls, 2)
+        self.assertIs(QuietCmd.commandTable['look'], QuietCmd.__dict__['do_look'])
+        self.assertFalse(hasattr(TextAdventureCmd.onecmd, '__wrapped__'))
+
+    def test_tracemalloc_is_left_as_it_was(self):
+        stats = CommandStats()
+        tracemalloc.start()
+        try:
+            stats.enable(TextAdventureCmd, traceAllocations=True)
+            stats.disable()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+        stats.enable(TextAdventureCmd, traceAllocations=True)
+        stats.disable()
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class CountingSink(MemorySink):
+    """A MemorySink that also counts its writes."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        super().write(text)
+
+
+class ResponseTests(unittest.TestCase):
+    def test_one_write_per_command(self):
+        sink = CountingSink()
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)), sink=sink)
+        for line in ['look', 'north', 'help', 'inventory']:
+            cmdObj.postcmd(cmdObj.onecmd(line), line)
+        self.assertEqual(sink.writes, 4)
+        self.assertIn('Town Square', sink.getvalue())
+        self.assertIn('Documented commands', sink.getvalue()) # help's output goes through the response too
+
+    def test_say_works_like_print(self):
+        response = Response(MemorySink())
+        response.say('a', 1, sep='-', end='!\n')
+        response.say()
+        response.send()
+        self.assertEqual(response.sink.take(), 'a-1!\n\n')
+
+    def test_encode_output(self):
+        self.assertEqual(encodeOutput('Town Square\n===\n'), b'Town Square\r\n===\r\n')
+        self.assertEqual(encodeOutput('caf\xe9\n', 'ascii'), b'caf?\r\n')
+
+
+class ShardTests(unittest.TestCase):
+    def test_partition_rooms(self):
+        shardOf = partitionRooms(gameWorld, 3)
+        self.assertEqual(len(shardOf), len(gameWorld.rooms))
+        self.assertEqual(set(shardOf), {0, 1, 2})
+        with self.assertRaises(ValueError):
+            partitionRooms(gameWorld, 0)
+
+    def test_player_is_handed_off_between_shards(self):
+        async def walk():
+            router = ShardRouter(shardCount=2)
+            router.start()
+            try:
+                start = gameWorld.roomId(textadventuredemo.startLocation)
+                destination = next(loc for loc in range(len(gameWorld.rooms))
+                                   if router.shardOf[loc] != router.shardOf[start])
+                playerId, text = await router.join()
+                for direction in gameWorld.router.path(start, destination):
+                    text, stop = await router.command(playerId, direction)
+                self.assertEqual(router.playerShards[playerId], router.shardOf[destination])
+                self.assertIn(gameWorld.rooms[destination].name, text)
+                self.assertGreater(router.handoffs, 0)
+                text, stop = await router.command(playerId, 'inventory')
+                self.assertIn('Donut', text) # the inventory comes along
+                text, stop = await router.command(playerId, 'quit')
+                self.assertTrue(stop)
+            finally:
+                router.stop()
+
+        asyncio.run(walk())
+
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.scheduler = Scheduler(clock=lambda: self.now)
+
+    def test_events_run_in_order(self):
+        ran = []
+        self.scheduler.schedule(2, ran.append, 'second')
+        self.scheduler.schedule(1, ran.append, 'first')
+        self.scheduler.schedule(2, ran.append, 'third') # due with "second", but added after it
+        self.assertEqual(self.scheduler.runDue(0.5), 0)
+        self.assertEqual(self.scheduler.runDue(5), 3)
+        self.assertEqual(ran, ['first', 'second', 'third'])
+
+    def test_every_and_cancel(self):
+        ran = []
+        event = self.scheduler.every(1, ran.append, 'tick')
+        self.scheduler.runDue(3.5)
+        self.assertEqual(len(ran), 3)
+        self.assertEqual(len(self.scheduler.events), 1) # the same event each time
+        self.scheduler.cancel(event)
+        self.scheduler.runDue(10)
+        self.assertEqual(len(ran), 3)
+        self.assertIsNone(self.scheduler.nextTime())
+
+    def test_every_stops_when_the_callback_returns_false(self):
+        ran = []
+        def callback():
+            ran.append(self.now)
+            return len(ran) < 2
+        self.scheduler.every(1, callback)
+        self.scheduler.runDue(10)
+        self.assertEqual(len(ran), 2)
+
+    def test_stopping_the_simulation_cancels_its_events(self):
+        state = WorldState(gameWorld)
+        startSimulation(state, self.scheduler)
+        self.assertTrue(state.simulationEvents)
+        self.assertIs(stopSimulation(state), self.scheduler)
+        self.assertIsNone(self.scheduler.nextTime())
+
+
+class BroadcastTests(unittest.TestCase):
+    def setUp(self):
+        self.state = WorldState(gameWorld)
+        self.heard = {}
+        self.players = [self.newPlayer('Alice'), self.newPlayer('Bob'), self.newPlayer('Carol')]
+
+    def newPlayer(self, name):
+        session = GameSession(self.state)
+        session.name = name
+        session.onNotify = lambda session, text: self.heard[session.name].append(text)
+        self.heard[name] = []
+        return TextAdventureCmd(session)
+
+    def test_only_the_players_in_the_room_hear(self):
+        alice, bob, carol = self.players
+        play(carol, 'north')
+        self.assertEqual(self.heard['Alice'], ['Carol leaves.'])
+        play(alice, 'drop donut')
+        self.assertEqual(self.heard['Bob'], ['Carol leaves.', 'Alice drops a donut.'])
+        self.assertEqual(self.heard['Carol'], [])
+        self.assertEqual(self.heard['Alice'], ['Carol leaves.'])
+        self.assertEqual(set(self.state.occupants[gameWorld.roomId('North Y Street')]), {carol.session})
+
+    def test_subscribers(self):
+        heard = []
+        listener = lambda loc, text: heard.append((loc, text))
+        loc = gameWorld.roomId('North Y Street')
+        self.state.subscribe(loc, listener)
+        play(self.players[0], 'north')
+        self.state.unsubscribe(loc, listener)
+        play(self.players[1], 'north')
+        self.assertEqual(heard, [(loc, 'Alice arrives.')])
+
+
+class NounPhraseTests(unittest.TestCase):
+    def test_words(self):
+        phrase = parseNounPhrase('the floating book')
+        self.assertEqual(phrase.words, ('floating', 'book'))
+        self.assertIsNone(phrase.quantity)
+        self.assertFalse(phrase.everything)
+
+    def test_quantities(self):
+        self.assertEqual(parseNounPhrase('3 donuts').quantity, 3)
+        self.assertEqual(parseNounPhrase('three donuts').quantity, 3)
+        self.assertEqual(parseNounPhrase('3 donuts').words, ('donuts',))
+        self.assertEqual(parseNounPhrase('99999 donuts').quantity, MAX_QUANTITY)
+        self.assertEqual(parseNounPhrase('9' * 1000 + ' donuts').quantity, MAX_QUANTITY)
+        self.assertIsNone(parseNounPhrase('0 donuts').quantity)
+        self.assertEqual(parseNounPhrase('0 donuts').words, ('0', 'donuts'))
+
+    def test_all(self):
+        phrase = parseNounPhrase('all donuts')
+        self.assertTrue(phrase.everything)
+        self.assertEqual(phrase.howMany(5), 5)
+        self.assertEqual(parseNounPhrase('2 donuts').howMany(5), 2)
+        self.assertEqual(parseNounPhrase('donut').howMany(5), 1)
+
+    def test_prepositions(self):
+        phrase = parseNounPhrase('sword from the anvil')
+        self.assertEqual(phrase.words, ('sword',))
+        self.assertEqual(phrase.preposition, 'from')
+        self.assertEqual(phrase.indirect, ('anvil',))
+        self.assertEqual(parseNounPhrase('in').words, ('in',)) # there is nothing before it
+
+    def test_punctuation(self):
+        self.assertEqual(parseNounPhrase('donut!').words, ('donut',))
+
+    def test_synonyms(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        play(cmdObj, 'put down the donut', 'walk north')
+        self.assertNotIn(gameWorld.itemId('Donut'), cmdObj.session.inventory)
+        self.assertEqual(cmdObj.session.location, gameWorld.roomId('North Y Street'))
+        play(cmdObj, 'go to town square', 'pick up the donut')
+        self.assertIn(gameWorld.itemId('Donut'), cmdObj.session.inventory)
+
+    def test_take_and_drop_all(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        carried = sorted(cmdObj.session.inventory.items())
+        loc = cmdObj.session.location
+        output = play(cmdObj, 'drop all')
+        self.assertIn('You drop', output)
+        self.assertEqual(len(cmdObj.session.inventory), 0)
+        self.assertIn('You are not carrying anything.', play(cmdObj, 'drop all'))
+
+        output = play(cmdObj, 'take all')
+        self.assertEqual(sorted(cmdObj.session.inventory.items()), carried)
+        ground = cmdObj.session.state.ground(loc)
+        self.assertTrue(all(not gameWorld.items[item].takeable for item in ground.distinct())) # those are left behind
+        self.assertIn('There is nothing here you can take.', play(cmdObj, 'take all'))
+        play(cmdObj, 'take all donuts') # "all" with an item still means all of that item
+        self.assertEqual(sorted(cmdObj.session.inventory.items()), carried)
+
+
+class ValidateWorldTests(unittest.TestCase):
+    def setUp(self):
+        self.worldDict = copy.deepcopy(textadventuredemo.world)
+        self.objectsDict = copy.deepcopy(textadventuredemo.objects)
+
+    def test_the_built_in_world_has_no_errors(self):
+        report = validateWorld(self.worldDict, self.objectsDict)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['rooms'], len(gameWorld.rooms))
+
+    def test_problems_are_found(self):
+        self.worldDict['Bakery'][GROUND].append('Doughnut')
+        self.worldDict['Town Square'][NORTH] = 'North Why Street'
+        self.worldDict['Broom Closet'] = {DESC: 'A small closet.', GROUND: [], UP: 'Town Square'}
+        report = validateWorld(self.worldDict, self.objectsDict)
+        self.assertEqual(report['counts'], {'bad-item': 1, 'bad-exit': 1, 'one-way-exit': 2, 'unreachable': 1})
+        self.assertEqual(report['errors'], 2)
+        self.assertIn({'check': 'bad-item', 'severity': 'error', 'room': 'Bakery', 'list': GROUND, 'item': 'Doughnut'},
+                      report['problems'])
+        json.dumps(report) # the report can be written out as JSON
+
+    def test_compile_errors_are_summarized(self):
+        del self.objectsDict['Donut'][DESCWORDS]
+        with self.assertRaises(ValueError) as raised:
+            compileWorld(self.worldDict, self.objectsDict)
+        self.assertIn('1 error(s)', str(raised.exception))
+        self.assertIn('missing-key', str(raised.exception))
+
+
+class RecordingTests(GameTestCase):
+    def test_record_and_replay(self):
+        filename = os.path.join(self.directory, 'test.rec')
+        self.cmdObj.recorder = SessionRecorder(filename, gameWorld, TextAdventureCmd)
+        self.play(['look', 'nroth', 'xyzzy plugh'] + self.commands)
+        self.cmdObj.recorder.close()
+        session, replayed, playTime = replayRecording(filename)
+        self.assertEqual(replayed, len(self.commands) + 3)
+        self.assertEqual(playerState(session), playerState(self.cmdObj.session))
+
+    def test_replay_part_of_a_recording(self):
+        filename = os.path.join(self.directory, 'test.rec')
+        self.cmdObj.recorder = SessionRecorder(filename, gameWorld, TextAdventureCmd)
+        self.play(['drop donut', 'north'])
+        self.cmdObj.recorder.close()
+        session, replayed, playTime = replayRecording(filename, limit=1)
+        self.assertEqual(replayed, 1)
+        self.assertEqual(session.location, gameWorld.roomId('Town Square'))
+
+    def test_cut_short_and_bad_recordings(self):
+        filename = os.path.join(self.directory, 'test.rec')
+        self.cmdObj.recorder = SessionRecorder(filename, gameWorld, TextAdventureCmd)
+        self.play(['north', 'save somewhere'])
+        self.cmdObj.recorder.close()
+        with open(filename, 'rb') as recordingFile:
+            data = recordingFile.read()
+        with open(filename, 'wb') as recordingFile:
+            recordingFile.write(data[:-3]) # in the middle of "somewhere"
+        self.assertEqual(len(readRecording(filename, gameWorld)[2]), 1)
+        with open(filename, 'wb') as recordingFile:
+            recordingFile.write(data + bytes([0, 0x7F, 0])) # a verb ID that doesn't exist
+        with self.assertRaises(ValueError):
+            readRecording(filename, gameWorld)
+
+    def test_existing_recordings_are_kept(self):
+        filename = os.path.join(self.directory, 'test.rec')
+        SessionRecorder(filename, gameWorld, TextAdventureCmd).close()
+        with self.assertRaises(FileExistsError):
+            SessionRecorder(filename, gameWorld, TextAdventureCmd, overwrite=False)
+
+    def test_replaying_uses_the_recorded_command_class(self):
+        self.play(['north', 'save here'])
+        filename = os.path.join(self.directory, 'test.rec')
+        player = SharedWorldCmd(GameSession(WorldState(gameWorld)), sink=MemorySink())
+        player.recorder = SessionRecorder(filename, gameWorld, SharedWorldCmd)
+        play(player, 'drop donut', 'restore here', 'east')
+        player.recorder.close()
+        self.assertIs(readRecording(filename, gameWorld)[0], SharedWorldCmd)
+        session, replayed, playTime = replayRecording(filename)
+        self.assertEqual(playerState(session), playerState(player.session)) # "restore" did nothing here either
+
+    def test_batch_with_events_round_trip(self):
+        script = os.path.join(self.directory, 'script.txt')
+        filename = os.path.join(self.directory, 'test.rec')
+        with open(script, 'w') as scriptFile:
+            scriptFile.write('goto bakery\nbuy 5 bagels\ninventory\n')
+        transcript = subprocess.run([sys.executable, textadventuredemo.__file__, '--batch', script, '--events',
+                                     '--record', filename], capture_output=True, text=True, check=True).stdout
+        self.assertIn('Bagel (%s)' % (SHOP_STOCK), transcript) # the bakery ran out
+        cmdClass, simulated, commands = readRecording(filename, gameWorld)
+        self.assertTrue(simulated)
+        session, replayed, playTime = replayRecording(filename)
+        self.assertEqual(replayed, 3)
+        self.assertIsNotNone(session.state.scheduler)
+        self.assertEqual(session.inventory.count(gameWorld.itemId('Bagel')), SHOP_STOCK)
+
+
+class VarintTests(unittest.TestCase):
+    def test_round_trip(self):
+        numbers = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 32, 2 ** 63]
+        data = bytearray()
+        for number in numbers:
+            packVarint(number, data)
+        offset = 0
+        for number in numbers:
+            unpacked, offset = unpackVarint(data, offset)
+            self.assertEqual(unpacked, number)
+        self.assertEqual(offset, len(data))
+
+    def test_small_numbers_take_one_byte(self):
+        data = bytearray()
+        packVarint(127, data)
+        self.assertEqual(len(data), 1)
+
+    def test_cut_short(self):
+        data = bytearray()
+        packVarint(300, data)
+        with self.assertRaises(IndexError):
+            unpackVarint(data[:1], 0)
+
+
+class EconomyTests(unittest.TestCase):
+    def trade(self, economies, ticks=200, seed=0):
+        """Makes the same random trades in each economy, ticking them all
+        after each batch."""
+        rng = random.Random(seed)
+        pairs = list(economies[0].pairIds)
+        for _ in range(ticks):
+            for _ in range(rng.randrange(4)):
+                loc, item = rng.choice(pairs)
+                change = rng.randint(-8, 5)
+                for economy in economies:
+                    economy.trade(loc, item, change)
+            for economy in economies:
+                economy.tick()
+        return pairs
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_and_array_prices_agree(self):
+        vectorized = Economy(gameWorld, useNumpy=True)
+        lazy = Economy(gameWorld, useNumpy=False)
+        self.assertIsNotNone(vectorized.numpy)
+        self.assertIsNone(lazy.numpy)
+        pairs = self.trade([vectorized, lazy])
+        for i in range(len(pairs)):
+            self.assertAlmostEqual(vectorized.currentPrice(i), lazy.currentPrice(i), places=9)
+        for loc, item in pairs:
+            self.assertEqual(vectorized.price(loc, item), lazy.price(loc, item))
+
+    def test_untraded_prices_drift_back(self):
+        economy = Economy(gameWorld, useNumpy=False)
+        (loc, item), = list(economy.pairIds)[:1]
+        usual = economy.currentPrice(0)
+        economy.trade(loc, item, -SHOP_STOCK)
+        economy.tick()
+        self.assertGreater(economy.currentPrice(0), usual)
+        for _ in range(500):
+            economy.tick()
+        self.assertAlmostEqual(economy.currentPrice(0), usual)
+
+    def test_selling_pays_less_than_buying_anywhere(self):
+        state = WorldState(gameWorld)
+        state.economy = Economy(gameWorld)
+        pairs = self.trade([state.economy], seed=1)
+        for loc, item in pairs:
+            for shop, _ in pairs:
+                self.assertLess(state.sellPrice(shop, item), state.price(loc, item))
+
+    def test_buying_and_selling_use_the_prices(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        session = cmdObj.session
+        play(cmdObj, 'north', 'west', 'south', 'west') # to the Used Anvils Store
+        anvil = gameWorld.itemId('Anvil')
+        price = session.state.price(session.location, anvil)
+        play(cmdObj, 'buy anvil')
+        self.assertEqual(session.money, START_MONEY - price)
+        play(cmdObj, 'sell anvil')
+        self.assertEqual(session.money, START_MONEY - price + session.state.sellPrice(session.location, anvil))
+        self.assertNotIn(anvil, session.inventory)
+
+
+class SearchTests(unittest.TestCase):
+    def test_search(self):
+        index = getSearchIndex(gameWorld)
+        self.assertIs(getSearchIndex(gameWorld), index)
+        score, document = index.search('donut')[0]
+        self.assertEqual(document, index.roomCount + gameWorld.itemId('Donut'))
+        self.assertEqual(index.search('xyzzy'), [])
+        self.assertEqual(index.search('donuts')[0][1], document)
+
+    def test_where_follows_the_ground(self):
+        state = WorldState(gameWorld)
+        alice = TextAdventureCmd(GameSession(state))
+        bob = TextAdventureCmd(GameSession(state))
+        donut = gameWorld.itemId('Donut')
+        before, total = state.roomsWithItem(donut, 100) # builds the GroundIndex
+        play(alice, 'drop donut')
+        rooms, newTotal = state.roomsWithItem(donut, 100)
+        self.assertEqual(sorted(rooms), sorted(before + [gameWorld.roomId('Town Square')]))
+        self.assertEqual(newTotal, total + 1)
+        self.assertEqual(state.roomsWithItem(donut, 1)[1], total + 1) # counted, even past the limit
+        self.assertIn('on the ground at Town Square', play(bob, 'where donut'))
+        play(bob, 'take donut')
+        self.assertEqual(state.roomsWithItem(donut, 100), (before, total))
+        self.assertIn('in your inventory', play(bob, 'where donut'))
+
+    def test_where_only_shows_the_ground_a_shard_keeps(self):
+        state = WorldState(gameWorld)
+        store = gameWorld.roomId('Used Anvils Store')
+        state.ownsRoom = lambda loc: loc != store # as if the store were in another shard
+        anvil = gameWorld.itemId('Anvil')
+        self.assertEqual(state.roomsWithItem(anvil, 100), ([gameWorld.roomId('Blacksmith')], 1))
+        text = play(TextAdventureCmd(GameSession(state)), 'where anvil')
+        self.assertIn('on the ground at Blacksmith;', text)
+        self.assertIn('Only the ground in this part of the world', text)
+
+
+class EditDistanceTests(unittest.TestCase):
+    def test_same_word(self):
+        self.assertEqual(editDistance('donut', 'donut', 2), 0)
+
+    def test_one_letter_changed_added_or_removed(self):
+        self.assertEqual(editDistance('donut', 'dobut', 2), 1)
+        self.assertEqual(editDistance('donut', 'donnut', 2), 1)
+        self.assertEqual(editDistance('donut', 'dont', 2), 1)
+
+    def test_swapped_letters_are_one_typo(self):
+        self.assertEqual(editDistance('nroth', 'north', 2), 1)
+        self.assertEqual(editDistance('ab', 'ba', 2), 1)
+        self.assertEqual(editDistance('sowrd', 'sword', 2), 1)
+
+    def test_several_typos(self):
+        self.assertEqual(editDistance('sotuh', 'south', 2), 1)
+        self.assertEqual(editDistance('donut', 'dnt', 2), 2)
+        self.assertEqual(editDistance('', 'ab', 2), 2)
+
+    def test_more_than_the_limit(self):
+        self.assertEqual(editDistance('kitten', 'sitting', 2), 3) # really 3, which is limit + 1
+        self.assertEqual(editDistance('kitten', 'sitting', 1), 2)
+        self.assertEqual(editDistance('a', 'abcdefgh', 2), 3)
+
+
+class FuzzyIndexTests(unittest.TestCase):
+    def test_lookup(self):
+        fuzzy = FuzzyIndex(['donut', 'sword', 'book'])
+        self.assertEqual(fuzzy.lookup('donnut'), [(1, 'donut')])
+        self.assertEqual(fuzzy.lookup('swrod'), [(1, 'sword')])
+        self.assertEqual(fuzzy.lookup('donut'), [(0, 'donut')])
+        self.assertEqual(fuzzy.lookup('anvil'), [])
+
+    def test_short_words_are_not_corrected(self):
+        fuzzy = FuzzyIndex(['up'])
+        self.assertEqual(fuzzy.lookup('us'), [])
+
+    def test_vocabulary(self):
+        fuzzy = FuzzyIndex(['donut', 'donuts'])
+        self.assertEqual(fuzzy.lookup('donutt', vocabulary={'donut': None}), [(1, 'donut')])
+
+    def test_add_and_remove(self):
+        fuzzy = FuzzyIndex(['donut'])
+        fuzzy.add('sword')
+        self.assertEqual(fuzzy.lookup('sowrd'), [(1, 'sword')])
+        fuzzy.remove('sword')
+        self.assertEqual(fuzzy.lookup('sowrd'), [])
+        fuzzy.remove('donut')
+        self.assertEqual(fuzzy.deletes, {})
+
+    def test_long_typos_are_not_looked_up(self):
+        fuzzy = FuzzyIndex(['donut'])
+        self.assertEqual(fuzzy.lookup('x' * 1000), [])
+        fuzzy.add('y' * 1000) # too long to index
+        self.assertNotIn('y' * 1000, fuzzy.words)
+
+    def test_ambiguous_corrections(self):
+        self.assertEqual(correctDirection('est'), ['east', 'west'])
+        self.assertEqual(closestWords(FuzzyIndex(['bat', 'cat']), 'hat'), ['bat', 'cat'])
+        self.assertEqual(correctDirection('nroth'), ['north'])
+        self.assertEqual(correctDirection('x' * 1000), [])
+
+    def test_typos_are_corrected(self):
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld)))
+        self.assertIn('North Y Street', play(cmdObj, 'nroth'))
+        self.assertEqual(cmdObj.session.location, gameWorld.roomId('North Y Street'))
+        play(cmdObj, 'drop dnout')
+        self.assertNotIn(gameWorld.itemId('Donut'), cmdObj.session.inventory)
+
+
+class RouterTests(unittest.TestCase):
+    def test_changed_exits_keep_routes_shortest(self):
+        world = textadventuredemo.compileWorld(textadventuredemo.world, textadventuredemo.objects)
+        world.router.precompute()
+        rng = random.Random(0)
+        rooms = range(len(world.rooms))
+        for _ in range(200):
+            destination = rng.choice([NO_EXIT, rng.choice(rooms)])
+            setExit(world, rng.choice(rooms), rng.choice(EXIT_DIRECTIONS), destination)
+            fresh = Router(world)
+            for start in rooms:
+                for end in rooms:
+                    kept = world.router.path(start, end)
+                    made = fresh.path(start, end)
+                    self.assertEqual(kept is None, made is None)
+                    if kept is not None:
+                        self.assertEqual(len(kept), len(made))
+
+    def test_unaffected_tables_are_kept(self):
+        world = textadventuredemo.compileWorld(textadventuredemo.world, textadventuredemo.objects)
+        world.router.precompute()
+        tables = len(world.router.tables)
+        # a second exit to the same room doesn't make any way shorter
+        loc = world.roomId('Town Square')
+        exits = world.roomExits(loc)
+        neighbour = next(to for to in exits if to != NO_EXIT)
+        setExit(world, loc, EXIT_DIRECTIONS[exits.index(NO_EXIT)], neighbour)
+        self.assertEqual(len(world.router.tables), tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,433 @@
+#! python3
+"""
+Text Adventure Demo Benchmarks
+
+This program makes up game worlds of any size and times how long every
+do_*() command and complete_*() tab completion method takes in them, so you
+can see how the game slows down (or doesn't) as worlds get bigger.
+
+generateWorld() makes world and objects dictionaries laid out just like the
+ones in textadventuredemo.py, from a random seed so that the same seed always
+makes the same world. You can choose how many rooms there are, how many exits
+each room has on average (the "branching factor"), how many items are on the
+ground in each room, and how many items the player carries.
+
+To time the commands in worlds of 100, 1,000 and 10,000 rooms:
+
+    python textadventurebench.py --sizes 100 1000 10000
+
+The timings can be saved as a baseline, and later runs compared against it.
+Any command that got slower than the threshold (by default, 1.5 times as
+slow) is reported, and the program exits with exit code 1:
+
+    python textadventurebench.py --save-baseline baseline.json
+    python textadventurebench.py --compare baseline.json
+
+Besides the timings, world_bytes_per_room is how much memory the compiled
+world takes up for each room, in bytes rather than microseconds. It is
+compared against the baseline the same way, so a change that makes worlds
+bigger is reported too.
+"""
+
+import argparse, json, os, random, sys, tempfile, time
+
+import textadventuredemo
+from textadventuredemo import (DESC, NORTH, SOUTH, EAST, WEST, UP, DOWN, GROUND, SHOP, GROUNDDESC,
+                               SHORTDESC, LONGDESC, TAKEABLE, EDIBLE, DESCWORDS, EXIT_DIRECTIONS,
+                               GameSession, TextAdventureCmd, WorldState)
+
+OPPOSITE_DIRECTIONS = {NORTH: SOUTH, SOUTH: NORTH, EAST: WEST, WEST: EAST, UP: DOWN, DOWN: UP}
+
+"""
+Words for making up item names and descriptions. Each kind of item is an
+adjective and a noun, such as "Rusty Lantern", with the desc words
+['lantern', 'rusty'].
+"""
+ADJECTIVES = ['rusty', 'shiny', 'ancient', 'cursed', 'wooden', 'golden', 'tiny', 'enormous', 'glowing',
+              'dusty', 'broken', 'royal', 'sticky', 'frozen', 'smelly', 'velvet', 'iron', 'crystal',
+              'silver', 'bronze', 'painted', 'hollow', 'heavy', 'fragile', 'lucky']
+NOUNS = ['lantern', 'helmet', 'goblet', 'scroll', 'boot', 'candle', 'shield', 'spoon', 'map', 'key',
+         'lute', 'mirror', 'dagger', 'pebble', 'rope', 'compass', 'bell', 'whistle', 'feather', 'skull']
+FOODS = ['apple', 'muffin', 'turnip', 'cheese', 'sausage', 'pretzel', 'plum', 'biscuit', 'pickle', 'cake']
+SENTENCE_WORDS = ['the', 'old', 'walls', 'are', 'covered', 'in', 'moss', 'and', 'a', 'cold', 'wind', 'blows',
+                  'through', 'cracks', 'torches', 'flicker', 'somewhere', 'water', 'drips', 'slowly', 'onto',
+                  'stone', 'floor', 'you', 'hear', 'distant', 'singing', 'smell', 'bread', 'dust', 'lies',
+                  'thick', 'everywhere', 'strange', 'carvings', 'decorate', 'ceiling']
+
+def makeSentences(rng, wordCount):
+    words = [rng.choice(SENTENCE_WORDS) for i in range(wordCount)]
+    sentences = []
+    for i in range(0, wordCount, 8):
+        sentence = ' '.join(words[i:i + 8])
+        sentences.append(sentence[0].upper() + sentence[1:] + '.')
+    return ' '.join(sentences)
+
+
+def generateObjects(rng, kinds):
+    """Returns an objects dictionary with kinds kinds of items. About a
+    quarter of them are edible and a fifth can't be taken."""
+    objectsDict = {}
+    while len(objectsDict) < kinds:
+        if rng.random() < 0.25:
+            adjective, noun, edible = rng.choice(ADJECTIVES), rng.choice(FOODS), True
+        else:
+            adjective, noun, edible = rng.choice(ADJECTIVES), rng.choice(NOUNS), False
+        name = '%s %s' % (adjective.title(), noun.title())
+        if name in objectsDict:
+            # there are only so many adjective/noun pairs, so number the rest
+            name = '%s %s' % (name, len(objectsDict))
+        objectsDict[name] = {
+            GROUNDDESC: 'A %s %s lies here.' % (adjective, noun),
+            SHORTDESC: 'a %s %s' % (adjective, noun),
+            LONGDESC: makeSentences(rng, 20),
+            TAKEABLE: rng.random() >= 0.2,
+            EDIBLE: edible,
+            DESCWORDS: [noun, adjective]}
+    return objectsDict
+
+
+def generateWorld(seed=0, roomCount=1000, branching=3, itemsPerRoom=3, itemKinds=200, shopFraction=0.05):
+    """Returns (world, objects, startLocation) for a randomly made world.
+
+    Every room can be reached from every other room: each new room is joined
+    to a room made before it, and then extra exits are added at random until
+    the rooms have branching exits each on average. All exits go both ways
+    (if north leads from A to B, south leads from B to A). Room 0 is always a
+    shop with at least one takeable item on the ground, so that every command
+    has something to work with there."""
+    rng = random.Random(seed)
+    objectsDict = generateObjects(rng, itemKinds)
+    itemNames = list(objectsDict)
+    takeableNames = [name for name in itemNames if objectsDict[name][TAKEABLE]]
+
+    names = ['Room %s' % (i) for i in range(roomCount)]
+    worldDict = {}
+    for i, name in enumerate(names):
+        ground = [rng.choice(itemNames) for j in range(itemsPerRoom)]
+        worldDict[name] = {DESC: makeSentences(rng, rng.randint(20, 60)), GROUND: ground}
+        if i == 0 or rng.random() < shopFraction:
+            worldDict[name][SHOP] = rng.sample(itemNames, min(len(itemNames), 5))
+    worldDict[names[0]][GROUND].append(rng.choice(takeableNames))
+
+    def connect(a, b):
+        freeDirections = [direction for direction in EXIT_DIRECTIONS
+                          if direction not in worldDict[names[a]] and OPPOSITE_DIRECTIONS[direction] not in worldDict[names[b]]]
+        if a == b or not freeDirections:
+            return False
+        direction = rng.choice(freeDirections)
+        worldDict[names[a]][direction] = names[b]
+        worldDict[names[b]][OPPOSITE_DIRECTIONS[direction]] = names[a]
+        return True
+
+    exitCount = 0
+    for i in range(1, roomCount):
+        # join room i to an earlier room that still has a free direction
+        while not connect(i, rng.randrange(i)):
+            pass
+        exitCount += 2
+    attempts = 0
+    while exitCount < branching * roomCount and attempts < 10 * branching * roomCount:
+        attempts += 1
+        if connect(rng.randrange(roomCount), rng.randrange(roomCount)):
+            exitCount += 2
+
+    return worldDict, objectsDict, names[0]
+
+
+"""
+The benchmarks. Each command is run over and over in the starting room with
+an argument that makes it do real work (such as taking an item that is really
+there). Commands that change the game are undone after each run, without
+timing the undo, so that every run starts from the same place.
+"""
+MIN_BENCHMARK_SECONDS = 0.05 # run each command for at least this long
+MAX_BENCHMARK_RUNS = 100000
+
+def uniqueWord(bag, item):
+    """Returns a desc word for item that describes no other item in bag, so
+    that a command using it is sure to pick item."""
+    descWords = bag.itemTable[item].descWords
+    for descWord in descWords:
+        if len(bag.descIndex.words.get(descWord, ())) == 1:
+            return descWord
+    return descWords[0]
+
+
+class BenchmarkContext:
+    """The items, words and places the benchmarks use, picked from the
+    world around the player."""
+
+    def __init__(self, cmdObj):
+        session = cmdObj.session
+        world = session.state.baseWorld
+        room = world.rooms[session.location]
+        ground = session.state.ground(session.location)
+        self.start = session.location
+        self.takeItem = next(item for item in ground.distinct() if world.items[item].takeable)
+        self.takeWord = uniqueWord(ground, self.takeItem)
+        self.lookWord = world.items[next(iter(ground.distinct()))].descWords[0]
+        self.buyItem = next(iter(room.shop.distinct()))
+        self.buyWord = uniqueWord(room.shop, self.buyItem)
+        self.dropItem = next(iter(session.inventory.distinct()))
+        self.dropWord = uniqueWord(session.inventory, self.dropItem)
+        self.eatItem = next(item for item in session.inventory.distinct() if world.items[item].edible)
+        self.eatWord = uniqueWord(session.inventory, self.eatItem)
+        self.direction = next(direction for direction in EXIT_DIRECTIONS if room.exit(direction) != textadventuredemo.NO_EXIT)
+        self.farRoom = world.rooms[len(world.rooms) - 1].name # made last, so usually far from room 0
+        self.money = session.money
+
+
+def resetLocation(cmdObj, c):
+    cmdObj.session.state.moveSession(cmdObj.session, c.start)
+
+def untake(cmdObj, c):
+    cmdObj.session.inventory.remove(c.takeItem)
+    cmdObj.session.state.groundForUpdate(c.start).add(c.takeItem)
+
+def undrop(cmdObj, c):
+    cmdObj.session.state.groundForUpdate(c.start).remove(c.dropItem)
+    cmdObj.session.inventory.add(c.dropItem)
+
+def unbuy(cmdObj, c):
+    cmdObj.session.inventory.remove(c.buyItem)
+    cmdObj.session.money = c.money
+
+def unsell(cmdObj, c):
+    cmdObj.session.inventory.add(c.dropItem)
+    cmdObj.session.money = c.money
+
+"""
+For each command: a function returning its argument, and a function that
+undoes what the command did (or None if it doesn't change anything).
+"""
+COMMAND_BENCHMARKS = {
+    'move':      (lambda c: c.direction, resetLocation),
+    'north':     (lambda c: '', resetLocation),
+    'south':     (lambda c: '', resetLocation),
+    'east':      (lambda c: '', resetLocation),
+    'west':      (lambda c: '', resetLocation),
+    'up':        (lambda c: '', resetLocation),
+    'down':      (lambda c: '', resetLocation),
+    'goto':      (lambda c: c.farRoom, resetLocation),
+    'look':      (lambda c: '', None),
+    'inventory': (lambda c: '', None),
+    'list':      (lambda c: 'full', None),
+    'exits':     (lambda c: '', None), # just toggles a setting
+    'take':      (lambda c: c.takeWord, untake),
+    'drop':      (lambda c: c.dropWord, undrop),
+    'buy':       (lambda c: c.buyWord, unbuy),
+    'sell':      (lambda c: c.dropWord, unsell),
+    'search':    (lambda c: c.lookWord, None),
+    'where':     (lambda c: c.takeWord, None),
+    'eat':       (lambda c: c.eatWord, lambda cmdObj, c: cmdObj.session.inventory.add(c.eatItem)),
+    'help':      (lambda c: '', None),
+    'stats':     (lambda c: '', None), # just a message unless stats are enabled
+    'save':      (lambda c: 'benchmark', None),
+    'restore':   (lambda c: 'benchmark', None),
+    'quit':      (lambda c: '', None),
+    }
+
+"""
+For each complete_*() method: the text typed so far, as a function of the
+BenchmarkContext. A one-letter prefix matches as many words as possible.
+"""
+COMPLETE_BENCHMARKS = {
+    'move': lambda c: c.direction[0],
+    'look': lambda c: c.lookWord[0],
+    'take': lambda c: c.takeWord[0],
+    'drop': lambda c: c.dropWord[0],
+    'buy':  lambda c: c.buyWord[0],
+    'sell': lambda c: c.dropWord[0],
+    'eat':  lambda c: c.eatWord[0],
+    'where': lambda c: c.takeWord[0],
+    'goto': lambda c: c.farRoom[:6].lower(),
+    }
+
+
+class NullOutput:
+    """A sink that throws away everything written to it, so that the
+    benchmarks time making the output but not storing it."""
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def timeCall(call, undo):
+    """Returns the average seconds call() takes, running undo() (untimed)
+    after each call if it isn't None. call() is run once first without
+    timing it, so that one-time work like filling caches isn't counted."""
+    call()
+    if undo is not None:
+        undo()
+    runs = 0
+    total = 0.0
+    while total < MIN_BENCHMARK_SECONDS and runs < MAX_BENCHMARK_RUNS:
+        start = time.perf_counter()
+        call()
+        total += time.perf_counter() - start
+        runs += 1
+        if undo is not None:
+            undo()
+    return total / runs
+
+
+def compileWorldMeasured(worldDict, objectsDict):
+    """Returns (the compiled world, how many bytes of memory it takes up).
+    tracemalloc only runs while the world is compiled, since it slows down
+    everything else."""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        gameWorld = textadventuredemo.compileWorld(worldDict, objectsDict)
+        return gameWorld, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmarkWorld(gameWorld, startLocation, inventorySize, seed=0):
+    """Returns a dictionary of each command's (and complete_*() method's)
+    average time in microseconds, in the world gameWorld."""
+    textadventuredemo.useWorld(gameWorld)
+    rng = random.Random(seed)
+    inventory = [rng.randrange(len(gameWorld.items)) for i in range(inventorySize)]
+    edible = [item.id for item in gameWorld.items if item.edible]
+    if edible:
+        inventory.append(edible[0])
+    results = {}
+    saveDirectory = textadventuredemo.SAVE_DIRECTORY
+    with tempfile.TemporaryDirectory() as tempDirectory:
+        textadventuredemo.SAVE_DIRECTORY = tempDirectory
+        cmdObj = TextAdventureCmd(GameSession(WorldState(gameWorld), gameWorld.roomId(startLocation), inventory),
+                                  sink=NullOutput())
+        context = BenchmarkContext(cmdObj)
+        try:
+            for name in sorted(TextAdventureCmd.commandTable):
+                if name not in COMMAND_BENCHMARKS:
+                    continue # an alias or abbreviation
+                getArgs, undo = COMMAND_BENCHMARKS[name]
+                args = getArgs(context)
+                if name == 'restore':
+                    cmdObj.dispatch('save', args)
+                results['do_' + name] = timeCall(lambda: (cmdObj.dispatch(name, args), cmdObj.response.send()),
+                                                 undo and (lambda: undo(cmdObj, context))) * 1000000
+
+            for name, getText in sorted(COMPLETE_BENCHMARKS.items()):
+                text = getText(context)
+                line = '%s %s' % (name, text)
+                method = getattr(cmdObj, 'complete_' + name)
+                results['complete_' + name] = timeCall(lambda: method(text, line, len(line) - len(text), len(line)), None) * 1000000
+
+            # taking an item whose desc word has a typo in it (a letter
+            # typed twice), which has to go through the FuzzyIndex
+            typo = context.takeWord[:2] + context.takeWord[1:]
+            results['fuzzy_take'] = timeCall(lambda: (cmdObj.dispatch('take', typo), cmdObj.response.send()),
+                                             lambda: untake(cmdObj, context)) * 1000000
+
+            # the simulation: with an event waiting for every room, the time
+            # to run the next event (which schedules itself again)
+            clock = [0.0]
+            scheduler = textadventuredemo.Scheduler(clock=lambda: clock[0])
+            def wander():
+                scheduler.schedule(rng.random() * 60, wander)
+            for loc in range(len(gameWorld.rooms)):
+                scheduler.schedule(rng.random() * 60, wander)
+            def tick():
+                clock[0] = scheduler.nextTime()
+                scheduler.runDue()
+            results['scheduler_event'] = timeCall(tick, None) * 1000000
+
+            # repricing every item in every shop, with a trade in each shop
+            economy = textadventuredemo.Economy(gameWorld)
+            def trade():
+                for loc, item in economy.pairIds:
+                    economy.trade(loc, item, -1)
+            results['economy_tick'] = timeCall(economy.tick, trade) * 1000000
+
+            # the same without NumPy, where only the traded prices are
+            # worked out, with a trade in a few shops
+            economy = textadventuredemo.Economy(gameWorld, useNumpy=False)
+            tradedPairs = list(economy.pairIds)[:10]
+            def tradeFew():
+                for loc, item in tradedPairs:
+                    economy.trade(loc, item, -1)
+            results['economy_tick_array'] = timeCall(economy.tick, tradeFew) * 1000000
+        finally:
+            textadventuredemo.SAVE_DIRECTORY = saveDirectory
+            if cmdObj.session.journal is not None:
+                cmdObj.session.journal.close()
+    return results
+
+
+def runBenchmarks(sizes, branching=3, itemsPerRoom=3, inventorySize=20, seed=0, useWorldFile=False):
+    """Returns {room count: {benchmark name: microseconds}} for worlds of each
+    size in sizes. If useWorldFile is True, each world is written to a world
+    file and played through a MappedWorld."""
+    allResults = {}
+    for size in sizes:
+        worldDict, objectsDict, startLocation = generateWorld(seed, size, branching, itemsPerRoom)
+        if useWorldFile:
+            with tempfile.TemporaryDirectory() as tempDirectory:
+                filename = os.path.join(tempDirectory, 'world.taw')
+                textadventuredemo.writeWorldFile(filename, worldDict, objectsDict)
+                del worldDict, objectsDict
+                results = benchmarkWorld(textadventuredemo.openWorldFile(filename), startLocation, inventorySize, seed)
+        else:
+            gameWorld, worldBytes = compileWorldMeasured(worldDict, objectsDict)
+            del worldDict, objectsDict
+            results = benchmarkWorld(gameWorld, startLocation, inventorySize, seed)
+            results['world_bytes_per_room'] = worldBytes / size
+        allResults[str(size)] = results
+        print('finished %s rooms' % (size), file=sys.stderr)
+    return allResults
+
+
+def printResults(allResults):
+    sizes = list(allResults)
+    names = sorted({name for results in allResults.values() for name in results})
+    print('%-18s' % ('microseconds') + ''.join('%14s' % ('%s rooms' % (size)) for size in sizes))
+    for name in names:
+        print('%-18s' % (name) + ''.join('%14.2f' % (allResults[size].get(name, float('nan'))) for size in sizes))
+
+
+def compareResults(allResults, baseline, threshold):
+    """Returns a list of (size, benchmark name, baseline time, new time) for
+    the benchmarks that are more than threshold times slower than baseline."""
+    regressions = []
+    for size, results in allResults.items():
+        for name, microseconds in results.items():
+            old = baseline.get(size, {}).get(name)
+            if old is not None and microseconds > old * threshold:
+                regressions.append((size, name, old, microseconds))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Text Adventure Demo Benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='room counts of the worlds to time')
+    parser.add_argument('--branching', type=int, default=3, help='average number of exits per room')
+    parser.add_argument('--items-per-room', type=int, default=3)
+    parser.add_argument('--inventory', type=int, default=20, help='how many items the player carries')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--world-file', action='store_true', help='play each world from a memory-mapped world file')
+    parser.add_argument('--save-baseline', metavar='FILE', help='save the timings to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='report benchmarks that are slower than the timings in FILE')
+    parser.add_argument('--threshold', type=float, default=1.5, help='how many times slower counts as a regression')
+    args = parser.parse_args()
+
+    allResults = runBenchmarks(args.sizes, args.branching, args.items_per_room, args.inventory, args.seed, args.world_file)
+    printResults(allResults)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baselineFile:
+            json.dump(allResults, baselineFile, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            regressions = compareResults(allResults, json.load(baselineFile), args.threshold)
+        for size, name, old, new in regressions:
+            unit = 'bytes' if name == 'world_bytes_per_room' else 'us'
+            print('REGRESSION: %s in %s rooms was %.2f %s (baseline %.2f %s)' % (name, size, new, unit, old, unit))
+        if regressions:
+            sys.exit(1)
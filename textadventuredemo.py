@@ -10,15 +10,29 @@ The tutorial for this game program is located at: TODO
 The github repo for this program is at: TODO
 
 
-This tutorial does not use classes and object-oriented programming
-in order to make it simpler to understand for new programmers. Although
-you can see how using dictionaries-in-dictionaries to structures your
-data quickly gets unwieldy.
-
-The same goes for using global variables and functions such as inventory,
-location, and moveDirection(). These are fine for a small program,
-but if you ever want to extend the game they can become burdensome to
-work with. But if you are starting out with a toy project, they're fine.
+The game world is still written as dictionaries-in-dictionaries (the
+world and objects variables below), because they are the easiest thing to
+read and edit. But the game doesn't play with them directly. It started
+out that way, with global variables for the inventory and location, and
+that gets unwieldy as soon as you want more than one player or a bigger
+world. So now the program is organized with a few classes:
+
+    GameWorld     the world and objects dictionaries compiled into Room and
+                  Item objects with integer IDs (see compileWorld()). Every
+                  player shares it, and only setExit() changes it while the
+                  game runs. MappedWorld is the same thing read from a world
+                  file, for worlds too big to write as dictionaries.
+    WorldState    the parts of the world that change, like the items on the
+                  ground, kept separately from the GameWorld. Players in the
+                  same world share one.
+    GameSession   one player: their location, inventory and money, and the
+                  WorldState they are playing in.
+    TextAdventureCmd  the commands a player can type, as a cmd.Cmd subclass
+                  with a GameSession. Everything a command displays goes
+                  into a Response and is written out in one go.
+
+textadventureserver.py and textadventureshards.py use these to let many
+players play in the same world over the network.
 """
 
 
@@ -41,6 +55,19 @@ The town looks something like this:
 """
 
 
+"""
+How long starting the game takes is measured from here (see
+startupCheckpoint() and the --startup-times option). The rest of the
+imports come after the world data.
+"""
+import time
+startupTimes = [('start', time.perf_counter())]
+
+def startupCheckpoint(name):
+    """Records that the part of starting up called name has just finished."""
+    startupTimes.append((name, time.perf_counter()))
+
+
 """
 These constant variables are used because if I mistype them, Python will
 immediately throw up an error message since no variable with the typo
@@ -64,6 +91,22 @@ EDIBLE = 'edible'
 DESCWORDS = 'descwords'
 
 SCREEN_WIDTH = 80
+RENDER_CACHE_SIZE = 1024 # how many wrapped texts and area descriptions to remember
+BATCH_FLUSH_SIZE = 64 * 1024 # how much batch mode output to buffer before writing it
+ROUTING_PRECOMPUTE_LIMIT = 2000 # worlds with up to this many rooms get every route worked out at load time
+ROUTING_CACHE_SIZE = 256 # otherwise, how many destinations' routes to remember
+SAVE_DIRECTORY = 'saves' # where the "save" and "restore" commands keep save files
+PARSE_CACHE_SIZE = 1024 # how many parsed lines to remember
+SHOP_STOCK = 3 # when the world is simulated, how many of each item a shop keeps in stock
+RESTOCK_SECONDS = 60.0 # and how long it takes a shop to restock one item
+START_MONEY = 50 # how many coins a new player has
+DEFAULT_PRICE = 5 # the price of items that aren't in itemPrices
+SELL_PRICE_FRACTION = 0.5 # shops pay this much of their price for the items players sell them
+ECONOMY_TICK_SECONDS = 30.0 # when the world is simulated, how often shops change their prices
+PRICE_SENSITIVITY = 0.1 # how much a price changes, per SHOP_STOCK items bought (or sold) more than sold (or bought), each tick
+PRICE_RECOVERY = 0.05 # how much of the way back to its usual price a price goes each tick
+MIN_PRICE_FACTOR = 0.25 # prices stay between these times an item's usual price
+MAX_PRICE_FACTOR = 4.0
 
 """
 The game world data is stored in a dictionary (which itself has dictionaries
@@ -81,9 +124,8 @@ variables (e.g. DESC, NORTH, etc.) instead of strings in case we make
 typos.
 
 DESC is a text description of the area. SHOP, if it exists, is a list of
-objects that can be bought at this area. (We don't implement money in this
-program, so everything is free.) GROUND is a list of objects that are on
-the ground in this area. The directions (NORTH, SOUTH, UP, etc.) are the
+objects that can be bought at this area (for the prices in itemPrices,
+below). GROUND is a list of objects that are on the ground in this area. The directions (NORTH, SOUTH, UP, etc.) are the
 areas that exist in that direction.
 """
 world = {
@@ -274,89 +316,2989 @@ objects = {
     }
 
 """
-These variables track where the player is and what is in their inventory.
-The value in the location variable will always be a key in the world variable
-and the value in the inventory list will always be a key in the objects
-variable.
+These variables are where a new player starts and what is in their inventory
+when they start. The value in startLocation is a key in the world variable
+and the values in the startInventory list are keys in the objects variable.
+
+Where each player is and what they are carrying is kept in a GameSession
+object (see below) rather than in global variables, so that one program can
+run the game for many players at once.
 """
-location = 'Town Square' # start in town square
-inventory = ['README Note', 'Sword', 'Donut'] # start with blank inventory
-showFullExits = True
+startLocation = 'Town Square' # start in town square
+startInventory = ['README Note', 'Sword', 'Donut'] # start with blank inventory
 
-import cmd, sys, textwrap
+"""
+Things that happen in an area by themselves, when the world is being
+simulated (see startSimulation() below). For each area, this is how many
+seconds apart they happen and the messages that the players there see, one
+after another.
+"""
+roomEvents = {
+    'South Y Street': (45, ['The carolers launch into a rousing chorus of "Deck the Halls." It is July.',
+                            'One of the Carols hands you a pamphlet about mitten safety.',
+                            'The carolers hum a note in perfect harmony, then argue about whose note it was.']),
+    'Wizard Tower': (60, ['A rat scurries past, muttering about the price of cheese.',
+                          'One of the cauldrons bubbles over with purple foam.']),
+    }
 
-def moveDirection(direction):
-    """A helper function that changes the location of the player."""
-    global location
+"""
+What each object usually costs, in coins. Objects that aren't listed cost
+DEFAULT_PRICE. When the world is simulated, shops raise the prices of what
+sells and lower the prices of what players sell them (see Economy below).
+"""
+itemPrices = {
+    'Meat Pie': 4,
+    'Donut': 2,
+    'Bagel': 2,
+    'Anvil': 40,
+    'Sword': 25,
+    'War Axe': 30,
+    'Chainmail T-Shirt': 20,
+    }
 
-    if direction in world[location]:
-        print('You move to the %s.' % direction)
-        location = world[location][direction]
-        displayLocation(location)
-    else:
-        print('You cannot move in that direction')
+startupCheckpoint('world data')
+
+# json, mmap, textwrap and tracemalloc are imported by the functions that use
+# them instead, since most games never need some of them and they take a
+# while to import
+import array, bisect, cmd, collections, heapq, io, itertools, marshal, math, os, re, struct, sys, zlib
+startupCheckpoint('imports')
+
+"""
+The world and objects dictionaries are easy to read and edit, but they are
+slow and memory hungry to play the game with: every world[loc][DESC] hashes
+two strings, and every area and object carries a whole dictionary around.
+Before the game starts, compileWorld() turns them into Room and Item objects
+that use __slots__ (so they don't have a dictionary at all) and refer to each
+other by integer IDs. A room's exits are a tuple of room IDs in the same order
+as EXIT_DIRECTIONS, with NO_EXIT for directions you can't go.
+
+The dictionaries are still how you write the game world; the Room and Item
+objects are only what the game uses while it runs.
+"""
+EXIT_DIRECTIONS = (NORTH, SOUTH, EAST, WEST, UP, DOWN) # the order of Room.exits
+DIRECTION_INDEX = {direction: i for i, direction in enumerate(EXIT_DIRECTIONS)}
+NO_EXIT = -1
+
+class Room:
+    """An area in the compiled game world. ground is an ItemBag of the item
+    IDs on the ground here, and shop is an ItemBag of the item IDs for sale
+    (or None if this area isn't a shop)."""
+    __slots__ = ('id', 'name', 'desc', 'exits', 'ground', 'shop')
+
+    def __init__(self, id, name, desc, exits, ground, shop=None):
+        self.id = id
+        self.name = name
+        self.desc = desc
+        self.exits = exits
+        self.ground = ground
+        self.shop = shop
+
+    def exit(self, direction):
+        """Returns the ID of the room in that direction, or NO_EXIT."""
+        if direction not in DIRECTION_INDEX:
+            return NO_EXIT
+        return self.exits[DIRECTION_INDEX[direction]]
+
+    def __repr__(self):
+        return 'Room(%r, %r)' % (self.id, self.name)
+
+
+class Item:
+    """An object in the compiled game world. The TAKEABLE and EDIBLE defaults
+    have already been filled in."""
+    __slots__ = ('id', 'name', 'groundDesc', 'shortDesc', 'longDesc', 'takeable', 'edible', 'descWords')
+
+    def __init__(self, id, name, groundDesc, shortDesc, longDesc, takeable, edible, descWords):
+        self.id = id
+        self.name = name
+        self.groundDesc = groundDesc
+        self.shortDesc = shortDesc
+        self.longDesc = longDesc
+        self.takeable = takeable
+        self.edible = edible
+        self.descWords = descWords
+
+    def __repr__(self):
+        return 'Item(%r, %r)' % (self.id, self.name)
+
+
+class GameWorld:
+    """The compiled game world. rooms and items are lists indexed by ID, and
+    roomIds and itemIds map the names used in the world and objects
+    dictionaries to those IDs. router finds the way between rooms."""
+    __slots__ = ('rooms', 'items', 'roomIds', 'itemIds', 'router', '_lowerRoomNames', '_sortedRoomNames', '_fingerprint',
+                 '_incoming')
+
+    def __init__(self, rooms, items, roomIds, itemIds):
+        self.rooms = rooms
+        self.items = items
+        self.roomIds = roomIds
+        self.itemIds = itemIds
+        self.router = Router(self)
+        self._lowerRoomNames = None
+        self._sortedRoomNames = None
+        self._fingerprint = None
+        self._incoming = None # room ID -> list of (room ID, direction index) of exits leading into it
+
+    def roomId(self, name):
+        return self.roomIds[name]
+
+    def itemId(self, name):
+        return self.itemIds[name]
+
+    def findRoom(self, name):
+        """Returns the ID of the room called name, ignoring case, or None if
+        there is no such room."""
+        if name in self.roomIds:
+            return self.roomIds[name]
+        if self._lowerRoomNames is None:
+            self._lowerRoomNames = {roomName.lower(): roomId for roomName, roomId in self.roomIds.items()}
+        return self._lowerRoomNames.get(name.lower())
+
+    def completeRoomNames(self, prefix):
+        """Returns the lowercase names of the rooms that start with prefix
+        (which should be lowercase too)."""
+        if self._sortedRoomNames is None:
+            self.findRoom('') # makes sure _lowerRoomNames exists
+            self._sortedRoomNames = sorted(self._lowerRoomNames)
+        names = self._sortedRoomNames
+        completions = []
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            completions.append(names[i])
+            i += 1
+        return completions
+
+    def roomExits(self, loc):
+        return self.rooms[loc].exits
+
+    def setRoomExits(self, loc, exits):
+        if self._incoming is not None:
+            updateIncomingExits(self.incomingExits, loc, self.rooms[loc].exits, exits)
+        self.rooms[loc].exits = exits
+
+    def incomingExits(self, loc):
+        """Returns a list of (room ID, direction index) pairs for the exits
+        that lead into the room loc. The lists for every room are made the
+        first time one is asked for."""
+        if self._incoming is None:
+            self._incoming = [[] for room in self.rooms]
+            for room in self.rooms:
+                for directionIndex, destination in enumerate(room.exits):
+                    if destination != NO_EXIT:
+                        self._incoming[destination].append((room.id, directionIndex))
+        return self._incoming[loc]
+
+    def fingerprint(self):
+        """Returns a number that changes if rooms or items are added, removed,
+        or reordered, which would change their IDs. Save files record this so
+        that they aren't loaded into a different world."""
+        if self._fingerprint is None:
+            self._fingerprint = worldFingerprint([room.name for room in self.rooms],
+                                                 [item.name for item in self.items])
+        return self._fingerprint
+
+
+def updateIncomingExits(incomingExits, loc, oldExits, newExits):
+    """Updates the incoming exit lists (see GameWorld.incomingExits()) after
+    the exits from the room loc change from oldExits to newExits."""
+    for directionIndex, (oldDestination, newDestination) in enumerate(zip(oldExits, newExits)):
+        if oldDestination == newDestination:
+            continue
+        if oldDestination != NO_EXIT:
+            incomingExits(oldDestination).remove((loc, directionIndex))
+        if newDestination != NO_EXIT:
+            incomingExits(newDestination).append((loc, directionIndex))
+
+
+def worldFingerprint(roomNames, itemNames):
+    """Returns the checksum that GameWorld.fingerprint() returns, for a world
+    with rooms and items with these names, in this order."""
+    checksum = zlib.crc32('\0'.join(roomNames).encode())
+    return zlib.crc32('\0'.join(itemNames).encode(), checksum)
+
+
+def compileWorld(worldDict, objectsDict):
+    """Returns a GameWorld made from dictionaries laid out like the world and
+    objects variables. IDs are given out in the order the dictionaries list
+    the areas and objects. Raises ValueError if the dictionaries have errors
+    (see validateWorld())."""
+    try:
+        return compileWorldUnchecked(worldDict, objectsDict)
+    except KeyError:
+        report = validateWorld(worldDict, objectsDict)
+        if not report['errors']:
+            raise
+        raise ValueError(summarizeReport(report) + ' Run with --validate to see them.') from None
+
+
+def compileWorldUnchecked(worldDict, objectsDict):
+    itemIds = {}
+    items = []
+    for name, obj in objectsDict.items():
+        itemIds[name] = len(items)
+        items.append(Item(len(items), name, obj[GROUNDDESC], obj[SHORTDESC], obj[LONGDESC],
+                          obj.get(TAKEABLE, True), obj.get(EDIBLE, False), tuple(obj[DESCWORDS])))
+
+    roomIds = {name: i for i, name in enumerate(worldDict)}
+    rooms = []
+    for name, area in worldDict.items():
+        exits = tuple(roomIds[area[direction]] if direction in area else NO_EXIT
+                      for direction in EXIT_DIRECTIONS)
+        ground = ItemBag(items, [itemIds[item] for item in area[GROUND]])
+        shop = None
+        if SHOP in area:
+            shop = ItemBag(items, [itemIds[item] for item in area[SHOP]])
+        rooms.append(Room(len(rooms), name, area[DESC], exits, ground, shop))
+
+    gameWorld = GameWorld(rooms, items, roomIds, itemIds)
+    if len(rooms) <= ROUTING_PRECOMPUTE_LIMIT:
+        gameWorld.router.precompute()
+    return gameWorld
+
+
+"""
+Checking the world. A typo in the world or objects dictionaries, like an
+exit to an area that doesn't exist or a GROUND item that isn't in objects,
+otherwise only shows up as a KeyError when the world is compiled (or, for a
+world file written from it, when a player walks into the area).
+validateWorld() finds every problem at once and returns a report of them
+that can be turned into JSON. Run "python textadventuredemo.py --validate"
+to check the built-in world.
+
+It is written to check worlds with millions of areas in a few seconds. The
+area names are turned into integer IDs once, and the exits are kept in one
+flat array of ints (six for each area, in EXIT_DIRECTIONS order, like
+Room.exits). Then a single breadth first pass over the exits finds the areas
+that can't be reached from startLocation and, while it is following each
+exit, checks that there is an exit back.
+
+Errors stop the game from working. Warnings might be on purpose (a trapdoor
+you can't climb back up through is a one-way exit) but are worth a look.
+"""
+VALIDATE_REPORT_LIMIT = 1000 # how many problems of each kind the report lists (all of them are counted)
+PROBLEM_SEVERITY = {
+    'missing-key': 'error', # an area or object is missing DESC, GROUND, DESCWORDS, etc.
+    'no-descwords': 'error', # an object's DESCWORDS list is empty, so the player can't name it
+    'bad-exit': 'error', # an exit leads to an area that isn't in world
+    'bad-item': 'error', # a GROUND or SHOP list names an object that isn't in objects
+    'bad-start': 'error', # startLocation or an item in startInventory doesn't exist
+    'one-way-exit': 'warning', # no exit from the area an exit leads to comes back
+    'unreachable': 'warning', # the area can't be walked to from startLocation
+    }
+
+def validateWorld(worldDict, objectsDict, startName=None, startItems=None, limit=VALIDATE_REPORT_LIMIT):
+    """Checks dictionaries laid out like the world and objects variables and
+    returns a report dictionary: how many rooms, items, errors and warnings
+    there are, how many of each kind of problem (see PROBLEM_SEVERITY), and
+    a list of up to limit problems of each kind. startName and startItems
+    default to startLocation and startInventory."""
+    if startName is None:
+        startName = startLocation
+    if startItems is None:
+        startItems = startInventory
+    report = {'rooms': len(worldDict), 'items': len(objectsDict), 'errors': 0, 'warnings': 0,
+              'counts': {}, 'problems': []}
+    counts = report['counts']
+    problems = report['problems']
+
+    def problem(check, **details):
+        counts[check] = counts.get(check, 0) + 1
+        report[PROBLEM_SEVERITY[check] + 's'] += 1
+        if counts[check] <= limit:
+            details['check'] = check
+            details['severity'] = PROBLEM_SEVERITY[check]
+            problems.append(details)
+
+    for name, obj in objectsDict.items():
+        for key in (GROUNDDESC, SHORTDESC, LONGDESC, DESCWORDS):
+            if key not in obj:
+                problem('missing-key', item=name, key=key)
+        if obj.get(DESCWORDS) == []:
+            problem('no-descwords', item=name)
+
+    # the first pass: give each area an ID and put its exits in the array,
+    # looking at each area's dictionary only once
+    roomNames = list(worldDict)
+    roomIds = dict(zip(roomNames, itertools.count()))
+    exits = array.array('i', [NO_EXIT]) * (len(roomNames) * 6)
+    for loc, area in enumerate(worldDict.values()):
+        for key, value in area.items():
+            direction = DIRECTION_INDEX.get(key)
+            if direction is not None:
+                target = roomIds.get(value)
+                if target is None:
+                    problem('bad-exit', room=roomNames[loc], direction=key, target=value)
+                else:
+                    exits[loc * 6 + direction] = target
+            elif key == GROUND or key == SHOP:
+                for item in value:
+                    if item not in objectsDict:
+                        problem('bad-item', room=roomNames[loc], list=key, item=item)
+        if DESC not in area:
+            problem('missing-key', room=roomNames[loc], key=DESC)
+        if GROUND not in area:
+            problem('missing-key', room=roomNames[loc], key=GROUND)
+
+    start = roomIds.get(startName)
+    if start is None:
+        problem('bad-start', room=startName)
+    for item in startItems:
+        if item not in objectsDict:
+            problem('bad-start', item=item)
+
+    # The graph pass: follow the exits from the start, and then from every
+    # area that wasn't reached, so that each exit is followed exactly once.
+    # seen has an extra byte at the end that is already set, so seen[NO_EXIT]
+    # (which is seen[-1]) says there is no need to go that way. The opposite
+    # of each direction is the one next to it in EXIT_DIRECTIONS (north and
+    # south, east and west, up and down), so direction ^ 1 is the way back
+    # that most exits have.
+    seen = bytearray(len(roomNames) + 1)
+    seen[-1] = 1
+    roots = range(len(roomNames)) if start is None else itertools.chain((start,), range(len(roomNames)))
+    for root in roots:
+        if seen[root]:
+            continue
+        seen[root] = 1
+        reachable = root == start
+        queue = [root]
+        for loc in queue: # the queue grows as the loop runs
+            if not reachable:
+                problem('unreachable', room=roomNames[loc])
+            for direction, target in enumerate(exits[loc * 6:loc * 6 + 6]):
+                if target == NO_EXIT:
+                    continue
+                if exits[target * 6 + (direction ^ 1)] != loc and loc not in exits[target * 6:target * 6 + 6]:
+                    problem('one-way-exit', room=roomNames[loc], direction=EXIT_DIRECTIONS[direction],
+                            target=roomNames[target])
+                if not seen[target]:
+                    seen[target] = 1
+                    queue.append(target)
+    return report
+
+
+def summarizeReport(report):
+    """Returns a one-line description of a validateWorld() report."""
+    text = 'The world has %s error(s) and %s warning(s)' % (report['errors'], report['warnings'])
+    if report['counts']:
+        text += ': ' + ', '.join('%s %s' % (count, check) for check, count in sorted(report['counts'].items()))
+    return text + '.'
 
 
-def displayLocation(loc):
+"""
+Fast startup. Compiling the world and objects dictionaries takes a little
+time, and working out every route (for worlds with up to
+ROUTING_PRECOMPUTE_LIMIT areas) takes a lot more. So the compiled world,
+routes included, is saved with the marshal module in a cache file next to
+this program's .pyc files, and later runs load it from there instead.
+
+The cache file also keeps repr() of the dictionaries it was made from. If
+that isn't exactly the same as repr() of the dictionaries the game is
+starting with (say, because you edited the world), the cache is ignored and
+made again. Comparing the text is as quick as hashing it would be, and two
+different worlds can never be mistaken for each other. (If you change what
+compileWorld() makes, add one to WORLD_CACHE_VERSION so old caches are
+thrown away too.)
+
+Small worlds compile faster than the cache file can be read and checked
+(the built-in one compiles in about 0.4 milliseconds, and loading it from
+the cache would take about 1.3), so worlds with fewer than
+WORLD_CACHE_MIN_ROOMS areas are just compiled. Bigger ones gain a lot: a
+world of 100 areas takes about 8 milliseconds to compile and 3 to load, and
+one of 1500 areas about 1.9 seconds to compile and 75 milliseconds to load.
+"""
+WORLD_CACHE_VERSION = 2
+WORLD_CACHE_MIN_ROOMS = 100
+WORLD_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'textadventuredemo.world.cache')
+
+def compileWorldCached(worldDict, objectsDict, cacheFile=WORLD_CACHE_FILE):
+    """Returns the same GameWorld as compileWorld(worldDict, objectsDict),
+    loaded from cacheFile if it was saved from the same dictionaries."""
+    if len(worldDict) < WORLD_CACHE_MIN_ROOMS:
+        return compileWorld(worldDict, objectsDict)
+    key = (WORLD_CACHE_VERSION, marshal.version, sys.version_info[:2])
+    source = repr((worldDict, objectsDict))
+    try:
+        with open(cacheFile, 'rb') as cache:
+            data = marshal.load(cache)
+        if data[0] == key and data[1] == source:
+            return unmarshalWorld(data)
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        pass # there is no cache yet, or it is damaged
+
+    compiledWorld = compileWorld(worldDict, objectsDict)
+    tempFile = '%s.%s.tmp' % (cacheFile, os.getpid()) # so two games starting at once don't write over each other
+    try:
+        os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+        with open(tempFile, 'wb') as cache:
+            marshal.dump(marshalWorld(key, source, compiledWorld), cache)
+        os.replace(tempFile, cacheFile)
+    except OSError:
+        pass # the cache is only a speed-up, so carry on without it
+    return compiledWorld
+
+def marshalWorld(key, source, compiledWorld):
+    """Returns compiledWorld as nested tuples of the types marshal can save."""
+    rooms = compiledWorld.rooms
+    return (key, source,
+            tuple(room.name for room in rooms),
+            tuple(room.desc for room in rooms),
+            tuple(room.exits for room in rooms),
+            tuple(tuple(room.ground.items()) for room in rooms),
+            tuple(None if room.shop is None else tuple(room.shop.items()) for room in rooms),
+            tuple((item.name, item.groundDesc, item.shortDesc, item.longDesc, item.takeable, item.edible, item.descWords)
+                  for item in compiledWorld.items),
+            tuple((loc, bytes(table)) for loc, table in compiledWorld.router.tables.items()))
+
+def unmarshalWorld(data):
+    """Returns the GameWorld saved by marshalWorld()."""
+    key, source, roomNames, descs, exits, grounds, shops, itemFields, routes = data
+    items = [Item(i, *fields) for i, fields in enumerate(itemFields)]
+    rooms = []
+    for i, name in enumerate(roomNames):
+        ground = ItemBag(items)
+        for item, count in grounds[i]:
+            ground.add(item, count)
+        shop = None
+        if shops[i] is not None:
+            shop = ItemBag(items)
+            for item, count in shops[i]:
+                shop.add(item, count)
+        rooms.append(Room(i, name, descs[i], exits[i], ground, shop))
+    compiledWorld = GameWorld(rooms, items, {name: i for i, name in enumerate(roomNames)},
+                              {fields[0]: i for i, fields in enumerate(itemFields)})
+    router = compiledWorld.router
+    router.cacheSize = max(router.cacheSize, len(routes))
+    for loc, table in routes:
+        router.tables[loc] = bytearray(table)
+    return compiledWorld
+
+
+NO_ROUTE = 255 # in a Router's next-hop table, means the destination can't be reached
+
+class Router:
+    """Finds the shortest way from one room to another.
+
+    For a destination room, the "next-hop table" is a bytearray with an entry
+    for every room, giving the index (in EXIT_DIRECTIONS) of the exit to take
+    from that room to get one step closer to the destination. Following the
+    table from room to room leads to the destination by the shortest path.
+    The table is made with a breadth-first search that starts at the
+    destination and follows exits backwards, using the world's
+    incomingExits(). A GameWorld works those out from its rooms, and a world
+    file has them stored in it, so routing in a MappedWorld doesn't have to
+    read every room first.
+
+    Small worlds have the table for every destination made at load time. In
+    large worlds that would take too much memory (one byte for every pair of
+    rooms), so tables are made the first time they are needed and the most
+    recently used ROUTING_CACHE_SIZE of them are kept."""
+
+    def __init__(self, world, cacheSize=ROUTING_CACHE_SIZE):
+        self.world = world
+        self.cacheSize = cacheSize
+        self.tables = collections.OrderedDict() # destination room ID -> next-hop table
+
+    def precompute(self):
+        """Makes the next-hop table for every destination."""
+        self.cacheSize = max(self.cacheSize, len(self.world.rooms))
+        for loc in range(len(self.world.rooms)):
+            self.nextHops(loc)
+
+    def nextHops(self, destination):
+        """Returns the next-hop table for getting to destination."""
+        table = self.tables.get(destination)
+        if table is not None:
+            self.tables.move_to_end(destination)
+            return table
+
+        incomingExits = self.world.incomingExits
+        table = bytearray([NO_ROUTE]) * len(self.world.rooms)
+        queue = collections.deque([destination])
+        while queue:
+            loc = queue.popleft()
+            for source, directionIndex in incomingExits(loc):
+                if table[source] == NO_ROUTE and source != destination:
+                    table[source] = directionIndex
+                    queue.append(source)
+
+        self.tables[destination] = table
+        while len(self.tables) > self.cacheSize:
+            self.tables.popitem(last=False)
+        return table
+
+    def path(self, start, destination):
+        """Returns a list of the directions to go to get from the start room
+        to the destination room, or None if there is no way there."""
+        directions = []
+        if start == destination:
+            return directions
+        table = self.nextHops(destination)
+        if table[start] == NO_ROUTE:
+            return None
+        loc = start
+        while loc != destination:
+            directions.append(EXIT_DIRECTIONS[table[loc]])
+            loc = self.world.roomExits(loc)[table[loc]]
+        return directions
+
+    def distance(self, table, start, destination):
+        """Returns how many steps the route in table takes from start to
+        destination, or None if there is no way there."""
+        steps = 0
+        loc = start
+        while loc != destination:
+            if table[loc] == NO_ROUTE:
+                return None
+            loc = self.world.roomExits(loc)[table[loc]]
+            steps += 1
+        return steps
+
+    def exitChanged(self, loc, directionIndex, oldDestination, newDestination):
+        """Updates the router after an exit from loc has been changed (the
+        world's setRoomExits() has already updated its incoming exits). Only
+        the next-hop tables the change can make wrong are thrown away (to be
+        made again the next time they are needed). Those are the tables whose
+        route from loc went through the changed exit, since every route
+        through loc went that way too, and the tables the new exit gives a
+        shorter route from loc. The rest still give a shortest path."""
+        outOfDate = []
+        for destination, table in self.tables.items():
+            if loc == destination:
+                continue # the way out of the destination doesn't matter
+            if table[loc] == directionIndex:
+                outOfDate.append(destination)
+            elif newDestination != NO_EXIT:
+                # the route from loc doesn't use the changed exit, so the
+                # table can still be followed to see if the new exit is shorter
+                newSteps = self.distance(table, newDestination, destination)
+                if newSteps is not None:
+                    steps = self.distance(table, loc, destination)
+                    if steps is None or newSteps + 1 < steps:
+                        outOfDate.append(destination)
+        for destination in outOfDate:
+            del self.tables[destination]
+
+
+def setExit(world, loc, direction, destination):
+    """Changes the exit in direction from the room loc to lead to the room
+    destination (or to nowhere, if destination is NO_EXIT). This changes the
+    GameWorld that every player shares."""
+    directionIndex = DIRECTION_INDEX[direction]
+    exits = list(world.roomExits(loc))
+    oldDestination = exits[directionIndex]
+    exits[directionIndex] = destination
+    world.setRoomExits(loc, tuple(exits)) # a new tuple, so renderCache knows the exits changed
+    world.router.exitChanged(loc, directionIndex, oldDestination, destination)
+
+
+def path(a, b):
+    """Returns a list of the directions to go to get from room a to room b,
+    where a and b are room names or IDs, or None if there is no way there."""
+    if isinstance(a, str):
+        a = gameWorld.roomId(a)
+    if isinstance(b, str):
+        b = gameWorld.roomId(b)
+    return gameWorld.router.path(a, b)
+
+
+"""
+Output. Instead of calling print(), the game's functions and do_*() methods
+add their text to the player's Response with say(), which takes the same
+arguments as print(). After each command, postcmd() calls the Response's
+send(), which hands everything the command said to the Response's sink in a
+single write. (When every line was printed separately, a "look" in a busy
+area made a dozen writes.)
+
+The sink decides where the text goes. Any object with a write(text) method
+can be a sink; TerminalSink and MemorySink below send the text to the
+terminal or a buffer in memory, and the servers have their own sinks that
+send it over the network, encoded by encodeOutput().
+"""
+class TerminalSink:
+    """Writes output to file, or to sys.stdout (whatever it is at the time)
+    if file is None."""
+
+    def __init__(self, file=None):
+        self.file = file
+
+    def write(self, text):
+        file = self.file if self.file is not None else sys.stdout
+        file.write(text)
+        file.flush()
+
+
+def encodeOutput(text, encoding='utf-8'):
+    """Returns text as bytes to send over a network connection, with
+    telnet-style \\r\\n line endings."""
+    return text.replace('\n', '\r\n').encode(encoding, 'replace')
+
+
+class MemorySink:
+    """Keeps output in memory until it is taken with getvalue() or take()."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0 # the number of characters in parts
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+    def take(self):
+        """Returns everything written so far and empties the sink."""
+        text = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return text
+
+
+class Response:
+    """The output of the command being run, which is sent to sink in one
+    write by send().
+
+    A Response is also a file-like object, so it can be used as cmd.Cmd's
+    stdout and the help command's output is collected with everything else."""
+
+    quiet = False # True if what is said is thrown away (see QuietResponse)
+
+    def __init__(self, sink=None):
+        self.sink = sink if sink is not None else TerminalSink()
+        self.parts = []
+
+    def say(self, *args, sep=' ', end='\n'):
+        """Adds text to the response, the same way print() would display it."""
+        if len(args) == 1 and type(args[0]) is str:
+            self.parts.append(args[0] + end)
+        else:
+            self.parts.append(sep.join([str(arg) for arg in args]) + end)
+
+    def write(self, text):
+        self.parts.append(text)
+        return len(text)
+
+    def flush(self):
+        pass # for file-like compatibility; nothing is sent until send() is called
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+    def send(self):
+        """Writes everything said since the last send() to the sink."""
+        if self.parts:
+            text = ''.join(self.parts)
+            self.parts = []
+            self.sink.write(text)
+
+
+def moveDirection(session, direction):
+    """A helper function that changes the location of the player."""
+    destination = gameWorld.rooms[session.location].exit(direction)
+    if destination != NO_EXIT:
+        session.response.say('You move to the %s.' % direction)
+        enterRoom(session, destination)
+    else:
+        session.response.say('You cannot move in that direction')
+
+def enterRoom(session, loc):
+    """Puts the player in the room loc and displays it, unless the session's
+    onEnter function says the player has been handed to someone else who
+    will display it. The other players in the rooms the player leaves and
+    enters are told about it."""
+    state = session.state
+    state.broadcast(session.location, '%s leaves.' % (session.name), exclude=session)
+    state.moveSession(session, loc)
+    session.record(JOURNAL_MOVE, loc)
+    if session.onEnter is None or not session.onEnter(session, loc):
+        displayLocation(session, loc)
+        state.broadcast(loc, '%s arrives.' % (session.name), exclude=session)
+
+def dropItem(session, item, count):
+    """A helper function that moves count of item from the player's
+    inventory to the ground where they are."""
+    session.response.say('You drop %s.' % (describeCount(item, count)))
+    session.inventory.remove(item, count) # remove from inventory
+    session.state.groundForUpdate(session.location).add(item, count) # add to the ground
+    session.record(JOURNAL_DROP, item, count)
+    session.state.broadcast(session.location, '%s drops %s.' % (session.name, describeCount(item, count)),
+                            exclude=session)
+
+def takeItem(session, item, count):
+    """A helper function that moves count of item from the ground where the
+    player is to their inventory."""
+    session.response.say('You take %s.' % (describeCount(item, count)))
+    session.state.groundForUpdate(session.location).remove(item, count) # remove from the ground
+    session.inventory.add(item, count) # add to inventory
+    session.state.broadcast(session.location, '%s takes %s.' % (session.name, describeCount(item, count)),
+                            exclude=session)
+    session.record(JOURNAL_TAKE, item, count)
+
+
+class RenderCache:
+    """A least-recently-used (LRU) cache of rendered text.
+
+    Wrapping a long description with textwrap is slow compared to everything
+    else the game does when you enter an area, and the descriptions never
+    change. So the wrapped text is remembered here, keyed by an ID for the
+    text and the screen width. Once the cache holds maxSize entries, the one
+    that was used longest ago is thrown out to make room."""
+
+    def __init__(self, maxSize=RENDER_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key) # mark as most recently used
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False) # throw out the least recently used
+
+    def clear(self):
+        self.entries.clear()
+
+renderCache = RenderCache()
+
+def wrapText(textId, text, width=SCREEN_WIDTH):
+    """Returns text wrapped to width, using renderCache. textId identifies
+    the text, such as ('room', roomId) or ('item', itemId)."""
+    key = (textId, width)
+    wrapped = renderCache.get(key)
+    if wrapped is None:
+        import textwrap
+        wrapped = '\n'.join(textwrap.wrap(text, width))
+        renderCache.put(key, wrapped)
+    return wrapped
+
+
+def displayLocation(session, loc):
     """A helper function for displaying an area's description and exits."""
-    print(loc)
-    print('=' * len(loc))
-    print('\n'.join(textwrap.wrap(world[loc][DESC], SCREEN_WIDTH)))
-    if len(world[loc][GROUND]) > 0:
-        print()
-        for item in world[loc][GROUND]:
-            print(objects[item][GROUNDDESC])
+    if session.response.quiet:
+        return # see QuietResponse
+    session.response.say(renderLocation(loc, session.state.ground(loc), session.showFullExits))
+
+def renderLocation(loc, ground, showFullExits=True, width=SCREEN_WIDTH):
+    """Returns the text that displayLocation() displays for an area, where
+    ground is the ItemBag of what is on the ground there.
+
+    The whole block of text is kept in renderCache along with the ground bag,
+    its version, and the area's exits when it was made, so it is only rendered
+    again when something is dropped or taken here or the exits change."""
+    room = gameWorld.rooms[loc]
+    key = (('location', loc, showFullExits), width)
+    cached = renderCache.get(key)
+    if cached is not None and cached[0] is ground and cached[1] == ground.version and cached[2] is room.exits:
+        return cached[3]
+
+    lines = [room.name, '=' * len(room.name), wrapText(('room', loc), room.desc, width)]
+    if len(ground) > 0:
+        lines.append('')
+        for item in ground:
+            lines.append(gameWorld.items[item].groundDesc)
     exits = []
-    for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-        if direction in world[loc].keys():
+    for direction, destination in zip(EXIT_DIRECTIONS, room.exits):
+        if destination != NO_EXIT:
             exits.append(direction.title())
-    print()
+    lines.append('')
     if showFullExits:
-        for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-            if direction in world[location]:
-                print('%s: %s' % (direction.title(), world[location][direction]))
+        for direction, destination in zip(EXIT_DIRECTIONS, room.exits):
+            if destination != NO_EXIT:
+                lines.append('%s: %s' % (direction.title(), gameWorld.rooms[destination].name))
     else:
-        print('Exits: %s' % ' '.join(exits))
+        lines.append('Exits: %s' % ' '.join(exits))
+
+    text = '\n'.join(lines)
+    renderCache.put(key, (ground, ground.version, room.exits, text))
+    return text
+
+class DescIndex:
+    """An inverted index from "description words" to the items they describe.
+
+    Each container of items (the inventory, an area's ground, or a shop) keeps
+    one of these so that finding the item a player typed doesn't require
+    looking at every item in the container. The ItemBag that owns the index
+    tells it when the first of an item arrives and when the last one leaves,
+    so the index only has to track which items are present, not how many.
+    items is the list of Item objects that the item IDs refer to."""
+
+    def __init__(self, items):
+        self.items = items
+        self.words = {} # desc word -> {item ID: None}, used as an ordered set
+        self.firstWords = {} # first desc word -> number of distinct items using it
+        self.sortedWords = [] # the keys of self.words, kept sorted for tab completion
+
+    def add(self, item):
+        descWords = self.items[item].descWords
+        self.firstWords[descWords[0]] = self.firstWords.get(descWords[0], 0) + 1
+        for descWord in descWords:
+            if descWord not in self.words:
+                self.words[descWord] = {}
+                bisect.insort(self.sortedWords, descWord)
+            self.words[descWord][item] = None
+
+    def remove(self, item):
+        descWords = self.items[item].descWords
+        for descWord in descWords:
+            matches = self.words[descWord]
+            del matches[item]
+            if len(matches) == 0:
+                del self.words[descWord]
+                del self.sortedWords[bisect.bisect_left(self.sortedWords, descWord)]
+        self.firstWords[descWords[0]] -= 1
+        if self.firstWords[descWords[0]] == 0:
+            del self.firstWords[descWords[0]]
+
+    def firstItem(self, desc):
+        """Returns the ID of an item described by desc, or None."""
+        matches = self.words.get(desc)
+        if not matches:
+            return None
+        return next(iter(matches))
+
+    def allItems(self, desc):
+        """Returns a list of the distinct item IDs described by desc."""
+        return list(self.words.get(desc, ()))
+
+    def complete(self, prefix, itemFilter=None):
+        """Returns the desc words that start with prefix. If itemFilter is
+        given, only words describing at least one item for which
+        itemFilter(item) is True are returned.
+
+        Since sortedWords is sorted, all the words starting with prefix are
+        next to each other, and bisect finds where they begin. This means we
+        only look at the words that match instead of every word in the
+        container."""
+        completions = []
+        i = bisect.bisect_left(self.sortedWords, prefix)
+        while i < len(self.sortedWords) and self.sortedWords[i].startswith(prefix):
+            descWord = self.sortedWords[i]
+            if itemFilter is None or any(map(itemFilter, self.words[descWord])):
+                completions.append(descWord)
+            i += 1
+        return completions
+
+    def completeFirstWords(self, itemFilter=None):
+        """Returns the first desc word of every item in the container. If
+        itemFilter is given, only items for which itemFilter(item) is True are
+        included."""
+        if itemFilter is None:
+            return list(self.firstWords)
+        completions = []
+        for descWord in self.firstWords:
+            for item in self.words[descWord]:
+                if self.items[item].descWords[0] == descWord and itemFilter(item):
+                    completions.append(descWord)
+                    break
+        return completions
+
+
+class ItemBag:
+    """A counted collection of item IDs (sometimes called a "multiset").
+
+    The inventory and each Room's ground and shop are ItemBags. Instead of a
+    list with one entry per item (so four anvils take up four entries), the
+    bag stores each item once along with how many of it there are. Adding,
+    removing, and counting items doesn't depend on how many items are in the
+    bag. Items are kept in the order they were first added so that they
+    display in a sensible order.
+
+    Iterating over the bag gives each item ID once per copy, just like a list
+    would. Use items() to get (item ID, count) pairs instead.
+
+    Most areas have little or nothing on the ground, and in a big world most
+    grounds are never looked at, so the DescIndex isn't made until something
+    looks up a word in the bag (see descIndex).
+
+    version goes up by one every time the bag changes, so that anything made
+    from the bag's contents (like the rendered area description) can tell
+    whether it is out of date. Anything that needs to know straight away can
+    set onChange, which is called as onChange(item, change) after each
+    change."""
+    __slots__ = ('itemTable', 'counts', 'total', 'version', 'onChange', '_descIndex')
+
+    def __init__(self, itemTable, items=()):
+        self.itemTable = itemTable # the list of Item objects that the IDs refer to
+        self.counts = {} # item ID -> count
+        self.total = 0
+        self.version = 0
+        self.onChange = None
+        self._descIndex = None
+        for item in items:
+            self.add(item)
+
+    @property
+    def descIndex(self):
+        """The DescIndex of the items in the bag. It is made the first time
+        it is needed, and kept up to date by add() and remove() after that."""
+        if self._descIndex is None:
+            if not self.counts:
+                return EMPTY_DESC_INDEX
+            self._descIndex = DescIndex(self.itemTable)
+            for item in self.counts:
+                self._descIndex.add(item)
+        return self._descIndex
+
+    def add(self, item, count=1):
+        if item not in self.counts:
+            self.counts[item] = 0
+            if self._descIndex is not None:
+                self._descIndex.add(item)
+        self.counts[item] += count
+        self.total += count
+        self.version += 1
+        if self.onChange is not None:
+            self.onChange(item, count)
+
+    def remove(self, item, count=1):
+        """Removes count copies of item. Raises ValueError if there aren't
+        that many in the bag."""
+        if self.counts.get(item, 0) < count:
+            raise ValueError('%r is not in the bag %s time(s)' % (item, count))
+        self.counts[item] -= count
+        self.total -= count
+        self.version += 1
+        if self.counts[item] == 0:
+            del self.counts[item]
+            if self._descIndex is not None:
+                self._descIndex.remove(item)
+        if self.onChange is not None:
+            self.onChange(item, -count)
+
+    def count(self, item):
+        return self.counts.get(item, 0)
+
+    def distinct(self):
+        """Returns the item IDs in the bag, without duplicates."""
+        return self.counts.keys()
+
+    def items(self):
+        """Returns (item ID, count) pairs for the items in the bag."""
+        return self.counts.items()
+
+    def copy(self):
+        bag = ItemBag(self.itemTable)
+        for item, count in self.counts.items():
+            bag.add(item, count)
+        return bag
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        for item, count in self.counts.items():
+            for i in range(count):
+                yield item
+
+    def __repr__(self):
+        return 'ItemBag(%r)' % (self.counts)
+
+EMPTY_DESC_INDEX = DescIndex(()) # shared by all empty ItemBags; never add items to this
+
+
+def printValidation(worldDict, objectsDict):
+    """Prints validateWorld()'s report on the dictionaries as JSON, and a
+    summary on stderr, and exits (with status 1 if there are errors)."""
+    import json
+    report = validateWorld(worldDict, objectsDict)
+    print(json.dumps(report, indent=2))
+    print(summarizeReport(report), file=sys.stderr)
+    sys.exit(1 if report['errors'] else 0)
+
+# --validate has to work on a world with errors in it, which can't be
+# compiled, so it's handled here before the world is compiled instead of
+# with the other arguments at the end of the file
+if __name__ == '__main__' and '--validate' in sys.argv[1:]:
+    printValidation(world, objects)
+
+gameWorld = compileWorldCached(world, objects)
+startupCheckpoint('compile world')
+NO_ITEMS = ItemBag(gameWorld.items) # used for areas without a shop; never add items to this
+
+
+"""
+World files let the game play worlds far too big to write out as dictionary
+literals, such as generated maps with millions of rooms. writeWorldFile()
+turns world and objects dictionaries into a binary file, and openWorldFile()
+uses the mmap module to map that file into memory instead of reading it. The
+operating system only reads the parts of the file the game actually looks
+at, so opening a world file takes the same (short) time and memory no matter
+how big the world is. (Unlike the world cache made by compileWorldCached(),
+nothing remakes a world file when the dictionaries change, so run
+--write-world again after editing them.)
+
+A world file is laid out like this, with all numbers little-endian:
+
+    header        WORLD_HEADER: the counts and where each section starts
+    room table    one WORLD_ROOM record per room, in room ID order
+    item table    one WORLD_ITEM record per item, in item ID order
+    room names    the room IDs (4 bytes each), sorted by lowercase room name
+    item names    the item IDs (4 bytes each), sorted by lowercase item name
+    item bags     the ground and shop contents: (item ID, count) pairs
+    strings       all the text, encoded as UTF-8
+    incoming      for each room, where its incoming exits start in the
+                  incoming data (4 bytes each, and one more for the end)
+    incoming data (room ID, direction index) pairs for the exits leading
+                  into each room, in room ID order
+
+Records are all the same size, so the record for room ID n is found by
+multiplication instead of searching. Text in a record is an (offset, length)
+pair into the strings section; an item's desc words are joined by NUL
+characters. A room's exits are room IDs, with NO_EXIT for no exit. The
+incoming exits are the same exits turned around, so that the Router can
+follow them backwards without reading the whole room table.
+"""
+WORLD_MAGIC = b'TADW'
+WORLD_VERSION = 2
+WORLD_HEADER = struct.Struct('<4sHHIQQQQQQQQQQ') # magic, version, unused, fingerprint, room count, item count, then the offsets of the sections
+WORLD_ROOM = struct.Struct('<QIQI6iQIQI') # name, desc, exits, ground offset and distinct item count, shop offset and distinct item count
+WORLD_ITEM = struct.Struct('<QIQIQIQIQIB') # name, groundDesc, shortDesc, longDesc, descWords, flags
+WORLD_ID = struct.Struct('<I')
+WORLD_PAIR = struct.Struct('<II')
+WORLD_NO_SHOP = 0xFFFFFFFF # the shop distinct item count for rooms that aren't shops
+WORLD_TAKEABLE = 1 # item flags
+WORLD_EDIBLE = 2
+WORLD_CACHE_SIZE = 4096 # how many rooms (and items) from a world file to keep in memory
+
+def writeWorldFile(filename, worldDict, objectsDict):
+    """Writes the world file for world and objects dictionaries. The rooms
+    and items get the same IDs that compileWorld() would give them."""
+    strings = io.BytesIO()
+    stringRefs = {} # text -> (offset, length), so that repeated text is only stored once
+    def addString(text):
+        if text not in stringRefs:
+            data = text.encode()
+            stringRefs[text] = (strings.tell(), len(data))
+            strings.write(data)
+        return stringRefs[text]
+
+    bags = io.BytesIO()
+    def addBag(names):
+        counts = {}
+        for name in names:
+            counts[itemIds[name]] = counts.get(itemIds[name], 0) + 1
+        offset = bags.tell()
+        for item, count in counts.items():
+            bags.write(WORLD_PAIR.pack(item, count))
+        return offset, len(counts)
+
+    itemIds = {name: i for i, name in enumerate(objectsDict)}
+    roomIds = {name: i for i, name in enumerate(worldDict)}
+
+    itemTable = io.BytesIO()
+    for name, obj in objectsDict.items():
+        flags = 0
+        if obj.get(TAKEABLE, True):
+            flags |= WORLD_TAKEABLE
+        if obj.get(EDIBLE, False):
+            flags |= WORLD_EDIBLE
+        itemTable.write(WORLD_ITEM.pack(*addString(name), *addString(obj[GROUNDDESC]), *addString(obj[SHORTDESC]),
+                                        *addString(obj[LONGDESC]), *addString('\0'.join(obj[DESCWORDS])), flags))
+
+    roomTable = io.BytesIO()
+    allExits = array.array('i') # six for each room, like in validateWorld()
+    for name, area in worldDict.items():
+        exits = [roomIds[area[direction]] if direction in area else NO_EXIT for direction in EXIT_DIRECTIONS]
+        allExits.extend(exits)
+        groundOffset, groundDistinct = addBag(area[GROUND])
+        shopOffset, shopDistinct = 0, WORLD_NO_SHOP
+        if SHOP in area:
+            shopOffset, shopDistinct = addBag(area[SHOP])
+        roomTable.write(WORLD_ROOM.pack(*addString(name), *addString(area[DESC]), *exits,
+                                        groundOffset, groundDistinct, shopOffset, shopDistinct))
+
+    roomNames = b''.join(WORLD_ID.pack(roomIds[name]) for name in sorted(worldDict, key=lambda name: (name.lower(), roomIds[name])))
+    itemNames = b''.join(WORLD_ID.pack(itemIds[name]) for name in sorted(objectsDict, key=lambda name: (name.lower(), itemIds[name])))
+
+    # sort the exits by the room they lead to with a counting sort: count the
+    # exits into each room, add the counts up to get where each room's exits
+    # start, and then put each exit in the next free place for its room
+    incomingStarts = array.array('I', bytes(4 * (len(worldDict) + 1)))
+    for destination in allExits:
+        if destination != NO_EXIT:
+            incomingStarts[destination + 1] += 1
+    for loc in range(len(worldDict)):
+        incomingStarts[loc + 1] += incomingStarts[loc]
+    nextFree = array.array('I', incomingStarts)
+    incoming = array.array('I', bytes(8 * incomingStarts[-1])) # (room ID, direction index) pairs
+    for i, destination in enumerate(allExits):
+        if destination != NO_EXIT:
+            incoming[nextFree[destination] * 2] = i // 6
+            incoming[nextFree[destination] * 2 + 1] = i % 6
+            nextFree[destination] += 1
+    if sys.byteorder != 'little':
+        incomingStarts.byteswap()
+        incoming.byteswap()
+
+    sections = [roomTable.getvalue(), itemTable.getvalue(), roomNames, itemNames, bags.getvalue(), strings.getvalue(),
+                incomingStarts.tobytes(), incoming.tobytes()]
+    offsets = []
+    offset = WORLD_HEADER.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    header = WORLD_HEADER.pack(WORLD_MAGIC, WORLD_VERSION, 0, worldFingerprint(list(worldDict), list(objectsDict)),
+                               len(worldDict), len(objectsDict), *offsets)
+    with open(filename, 'wb') as worldFile:
+        worldFile.write(header)
+        for section in sections:
+            worldFile.write(section)
+
+
+class MappedTable:
+    """A read-only, list-like table of the Room or Item objects in a world
+    file. Each object is made from its record the first time it is asked for,
+    and the most recently used cacheSize of them are kept."""
+
+    def __init__(self, count, loadRecord, cacheSize=WORLD_CACHE_SIZE):
+        self.count = count
+        self.loadRecord = loadRecord # function that makes the object for an ID
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        obj = self.cache.get(i)
+        if obj is not None:
+            self.cache.move_to_end(i)
+            return obj
+        if not 0 <= i < self.count:
+            raise IndexError('ID %s is not in the world file' % (i))
+        obj = self.loadRecord(i)
+        self.cache[i] = obj
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return obj
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+class MappedWorld:
+    """A game world read from a world file with mmap. It can be used anywhere
+    a GameWorld can: rooms and items act like lists of Room and Item objects,
+    but only the rooms and items that are used get read from the file.
+
+    The rooms' ground ItemBags are never changed (WorldState copies them
+    before changing them), so it's safe for a room to be dropped from the
+    cache and read from the file again later. Exits changed with setExit() are
+    kept in changedExits for the same reason, and the incoming exits of the
+    rooms they lead to (or used to lead to) in changedIncoming."""
+
+    def __init__(self, filename, cacheSize=WORLD_CACHE_SIZE):
+        self.filename = filename
+        with open(filename, 'rb') as worldFile:
+            import mmap
+            self.mm = mmap.mmap(worldFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < WORLD_HEADER.size:
+            raise ValueError('%s is not a world file' % (filename))
+        (magic, version, unused, self._fingerprint, roomCount, itemCount, self.roomTable, self.itemTable,
+         self.roomNameIndex, self.itemNameIndex, self.bagData, self.strings, self.incomingIndex,
+         self.incomingData) = WORLD_HEADER.unpack_from(self.mm)
+        if magic != WORLD_MAGIC or version != WORLD_VERSION:
+            raise ValueError('%s is not a world file' % (filename))
+
+        self.rooms = MappedTable(roomCount, self.loadRoom, cacheSize)
+        self.items = MappedTable(itemCount, self.loadItem, cacheSize)
+        self.changedExits = {} # room ID -> exits tuple
+        self.changedIncoming = {} # room ID -> list of (room ID, direction index)
+        self.router = Router(self)
+
+    def string(self, offset, length):
+        offset += self.strings
+        return self.mm[offset:offset + length].decode()
+
+    def loadBag(self, offset, distinct):
+        bag = ItemBag(self.items)
+        offset += self.bagData
+        for i in range(distinct):
+            bag.add(*WORLD_PAIR.unpack_from(self.mm, offset + i * WORLD_PAIR.size))
+        return bag
+
+    def loadRoom(self, loc):
+        record = WORLD_ROOM.unpack_from(self.mm, self.roomTable + loc * WORLD_ROOM.size)
+        shop = None
+        if record[13] != WORLD_NO_SHOP:
+            shop = self.loadBag(record[12], record[13])
+        return Room(loc, self.string(record[0], record[1]), self.string(record[2], record[3]),
+                    self.roomExits(loc), self.loadBag(record[10], record[11]), shop)
+
+    def loadItem(self, item):
+        record = WORLD_ITEM.unpack_from(self.mm, self.itemTable + item * WORLD_ITEM.size)
+        return Item(item, self.string(record[0], record[1]), self.string(record[2], record[3]),
+                    self.string(record[4], record[5]), self.string(record[6], record[7]),
+                    bool(record[10] & WORLD_TAKEABLE), bool(record[10] & WORLD_EDIBLE),
+                    tuple(self.string(record[8], record[9]).split('\0')))
+
+    def roomExits(self, loc):
+        # read straight from the record so that routing doesn't have to load
+        # every room in the world
+        if loc in self.changedExits:
+            return self.changedExits[loc]
+        return WORLD_ROOM.unpack_from(self.mm, self.roomTable + loc * WORLD_ROOM.size)[4:10]
+
+    def setRoomExits(self, loc, exits):
+        updateIncomingExits(self.changeIncomingExits, loc, self.roomExits(loc), exits)
+        self.changedExits[loc] = exits
+        if loc in self.rooms.cache:
+            self.rooms.cache[loc].exits = exits
+
+    def incomingExits(self, loc):
+        if loc in self.changedIncoming:
+            return self.changedIncoming[loc]
+        start, end = WORLD_PAIR.unpack_from(self.mm, self.incomingIndex + loc * WORLD_ID.size) # this room's start and the next one's
+        return list(WORLD_PAIR.iter_unpack(self.mm[self.incomingData + start * WORLD_PAIR.size:
+                                                   self.incomingData + end * WORLD_PAIR.size]))
+
+    def changeIncomingExits(self, loc):
+        """Returns the incoming exits of loc as a list that can be changed."""
+        if loc not in self.changedIncoming:
+            self.changedIncoming[loc] = self.incomingExits(loc)
+        return self.changedIncoming[loc]
+
+    def roomName(self, loc):
+        record = WORLD_ROOM.unpack_from(self.mm, self.roomTable + loc * WORLD_ROOM.size)
+        return self.string(record[0], record[1])
+
+    def itemName(self, item):
+        record = WORLD_ITEM.unpack_from(self.mm, self.itemTable + item * WORLD_ITEM.size)
+        return self.string(record[0], record[1])
+
+    def searchNames(self, nameIndex, count, getName, prefix):
+        """Returns the position in a sorted name index of the first name that
+        is not less than prefix (like bisect.bisect_left())."""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if getName(WORLD_ID.unpack_from(self.mm, nameIndex + middle * WORLD_ID.size)[0]).lower() < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def matchingNames(self, nameIndex, count, getName, prefix):
+        """Yields (ID, name) for the names in a sorted name index that start
+        with prefix, ignoring case."""
+        i = self.searchNames(nameIndex, count, getName, prefix)
+        while i < count:
+            objectId = WORLD_ID.unpack_from(self.mm, nameIndex + i * WORLD_ID.size)[0]
+            name = getName(objectId)
+            if not name.lower().startswith(prefix):
+                return
+            yield objectId, name
+            i += 1
+
+    def roomId(self, name):
+        for loc, roomName in self.matchingNames(self.roomNameIndex, len(self.rooms), self.roomName, name.lower()):
+            if roomName == name:
+                return loc
+            if roomName.lower() != name.lower():
+                break
+        raise KeyError(name)
+
+    def itemId(self, name):
+        for item, itemName in self.matchingNames(self.itemNameIndex, len(self.items), self.itemName, name.lower()):
+            if itemName == name:
+                return item
+            if itemName.lower() != name.lower():
+                break
+        raise KeyError(name)
+
+    def findRoom(self, name):
+        for loc, roomName in self.matchingNames(self.roomNameIndex, len(self.rooms), self.roomName, name.lower()):
+            if roomName.lower() == name.lower():
+                return loc
+            break
+        return None
+
+    def completeRoomNames(self, prefix):
+        return [name.lower() for loc, name in self.matchingNames(self.roomNameIndex, len(self.rooms), self.roomName, prefix)]
+
+    def fingerprint(self):
+        return self._fingerprint
+
+
+def openWorldFile(filename, cacheSize=WORLD_CACHE_SIZE):
+    """Returns a MappedWorld for the world file. Raises ValueError if the file
+    isn't a world file."""
+    return MappedWorld(filename, cacheSize)
+
+
+def useWorld(newWorld):
+    """Makes newWorld (a GameWorld or MappedWorld) the world that the game is
+    played in. Do this before any GameSessions are made."""
+    global gameWorld, NO_ITEMS
+    gameWorld = newWorld
+    NO_ITEMS = ItemBag(gameWorld.items)
+    renderCache.clear()
+    useFuzzyWords(gameWorld)
+
+
+class WorldState:
+    """The parts of the game world that change while the game is played.
+
+    The GameWorld made by compileWorld() is never changed once the game
+    starts, so any number of players can share it. When an item is dropped or
+    taken, the area's ground is copied into this WorldState the first time it
+    changes (this is called "copy-on-write") and the copy is changed instead.
+    Areas that nobody has changed cost nothing.
+
+    Players whose GameSessions share a WorldState see each other's changes.
+    Giving each session its own WorldState gives each player a private copy of
+    the world."""
+
+    def __init__(self, baseWorld):
+        self.baseWorld = baseWorld
+        self.changedGround = {} # room ID -> this state's copy of the ground ItemBag
+        self.occupants = {} # room ID -> {GameSession: None} for the players in that room, in the order they came
+        self.subscribers = {} # room ID -> list of functions to call with what happens there
+        self.scheduler = None # the Scheduler, if this state is being simulated (see startSimulation())
+        self.shopStock = {} # (room ID, item ID) -> how many the shop has, once it isn't SHOP_STOCK
+        self.restocking = set() # the (room ID, item ID) keys with a restock event waiting
+        self.economy = None # the Economy that sets the shops' prices, if this state is being simulated
+        self.simulationEvents = [] # the Scheduler's repeating events for this state, so they can be cancelled
+        self.groundIndex = None # the GroundIndex of where items are, once "where" needs it
+        self.ownsRoom = None # if set, ownsRoom(loc) says whether this state keeps the ground at loc up to date
+
+    def ground(self, loc):
+        """Returns the ItemBag of what is on the ground at loc. Don't change
+        the bag this returns; use groundForUpdate() for that."""
+        ground = self.changedGround.get(loc)
+        if ground is None:
+            return self.baseWorld.rooms[loc].ground
+        return ground
+
+    def groundForUpdate(self, loc):
+        """Returns the ItemBag of what is on the ground at loc, copying it
+        into this WorldState first if this is the first change to it."""
+        ground = self.changedGround.get(loc)
+        if ground is None:
+            ground = self.baseWorld.rooms[loc].ground.copy()
+            self.setGround(loc, ground)
+        return ground
+
+    def setGround(self, loc, ground):
+        """Replaces the ground at loc with the ItemBag ground, which belongs
+        to this WorldState from now on."""
+        oldGround = self.changedGround.get(loc)
+        if oldGround is not None:
+            oldGround.onChange = None
+        self.changedGround[loc] = ground
+        if self.groundIndex is not None:
+            self.groundIndex.groundReplaced(loc, oldGround, ground)
+        ground.onChange = lambda item, change: self.groundChanged(loc, item, change)
+
+    def groundChanged(self, loc, item, change):
+        if self.groundIndex is not None:
+            self.groundIndex.itemChanged(loc, item, change)
+
+    def roomsWithItem(self, item, limit):
+        """Returns (list of the IDs of up to limit rooms with item on the
+        ground, how many rooms have it on the ground)."""
+        if self.groundIndex is None:
+            self.groundIndex = GroundIndex(self, getSearchIndex(self.baseWorld))
+        return self.groundIndex.rooms(item, limit)
+
+    """
+    Interest management. Each player only needs to hear about what happens
+    in the room they are in, so instead of going through every player to find
+    the ones in a room, the WorldState keeps an index of each room's
+    occupants, which enterRoom() keeps up to date. Other code can listen to
+    a room with subscribe().
+
+    broadcast() is given the text of something that happened, made once, and
+    hands the same string to each listener. The servers turn it into bytes
+    once as well, so telling fifty players in a busy room that someone
+    dropped a sword costs little more than telling one.
+    """
+    def addSession(self, session):
+        self.occupants.setdefault(session.location, {})[session] = None
+
+    def removeSession(self, session):
+        """Takes session out of this state, such as when the player disconnects."""
+        occupants = self.occupants.get(session.location)
+        if occupants is not None and session in occupants:
+            del occupants[session]
+            if not occupants:
+                del self.occupants[session.location]
+
+    def moveSession(self, session, loc):
+        """Moves the player to the room loc. Use this (or enterRoom()) instead
+        of setting session.location so that occupants stays right."""
+        self.removeSession(session)
+        session.location = loc
+        self.addSession(session)
+
+    def subscribe(self, loc, callback):
+        """Calls callback(loc, text) with the text of everything broadcast
+        to the room loc, until unsubscribe() is called."""
+        self.subscribers.setdefault(loc, []).append(callback)
+
+    def unsubscribe(self, loc, callback):
+        callbacks = self.subscribers[loc]
+        callbacks.remove(callback)
+        if not callbacks:
+            del self.subscribers[loc]
+
+    def broadcast(self, loc, text, exclude=None):
+        """Tells text to every player in the room loc (except the GameSession
+        exclude, usually the player who did what text describes) and to the
+        room's subscribers."""
+        occupants = self.occupants.get(loc)
+        if occupants is not None:
+            for session in occupants:
+                if session is not exclude:
+                    session.notify(text)
+        callbacks = self.subscribers.get(loc)
+        if callbacks is not None:
+            for callback in list(callbacks):
+                callback(loc, text)
+
+    def stock(self, loc, item):
+        """Returns how many of item the shop at loc has, or None if the shop
+        never runs out (which is when the world isn't being simulated)."""
+        if self.scheduler is None:
+            return None
+        return self.shopStock.get((loc, item), SHOP_STOCK)
+
+    def price(self, loc, item):
+        """Returns how many coins the shop at loc charges for item."""
+        if self.economy is None:
+            return basePrice(self.baseWorld, item)
+        return self.economy.price(loc, item)
+
+    def sellPrice(self, loc, item):
+        """Returns how many coins the shop at loc pays for item: a fraction of
+        its lowest price in any shop (see Economy), so it is always less than
+        what it costs to buy."""
+        if self.economy is None:
+            price = basePrice(self.baseWorld, item)
+        else:
+            price = self.economy.lowestPrice(item)
+        return max(1, int(price * SELL_PRICE_FRACTION))
+
+    def changeStock(self, loc, item, change):
+        """Adds change (which is negative when an item is bought) to the
+        stock of item in the shop at loc, and schedules a restock if the shop
+        has fewer than SHOP_STOCK."""
+        if self.scheduler is None:
+            return
+        if self.economy is not None:
+            self.economy.trade(loc, item, change)
+        key = (loc, item)
+        count = self.shopStock.get(key, SHOP_STOCK) + change
+        self.shopStock[key] = count
+        if count < SHOP_STOCK and key not in self.restocking:
+            self.restocking.add(key)
+            self.scheduler.schedule(RESTOCK_SECONDS, self.restock, key)
+
+    def restock(self, key):
+        count = self.shopStock[key] + 1
+        self.shopStock[key] = count
+        if count < SHOP_STOCK:
+            self.scheduler.schedule(RESTOCK_SECONDS, self.restock, key)
+        else:
+            self.restocking.discard(key)
+
+
+class GameSession:
+    """Everything about one player: where they are, what they are carrying,
+    their settings, and the WorldState they are playing in."""
+
+    def __init__(self, state, location=None, inventory=None):
+        self.state = state
+        if location is None:
+            location = state.baseWorld.roomId(startLocation)
+        if inventory is None:
+            inventory = [state.baseWorld.itemId(item) for item in startInventory]
+        self.location = location # the room ID the player is in
+        self.inventory = ItemBag(state.baseWorld.items, inventory)
+        self.showFullExits = True
+        self.money = START_MONEY # in coins
+        self.journal = None # if this is a Journal, every change is recorded in it
+        self.response = Response() # where the player's output goes; TextAdventureCmd gives it a sink
+        self.onEnter = None # if set, called as onEnter(session, loc) when the player walks into a room (see enterRoom())
+        self.onNotify = None # if set, called as onNotify(session, text) to tell the player something between commands
+        self.name = 'Someone' # what other players see this player called
+        state.addSession(self)
+
+    def record(self, change, value, count=1):
+        """Records a change (one of the JOURNAL_* constants) to count of the
+        item value (or to the room or money value) in the journal, if there
+        is one."""
+        if self.journal is not None:
+            self.journal.write(change, value, count)
+
+    def notify(self, text):
+        """Tells the player text, which happened while they weren't typing a
+        command. Unless there is an onNotify function to send it right away,
+        it is shown with the next command's output."""
+        if self.onNotify is not None:
+            self.onNotify(self, text)
+        else:
+            self.response.say(text)
+
+
+"""
+The simulation. Without it, nothing in the world changes between commands.
+With it, a Scheduler runs timed events: the messages in roomEvents, and
+shops restocking the items that players buy.
+
+The Scheduler keeps its events in a heap, ordered by when they are due.
+Adding an event or taking the next one takes O(log n) time however many
+events are waiting, and only events that are due are ever looked at, so
+nothing has to go through every area of the world on each "tick". Areas
+and shops with nothing going on cost nothing.
+
+The Scheduler can run in two ways. Under asyncio (as in the server),
+attach() sets an event loop timer for the next event, so events happen on
+time even when nobody is typing. The terminal game waits in input() instead
+of an event loop, so precmd() calls runDue() before each command to run
+everything that came due while the player was thinking.
+"""
+class Scheduler:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.events = [] # a heap of [when, sequence number, callback, args]
+        self.sequence = itertools.count() # so events due at the same time run in the order they were added
+        self.loop = None # the asyncio event loop, once attach() is called
+        self.timer = None # the event loop's TimerHandle for the next event
+        self.timerWhen = None # when the timer goes off
+        self.running = None # while runDue() runs an event, when that event was due
+        self.eventsRun = 0
+
+    def schedule(self, delay, callback, *args):
+        """Calls callback(*args) in delay seconds. Returns the event, which
+        can be passed to cancel().
+
+        An event that schedules another is treated as having run exactly when
+        it was due, so repeating events don't drift even when runDue() is
+        called late and runs several at once."""
+        now = self.running if self.running is not None else self.clock()
+        event = [now + delay, next(self.sequence), callback, args]
+        self.push(event)
+        return event
+
+    def push(self, event):
+        heapq.heappush(self.events, event)
+        if self.loop is not None and (self.timerWhen is None or event[0] < self.timerWhen):
+            self.setTimer()
+
+    def every(self, interval, callback, *args):
+        """Calls callback(*args) every interval seconds, until it returns
+        False. Returns the event, which can be passed to cancel() to stop the
+        repeats. (The same event is put back in the heap each time.)"""
+        def repeat():
+            if callback(*args) is not False and event[2] is not None:
+                event[0] += interval
+                event[1] = next(self.sequence)
+                self.push(event)
+        event = self.schedule(interval, repeat)
+        return event
+
+    def cancel(self, event):
+        event[2] = None # it stays in the heap, but is skipped when it comes due
+
+    def nextTime(self):
+        """Returns when the next event is due, or None if there are none."""
+        events = self.events
+        while events and events[0][2] is None:
+            heapq.heappop(events)
+        return events[0][0] if events else None
+
+    def runDue(self, now=None):
+        """Runs every event that is due, and returns how many ran."""
+        if now is None:
+            now = self.clock()
+        events = self.events
+        ran = 0
+        try:
+            while events and events[0][0] <= now:
+                when, sequence, callback, args = heapq.heappop(events)
+                if callback is not None:
+                    self.running = when
+                    callback(*args)
+                    ran += 1
+        finally:
+            self.running = None
+        self.eventsRun += ran
+        return ran
+
+    def attach(self, loop):
+        """Runs the events on time from the asyncio event loop loop. From now
+        on the scheduler's clock is loop.time()."""
+        offset = loop.time() - self.clock()
+        for event in self.events:
+            event[0] += offset # adding the same amount to every event keeps the heap in order
+        self.clock = loop.time
+        self.loop = loop
+        self.setTimer()
+
+    def setTimer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timerWhen = self.nextTime()
+        self.timer = None if self.timerWhen is None else self.loop.call_at(self.timerWhen, self.onTimer)
+
+    def onTimer(self):
+        self.timer = None
+        self.runDue()
+        self.setTimer()
+
+
+"""
+Prices. Without the simulation, everything costs what itemPrices says. With
+it, each shop's prices follow supply and demand: every ECONOMY_TICK_SECONDS,
+the price of each item in each shop goes up if players bought more of it
+than they sold it since the last tick, and down if they sold more, and then
+drifts a little of the way back to its usual price.
+
+A big world can have hundreds of thousands of shop and item pairs, and
+going through them one at a time in Python on every tick would be slow. So
+the Economy gives each pair an index and keeps the prices and usual prices
+in arrays. If NumPy is installed, these are NumPy arrays, the trades since
+the last tick are an array too, and tick() updates every price at once,
+with each step of the update a single vectorized operation.
+
+Without NumPy, tick() only goes through the pairs that were traded since
+the last tick. A pair nobody trades only drifts back toward its usual
+price, by the same fraction every tick, so instead of being updated on
+every tick, its price is worked out from how many ticks it has been since
+it was last traded whenever it is needed (see currentPrice()). The game
+works the same either way.
+
+Shops pay SELL_PRICE_FRACTION of the lowest price the item has in any
+shop, rather than of their own price. Otherwise a player could buy an item
+where it's cheap and sell it where it's dear for more than they paid, over
+and over.
+"""
+def basePrice(world, item):
+    """Returns the usual price of item in world, from itemPrices."""
+    return itemPrices.get(world.items[item].name, DEFAULT_PRICE)
+
+
+class Economy:
+    """The prices of everything in every shop in world. useNumpy can be set
+    to False to use the array module even if NumPy is installed."""
+
+    def __init__(self, world, useNumpy=True):
+        self.world = world
+        self.pairIds = {} # (room ID, item ID) -> index into the arrays
+        self.itemPairs = {} # item ID -> list of the indexes of the shops selling it
+        basePrices = []
+        for loc, room in enumerate(world.rooms):
+            if room.shop is not None:
+                for item in room.shop.distinct():
+                    self.pairIds[(loc, item)] = len(basePrices)
+                    self.itemPairs.setdefault(item, []).append(len(basePrices))
+                    basePrices.append(basePrice(world, item))
+        self.lowestPrices = {} # item ID -> its lowest price since the last tick, once something asks for it
+
+        self.numpy = None
+        if useNumpy:
+            try:
+                import numpy # imported here, since most games never need it and it takes a while to import
+                self.numpy = numpy
+            except ImportError:
+                pass
+        if self.numpy is not None:
+            self.basePrices = self.numpy.array(basePrices, dtype=self.numpy.float64)
+            self.prices = self.basePrices.copy()
+            self.minPrices = self.basePrices * MIN_PRICE_FACTOR
+            self.maxPrices = self.basePrices * MAX_PRICE_FACTOR
+            self.netDemand = self.numpy.zeros(len(basePrices)) # items bought minus items sold since the last tick
+        else:
+            self.basePrices = array.array('d', basePrices)
+            self.prices = array.array('d', basePrices) # each price as of the tick in updated
+            self.updated = array.array('q', bytes(len(basePrices) * 8)) # the tick each price was last worked out on
+            self.netDemand = {} # index -> items bought minus items sold since the last tick, for the pairs traded
+        self.ticks = 0
+
+    def currentPrice(self, i):
+        """Returns the exact (not rounded) price of the pair with index i."""
+        if self.numpy is not None:
+            return float(self.prices[i])
+        base = self.basePrices[i]
+        return base + (self.prices[i] - base) * (1 - PRICE_RECOVERY) ** (self.ticks - self.updated[i])
+
+    def price(self, loc, item):
+        """Returns the price of item in the shop at loc, in whole coins."""
+        i = self.pairIds.get((loc, item))
+        if i is None:
+            return basePrice(self.world, item)
+        return max(1, round(self.currentPrice(i)))
+
+    def lowestPrice(self, item):
+        """Returns the lowest price of item in any shop, in whole coins (or
+        its usual price if no shop sells it)."""
+        lowest = self.lowestPrices.get(item)
+        if lowest is None:
+            pairs = self.itemPairs.get(item)
+            if pairs is None:
+                lowest = basePrice(self.world, item)
+            else:
+                lowest = max(1, round(min(self.currentPrice(i) for i in pairs)))
+            self.lowestPrices[item] = lowest
+        return lowest
+
+    def trade(self, loc, item, change):
+        """Records that the stock of item in the shop at loc changed by change
+        (which is negative when players buy it)."""
+        i = self.pairIds.get((loc, item))
+        if i is not None:
+            if self.numpy is not None:
+                self.netDemand[i] -= change
+            else:
+                self.netDemand[i] = self.netDemand.get(i, 0) - change
+
+    def tick(self):
+        """Changes the prices for the trades since the last tick."""
+        self.lowestPrices.clear()
+        if self.numpy is not None:
+            self.ticks += 1
+            prices = self.prices
+            prices *= 1 + (PRICE_SENSITIVITY / SHOP_STOCK) * self.netDemand
+            prices += (self.basePrices - prices) * PRICE_RECOVERY
+            self.numpy.clip(prices, self.minPrices, self.maxPrices, out=prices)
+            self.netDemand.fill(0)
+            return
+
+        # the traded prices are brought up to date, and then changed like
+        # the NumPy version changes them; the rest just drift (see above)
+        for i, net in self.netDemand.items():
+            price = self.currentPrice(i)
+            base = self.basePrices[i]
+            self.prices[i] = min(max(price * (1 + PRICE_SENSITIVITY / SHOP_STOCK * net) * (1 - PRICE_RECOVERY) + base * PRICE_RECOVERY,
+                                     base * MIN_PRICE_FACTOR), base * MAX_PRICE_FACTOR)
+            self.updated[i] = self.ticks + 1
+        self.netDemand.clear()
+        self.ticks += 1
+
+
+def startSimulation(state, scheduler=None):
+    """Starts simulating the WorldState state: schedules its roomEvents and
+    turns on shop stock, restocking and changing prices. Returns the
+    Scheduler."""
+    if scheduler is None:
+        scheduler = Scheduler()
+    state.scheduler = scheduler
+    state.economy = Economy(state.baseWorld)
+    state.simulationEvents.append(scheduler.every(ECONOMY_TICK_SECONDS, state.economy.tick))
+    for roomName, (interval, messages) in roomEvents.items():
+        loc = state.baseWorld.findRoom(roomName)
+        if loc is not None: # the world might not have this room
+            state.simulationEvents.append(scheduler.every(interval, roomEvent, state, loc, messages, itertools.count()))
+    return scheduler
+
+def stopSimulation(state):
+    """Cancels the repeating events that startSimulation() scheduled for
+    state, such as when a restored game replaces it. Returns the Scheduler."""
+    for event in state.simulationEvents:
+        state.scheduler.cancel(event)
+    state.simulationEvents = []
+    return state.scheduler
+
+def roomEvent(state, loc, messages, counter):
+    if loc in state.occupants or loc in state.subscribers: # nobody hears it otherwise
+        state.broadcast(loc, messages[next(counter) % len(messages)])
+
+
+"""
+Saving and restoring games. A save file has two parts:
+
+The snapshot (such as "saves/mygame.sav") is everything about the game that
+can change: the player's location, settings, and inventory, and the ground
+of every area that is different from how the game started. It is written in
+a compact binary format using the struct and array modules, with room and
+item IDs instead of names and each distinct item stored once with its count.
+
+The journal (such as "saves/mygame.sav.journal") records every change made
+after the snapshot was saved: each take, drop, buy, sell, eat, and move is
+added to the end of the journal as a 9-byte record (one for each command,
+so "drop 5 donuts" is one record with a count of 5). Restoring a game reads
+the snapshot in one go and then replays the (short) journal, which is much
+faster than replaying every command the player ever typed.
+
+All the numbers are unsigned, little-endian, and 4 bytes long except where
+the format strings below say otherwise.
+"""
+SAVE_MAGIC = b'TADS'
+SAVE_VERSION = 3
+SAVE_HEADER = struct.Struct('<4sHIIIIBI') # magic, version, world fingerprint, room count, item count, location, showFullExits, money
+SAVE_COUNT = struct.Struct('<I')
+JOURNAL_RECORD = struct.Struct('<BII') # change, room or item ID (or money), count
+
+JOURNAL_MOVE = 1 # the player moved to the room
+JOURNAL_TAKE = 2 # the player took the item from the ground
+JOURNAL_DROP = 3 # the player dropped the item onto the ground
+JOURNAL_BUY = 4 # the player bought the item
+JOURNAL_SELL = 5 # the player sold the item
+JOURNAL_EAT = 6 # the player ate the item
+JOURNAL_MONEY = 7 # the player's money changed to this many coins
+
+class Journal:
+    """An append-only file of the changes made to a game since its snapshot
+    was saved."""
+
+    def __init__(self, filename, truncate=False):
+        self.filename = filename
+        self.file = open(filename, 'wb' if truncate else 'ab')
+
+    def write(self, change, value, count=1):
+        self.file.write(JOURNAL_RECORD.pack(change, value, count))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def packItemBag(bag):
+    """Returns the bytes for an ItemBag: the number of distinct items, then
+    pairs of item ID and count."""
+    pairs = array.array('I')
+    for item, count in bag.items():
+        pairs.append(item)
+        pairs.append(count)
+    if sys.byteorder != 'little':
+        pairs.byteswap()
+    return SAVE_COUNT.pack(len(bag.counts)) + pairs.tobytes()
+
+def unpackItemBag(data, offset, itemTable):
+    """Returns (ItemBag, offset) for the ItemBag packed at offset in data,
+    where the returned offset is just past the end of it."""
+    distinct = SAVE_COUNT.unpack_from(data, offset)[0]
+    offset += SAVE_COUNT.size
+    pairs = array.array('I')
+    pairs.frombytes(data[offset:offset + distinct * 2 * pairs.itemsize])
+    if len(pairs) != distinct * 2:
+        raise ValueError('the save file is cut short')
+    if sys.byteorder != 'little':
+        pairs.byteswap()
+    bag = ItemBag(itemTable)
+    for i in range(0, len(pairs), 2):
+        if pairs[i] >= len(itemTable) or pairs[i + 1] == 0:
+            raise ValueError('the save file has an item that is not in the world')
+        bag.add(pairs[i], pairs[i + 1])
+    return bag, offset + len(pairs) * pairs.itemsize
+
+
+def saveGame(session, filename):
+    """Saves a snapshot of session (and the ground in its WorldState) to
+    filename, and starts a new, empty journal for the session next to it."""
+    world = session.state.baseWorld
+    parts = [SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, world.fingerprint(), len(world.rooms),
+                              len(world.items), session.location, session.showFullExits, session.money),
+             packItemBag(session.inventory),
+             SAVE_COUNT.pack(len(session.state.changedGround))]
+    for loc, ground in session.state.changedGround.items():
+        parts.append(SAVE_COUNT.pack(loc))
+        parts.append(packItemBag(ground))
+
+    # write to a temporary file first so that a crash while saving doesn't
+    # destroy the previous save
+    with open(filename + '.tmp', 'wb') as saveFile:
+        saveFile.write(b''.join(parts))
+    os.replace(filename + '.tmp', filename)
+
+    if session.journal is not None:
+        session.journal.close()
+    session.journal = Journal(filename + '.journal', truncate=True)
+
+
+def loadGame(filename, world=None):
+    """Returns a new GameSession (with its own WorldState) restored from the
+    snapshot in filename and its journal. Raises ValueError if the file isn't
+    a save file for this world. The session keeps adding to the journal."""
+    if world is None:
+        world = gameWorld
+    with open(filename, 'rb') as saveFile:
+        data = saveFile.read()
+
+    if len(data) < SAVE_HEADER.size:
+        raise ValueError('%s is not a save file' % (filename))
+    magic, version, fingerprint, roomCount, itemCount, location, showFullExits, money = SAVE_HEADER.unpack_from(data)
+    if magic != SAVE_MAGIC or version != SAVE_VERSION:
+        raise ValueError('%s is not a save file' % (filename))
+    if fingerprint != world.fingerprint() or roomCount != len(world.rooms) or itemCount != len(world.items):
+        raise ValueError('%s was saved in a different game world' % (filename))
+
+    if location >= len(world.rooms):
+        raise ValueError('%s has a location that is not in the world' % (filename))
+
+    offset = SAVE_HEADER.size
+    state = WorldState(world)
+    try:
+        inventory, offset = unpackItemBag(data, offset, world.items)
+        changedRooms = SAVE_COUNT.unpack_from(data, offset)[0]
+        offset += SAVE_COUNT.size
+        for i in range(changedRooms):
+            loc = SAVE_COUNT.unpack_from(data, offset)[0]
+            if loc >= len(world.rooms):
+                raise ValueError('%s has an area that is not in the world' % (filename))
+            ground, offset = unpackItemBag(data, offset + SAVE_COUNT.size, world.items)
+            state.setGround(loc, ground)
+    except struct.error:
+        raise ValueError('%s is cut short' % (filename)) from None
+
+    session = GameSession(state, location, ())
+    session.inventory = inventory
+    session.showFullExits = bool(showFullExits)
+    session.money = money
+    if os.path.exists(filename + '.journal'):
+        replayJournal(session, filename + '.journal')
+    session.journal = Journal(filename + '.journal')
+    return session
+
+
+def replayJournal(session, filename):
+    """Applies the changes recorded in the journal file to session."""
+    with open(filename, 'rb') as journalFile:
+        data = journalFile.read()
+    data = data[:len(data) - len(data) % JOURNAL_RECORD.size] # ignore a half-written last record
+    world = session.state.baseWorld
+    for change, value, count in JOURNAL_RECORD.iter_unpack(data):
+        if change != JOURNAL_MONEY and value >= len(world.rooms if change == JOURNAL_MOVE else world.items):
+            raise ValueError('%s has a change to an area or item that is not in the world' % (filename))
+        if change == JOURNAL_MOVE:
+            session.state.moveSession(session, value)
+        elif change == JOURNAL_TAKE:
+            session.state.groundForUpdate(session.location).remove(value, count)
+            session.inventory.add(value, count)
+        elif change == JOURNAL_DROP:
+            session.inventory.remove(value, count)
+            session.state.groundForUpdate(session.location).add(value, count)
+        elif change == JOURNAL_BUY:
+            session.inventory.add(value, count)
+        elif change in (JOURNAL_SELL, JOURNAL_EAT):
+            session.inventory.remove(value, count)
+        elif change == JOURNAL_MONEY:
+            session.money = value
+        else:
+            raise ValueError('%s has an unknown change %s' % (filename, change))
+
+
+def getSaveFilename(name):
+    """Returns the filename in SAVE_DIRECTORY for the save called name, or
+    None if name isn't a valid save name. Only letters, numbers, - and _ are
+    allowed so that players (who might be connected over the network) can't
+    write files anywhere else."""
+    if re.fullmatch(r'[A-Za-z0-9_-]{1,64}', name) is None:
+        return None
+    return os.path.join(SAVE_DIRECTORY, name + '.sav')
+
+
+"""
+Recording sessions. A save file and its journal record what a game's state
+is, but not how the player got there, so a bug report like "the bakery
+gave me the wrong item" can't be reproduced from them. A recording (see
+"--record" below, and "--record-dir" in the server) is every command the
+player gave, in order, with how long after the previous command it was
+given. Replaying it (see "--replay") gets back the player's state after
+any number of commands.
+
+Recordings are compact because nothing is stored as text if it can be
+stored as a number. Each command is stored as its verb ID (the position
+of its full name in verbNames, so "n" and "north" are the same verb)
+and each word after it as its position in the vocabulary: the
+directions, the desc words of every item, and the words parseNounPhrase()
+knows. Words that aren't in the vocabulary, like the names of save games,
+are stored as text. The numbers are varints: 7 bits in each byte, with the
+high bit set on every byte but the last, so numbers under 128 (nearly all
+of them) take one byte. A typical command takes four or five bytes.
+
+Replaying calls each command's do_*() method directly, with output that
+is thrown away without being rendered, and skips the commands that only
+display things (like "look" and "inventory"), and "save" so that save files
+aren't overwritten. The recording names the command class the player used
+(TextAdventureCmd, or SharedWorldCmd in the servers), and the replay uses
+the same one, so the commands do exactly what they did: "restore" loads
+whatever the save file has in it at the time of the replay, except in a
+server recording, where it did nothing. With the world simulated
+(see startSimulation()), the simulation runs on a clock that follows the
+recorded times instead of the real one, so shops sell out and restock
+exactly as they did. The recording only has this player's commands, so in
+the server, what other players did in the same world isn't replayed.
+"""
+RECORDING_MAGIC = b'TADR'
+RECORDING_VERSION = 2
+RECORDING_HEADER = struct.Struct('<4sHIIB') # magic, version, world fingerprint, vocabulary checksum, flags, then the command class's name as a varint length and UTF-8
+RECORDING_SIMULATED = 1 # flag for recordings of a simulated world
+DISPLAY_ONLY_COMMANDS = frozenset(['look', 'inventory', 'list', 'help', 'stats', 'save', 'search', 'where'])
+
+def packVarint(number, out):
+    """Adds the varint bytes for the non-negative number to the bytearray out."""
+    while number >= 0x80:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+def unpackVarint(data, offset):
+    """Returns (number, offset) for the varint at offset in data, where the
+    returned offset is just past the end of it."""
+    number = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+recordingVocabularies = {} # world fingerprint -> (words, word -> index, checksum)
+
+def recordingVocabulary(world, verbNames):
+    """Returns (list of words, dictionary of word -> index, checksum) for
+    recordings of commands in world. The checksum changes if the verbs or
+    the vocabulary do, which would change what the numbers in a recording
+    mean."""
+    key = (world.fingerprint(), tuple(verbNames))
+    if key not in recordingVocabularies:
+        words = list(EXIT_DIRECTIONS)
+        for item in world.items:
+            words.extend(item.descWords)
+        words.extend(sorted(STOP_WORDS))
+        words.extend(NUMBER_WORDS)
+        words.extend(sorted(ALL_WORDS))
+        words.extend(sorted(PREPOSITIONS))
+        words = list(dict.fromkeys(words)) # without repeats, in the same order
+        checksum = zlib.crc32('\0'.join(words + verbNames[1:]).encode())
+        recordingVocabularies[key] = (words, {word: i for i, word in enumerate(words)}, checksum)
+    return recordingVocabularies[key]
+
+
+class SessionRecorder:
+    """Records the commands a player gives (see TextAdventureCmd.dispatch())
+    to the file filename. cmdClass is the player's TextAdventureCmd class
+    (or subclass). If simulated is True, started should be when the
+    simulation started (by clock), if that was before now. If overwrite is
+    False, raises FileExistsError instead of replacing an existing file."""
+
+    def __init__(self, filename, world, cmdClass, simulated=False, clock=time.monotonic, started=None, overwrite=True):
+        self.filename = filename
+        self.verbNames = cmdClass.verbNames
+        self.clock = clock
+        self.lastTime = clock() if started is None else started
+        words, self.wordIds, checksum = recordingVocabulary(world, cmdClass.verbNames)
+        header = bytearray(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, world.fingerprint(), checksum,
+                                                 RECORDING_SIMULATED if simulated else 0))
+        className = cmdClass.__qualname__.encode()
+        packVarint(len(className), header)
+        header += className
+        self.file = open(filename, 'wb' if overwrite else 'xb')
+        self.file.write(header)
+        self.commands = 0
+
+    def record(self, verb, words):
+        """Records the command with verb ID verb, and the list of words after it."""
+        now = self.clock()
+        data = bytearray()
+        packVarint(max(0, round((now - self.lastTime) * 1000)), data) # milliseconds since the last command
+        self.lastTime = now
+        packVarint(verb, data)
+        packVarint(len(words), data)
+        for word in words:
+            wordId = self.wordIds.get(word)
+            if wordId is not None:
+                packVarint(wordId * 2, data)
+            else:
+                encoded = word.encode()
+                packVarint(len(encoded) * 2 + 1, data) # odd numbers are the length of a word stored as text
+                data += encoded
+        self.file.write(data)
+        self.commands += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def findCommandClass(name):
+    """Returns TextAdventureCmd or the subclass of it called name (as
+    __qualname__ gives it), or None if there isn't one."""
+    classes = [TextAdventureCmd]
+    for cls in classes:
+        if cls.__qualname__ == name:
+            return cls
+        classes.extend(cls.__subclasses__())
+    return None
+
+
+def readRecording(filename, world, cmdClass=None):
+    """Returns (command class, simulated, list of (seconds since the
+    previous command, verb ID, list of words)) for the recording in
+    filename. The command class is the one named in the recording, unless
+    cmdClass is given. Raises ValueError if the file isn't a recording made
+    in this world with that class's verbs, or has a verb or word ID that
+    isn't in them. A last command that is cut short (because the game
+    stopped while writing it) is left out."""
+    with open(filename, 'rb') as recordingFile:
+        data = recordingFile.read()
+    if len(data) < RECORDING_HEADER.size:
+        raise ValueError('%s is not a recording' % (filename))
+    magic, version, fingerprint, checksum, flags = RECORDING_HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError('%s is not a recording' % (filename))
+    try:
+        length, offset = unpackVarint(data, RECORDING_HEADER.size)
+        className = data[offset:offset + length].decode()
+    except (IndexError, UnicodeDecodeError):
+        raise ValueError('%s is not a recording' % (filename)) from None
+    offset += length
+    if cmdClass is None:
+        cmdClass = findCommandClass(className)
+        if cmdClass is None:
+            raise ValueError('%s was recorded with %s, which this game does not have' % (filename, className))
+    verbNames = cmdClass.verbNames
+    words, wordIds, expectedChecksum = recordingVocabulary(world, verbNames)
+    if fingerprint != world.fingerprint() or checksum != expectedChecksum:
+        raise ValueError('%s was recorded in a different game world or version of the game' % (filename))
+
+    commands = []
+    try:
+        while offset < len(data):
+            delay, offset = unpackVarint(data, offset)
+            verb, offset = unpackVarint(data, offset)
+            if verb >= len(verbNames):
+                raise ValueError('%s has a command that is not in this version of the game' % (filename))
+            wordCount, offset = unpackVarint(data, offset)
+            commandWords = []
+            for i in range(wordCount):
+                wordId, offset = unpackVarint(data, offset)
+                if wordId & 1:
+                    length = wordId >> 1
+                    if offset + length > len(data):
+                        raise IndexError # the data ran out
+                    commandWords.append(data[offset:offset + length].decode())
+                    offset += length
+                elif wordId >> 1 < len(words):
+                    commandWords.append(words[wordId >> 1])
+                else:
+                    raise ValueError('%s has a word that is not in the vocabulary' % (filename))
+            commands.append((delay / 1000, verb, commandWords))
+    except IndexError:
+        # only unpackVarint() running out of data (or the check above)
+        # raises this, so it's a half-written last command, which is
+        # ignored like replayJournal() does
+        pass
+    return cmdClass, bool(flags & RECORDING_SIMULATED), commands
+
+
+class QuietResponse(Response):
+    """A Response that throws away everything said to it. displayLocation()
+    doesn't even render the area for it."""
+    quiet = True
+
+    def say(self, *args, sep=' ', end='\n'):
+        pass
+
+    def write(self, text):
+        return len(text)
+
+    def send(self):
+        pass
+
+
+def replayRecording(filename, cmdClass=None, limit=None, world=None):
+    """Returns (GameSession, number of commands replayed, seconds of play
+    they took) for the player in the recording in filename, after replaying
+    the first limit commands (or all of them, if limit is None). The
+    commands are replayed with the command class they were recorded with,
+    unless cmdClass is given."""
+    if world is None:
+        world = gameWorld
+    cmdClass, simulated, commands = readRecording(filename, world, cmdClass)
+    if limit is not None:
+        commands = commands[:limit]
+
+    session = GameSession(WorldState(world))
+    cmdObj = cmdClass(session, sink=MemorySink())
+    cmdObj.response = session.response = cmdObj.stdout = QuietResponse()
+    playTime = 0.0
+    scheduler = None
+    if simulated:
+        scheduler = startSimulation(session.state, Scheduler(clock=lambda: playTime))
+    verbNames = cmdClass.verbNames
+    commandTable = cmdClass.commandTable
+    replayed = 0
+    for delay, verb, words in commands:
+        playTime += delay
+        replayed += 1
+        if scheduler is not None:
+            scheduler.runDue(playTime)
+        if verb == 0 or verbNames[verb] in DISPLAY_ONLY_COMMANDS:
+            continue # an unknown command, or one that changes nothing
+        if commandTable[verbNames[verb]](cmdObj, ' '.join(words)):
+            break # the player quit
+    if scheduler is not None:
+        # from now on the simulation carries on in real time, from where the
+        # recording left off
+        resumed = time.monotonic()
+        scheduler.clock = lambda: playTime + time.monotonic() - resumed
+    session.response = Response()
+    return session, replayed, playTime
+
 
 def getAllFirstDescWords(itemList):
     """Returns a list of the first "description word" in the list of
     description words for each item named in itemList."""
-    itemList = list(set(itemList)) # make itemList unique
-    descWords = []
-    for item in itemList:
-        descWords.append(objects[item][DESCWORDS][0])
-    return list(set(descWords))
+    return list(itemList.descIndex.firstWords)
 
 def getAllDescWords(itemList):
     """Returns a list of "description words" for each item named in itemList."""
-    itemList = list(set(itemList)) # make itemList unique
-    descWords = []
-    for item in itemList:
-        descWords.extend(objects[item][DESCWORDS])
-    return list(set(descWords))
+    return list(itemList.descIndex.words)
+
+def isTakeable(item):
+    return gameWorld.items[item].takeable
+
+def isEdible(item):
+    return gameWorld.items[item].edible
+
+"""
+DIRECTIONS is sorted so that directions can be tab completed with bisect in
+the same way as the desc words in a DescIndex.
+"""
+DIRECTIONS = sorted((NORTH, SOUTH, EAST, WEST, UP, DOWN))
+
+def completeDirections(prefix, loc=None):
+    """Returns the directions that start with prefix. If loc is given, only
+    the directions with an exit from that area are returned."""
+    completions = []
+    i = bisect.bisect_left(DIRECTIONS, prefix)
+    while i < len(DIRECTIONS) and DIRECTIONS[i].startswith(prefix):
+        if loc is None or gameWorld.rooms[loc].exit(DIRECTIONS[i]) != NO_EXIT:
+            completions.append(DIRECTIONS[i])
+        i += 1
+    return completions
+
+def completeItemWords(text, line, itemBags, itemFilter=None, exitsFrom=None):
+    """The tab completion engine used by all of the complete_*() methods.
+
+    Returns the desc words of the items in itemBags (and the direction names,
+    if exitsFrom is a room ID) that start with text. If text is blank, the
+    first desc word of each item is returned instead (along with the exits
+    from the exitsFrom room). itemFilter is a function such as isTakeable()
+    that, if given, decides which items can be completed."""
+    directions = exitsFrom is not None
+    # if the argument already typed starts with a complete desc word, the
+    # command is complete and there's nothing left to suggest
+    argument = line.split(None, 1)[1] if ' ' in line.strip() else ''
+    for i in range(1, len(argument) + 1):
+        if (directions and argument[:i] in DIRECTIONS) or \
+           any(argument[:i] in itemBag.descIndex.words for itemBag in itemBags):
+            return []
+
+    prefix = text.lower().strip()
+    completions = []
+    for itemBag in itemBags:
+        if prefix == '':
+            completions.extend(itemBag.descIndex.completeFirstWords(itemFilter))
+        else:
+            completions.extend(itemBag.descIndex.complete(prefix, itemFilter))
+    if directions:
+        completions.extend(completeDirections(prefix, exitsFrom if prefix == '' else None))
+    return list(dict.fromkeys(completions)) # make list unique, keeping the order
 
 def getFirstItemMatchingDesc(desc, itemList):
-    itemList = list(set(itemList)) # make itemList unique
-    for item in itemList:
-        if desc in objects[item][DESCWORDS]:
-            return item
-    return None
+    matches = matchItems(parseNounPhrase(desc), itemList)
+    return matches[0] if matches else None
 
 def getAllItemsMatchingDesc(desc, itemList):
-    pass # TODO - not sure if I'll need this
-    itemList = list(set(itemList)) # make itemList unique
-    matchingItems = []
-    for item in itemList:
-        if desc in objects[item][DESCWORDS]:
-            matchingItems.append(item)
-    return matchingItems
+    return matchItems(parseNounPhrase(desc), itemList)
+
+
+"""
+Parsing. Players can type things like "pick up the floating book", "buy 3
+donuts" or "look at the welcome sign" instead of just a command and one
+description word. parseCommand() works out the command, and
+parseNounPhrase() turns the rest into a NounPhrase:
+
+    quantity     a number ("3" or "three") if one was typed, up to MAX_QUANTITY
+    everything   True if the player typed "all" (as in "drop all donuts", or
+                 "drop all" on its own, which take and drop handle as
+                 every item)
+    words        the words describing the item, without STOP_WORDS like "the"
+    preposition  a word in PREPOSITIONS, like "from" or "with", and the
+    indirect     words after it, describing a second thing (no command uses
+                 these yet)
+
+The grammar is compiled into dictionaries and sets when the program starts,
+so looking up a word is a single dictionary lookup, and VERB_SYNONYMS is
+compiled into verbTable by compileVerbs(). Players type the same few lines
+over and over, so parsed lines are kept in LRU caches (the same kind as
+renderCache) and a line that was typed before isn't parsed again at all.
+
+Which item the words mean depends on what is nearby, so that is worked out
+each time by matchItems(). The last word that describes something in the
+container is the noun, and the other words (adjectives like "floating" or
+"welcome") must describe the same item. Words that describe nothing in the
+container are ignored, plurals like "donuts" match "donut", and two words
+like "lock picks" match the desc word "lockpicks".
+"""
+VERB_SYNONYMS = {
+    'get': 'take', 'grab': 'take', 'pick up': 'take',
+    'put down': 'drop', 'discard': 'drop',
+    'go': 'move', 'walk': 'move', 'run': 'move', 'head': 'move', 'climb': 'move',
+    'go to': 'goto', 'walk to': 'goto', 'travel to': 'goto',
+    'examine': 'look', 'inspect': 'look', 'read': 'look', 'x': 'look', 'l': 'look',
+    'i': 'inventory',
+    'purchase': 'buy',
+    'consume': 'eat', 'devour': 'eat',
+    }
+STOP_WORDS = frozenset(['the', 'a', 'an', 'some', 'my', 'your', 'this', 'that', 'these', 'those', 'at', 'to', 'of', 'please'])
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
+ALL_WORDS = frozenset(['all', 'every', 'each', 'both'])
+PREPOSITIONS = frozenset(['from', 'in', 'into', 'on', 'onto', 'with', 'under', 'inside', 'off'])
+PUNCTUATION = '.,!?;:"\''
+MAX_QUANTITY = 1000 # "buy 99999 donuts" buys this many at most
+
+def compileVerbs(synonyms):
+    """Returns a dictionary that maps the first word of each synonym in
+    synonyms to a list of (tuple of the synonym's words, command) pairs,
+    with the longest synonyms first so that "go to" is tried before "go"."""
+    verbs = {}
+    for synonym, command in synonyms.items():
+        words = tuple(synonym.split())
+        verbs.setdefault(words[0], []).append((words, command))
+    for phrases in verbs.values():
+        phrases.sort(key=lambda phrase: -len(phrase[0]))
+    return verbs
+
+verbTable = compileVerbs(VERB_SYNONYMS)
+phraseCache = RenderCache(PARSE_CACHE_SIZE) # text -> NounPhrase
+
+def parseCommand(line, commandTable):
+    """Returns (command, args) for line, where command is the command
+    (something in commandTable, if the line makes sense) and args is the rest
+    of the line. A synonym is only used if the word isn't already a command."""
+    words = line.split()
+    first = words[0].lower()
+    for synonym, command in verbTable.get(first, ()):
+        if len(synonym) > 1:
+            if len(words) >= len(synonym) and tuple(word.lower() for word in words[:len(synonym)]) == synonym:
+                return command, ' '.join(words[len(synonym):])
+        elif first not in commandTable:
+            return command, ' '.join(words[1:])
+    return first, ' '.join(words[1:])
+
+
+class NounPhrase:
+    """The parsed description of an item, such as "3 floating books" (see
+    above). Use parseNounPhrase() to get one, so that it is cached."""
+    __slots__ = ('quantity', 'everything', 'words', 'preposition', 'indirect')
+
+    def __init__(self, text):
+        self.quantity = None
+        self.everything = False
+        self.preposition = None
+        words = []
+        indirect = None
+        for word in text.lower().split():
+            word = word.strip(PUNCTUATION)
+            if word == '' or word in STOP_WORDS:
+                continue
+            if not words and indirect is None and self.quantity is None and not self.everything:
+                if word.isdecimal() and word.strip('0'):
+                    # (a number with more digits than MAX_QUANTITY is more than it)
+                    digits = word.lstrip('0')
+                    self.quantity = MAX_QUANTITY if len(digits) > len(str(MAX_QUANTITY)) else min(int(digits), MAX_QUANTITY)
+                    continue
+                if word in NUMBER_WORDS:
+                    self.quantity = NUMBER_WORDS[word]
+                    continue
+                if word in ALL_WORDS:
+                    self.everything = True
+                    continue
+            if word in PREPOSITIONS and words and indirect is None:
+                self.preposition = word
+                indirect = []
+                continue
+            if indirect is None:
+                words.append(word)
+            else:
+                indirect.append(word)
+        self.words = tuple(words)
+        self.indirect = tuple(indirect or ())
+
+    def howMany(self, available):
+        """Returns how many of an item the player asked for, when there are
+        available of them."""
+        if self.everything:
+            return available
+        if self.quantity is None:
+            return min(1, available)
+        return min(self.quantity, available)
+
+    def __repr__(self):
+        return 'NounPhrase(quantity=%r, everything=%r, words=%r, preposition=%r, indirect=%r)' % (
+            self.quantity, self.everything, self.words, self.preposition, self.indirect)
+
+def parseNounPhrase(text):
+    """Returns the NounPhrase for text, from phraseCache if it was parsed before."""
+    phrase = phraseCache.get(text)
+    if phrase is None:
+        phrase = NounPhrase(text)
+        phraseCache.put(text, phrase)
+    return phrase
+
+def knownWords(words, vocabulary, fuzzy=None):
+    """Returns the words in words that are in vocabulary (a DescIndex's
+    words), after joining pairs like "lock picks" or "t shirt" into one
+    word and turning plurals into the singular. If fuzzy (a FuzzyIndex) is
+    given, a word that is closest to a single word in vocabulary (see
+    closestWords()) is corrected to it. Other words are left out."""
+    known = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        if i + 1 < len(words):
+            nextWord = words[i + 1]
+            joined = None
+            for joined in (word + nextWord, word + '-' + nextWord, word + ' ' + nextWord):
+                if joined in vocabulary:
+                    break
+            else:
+                joined = None
+            if joined is not None:
+                known.append(joined)
+                i += 2
+                continue
+        if word not in vocabulary:
+            if word.endswith('es') and word[:-2] in vocabulary:
+                word = word[:-2]
+            elif word.endswith('s') and word[:-1] in vocabulary:
+                word = word[:-1]
+            else:
+                corrections = closestWords(fuzzy, word, vocabulary) if fuzzy is not None else ()
+                word = corrections[0] if len(corrections) == 1 else None
+        if word is not None:
+            known.append(word)
+        i += 1
+    return known
+
+def matchItems(phrase, itemBag):
+    """Returns a list of the distinct item IDs in itemBag that the NounPhrase
+    phrase describes."""
+    vocabulary = itemBag.descIndex.words
+    words = phrase.words
+    if len(words) == 1 and words[0] in vocabulary:
+        return list(vocabulary[words[0]]) # the usual case: a single desc word
+    known = knownWords(words, vocabulary)
+    matches = describedItems(known, itemBag)
+    if not matches:
+        # only look for typos if the words as typed don't describe anything,
+        # so an adjective that isn't a desc word can't get "corrected"
+        matches = describedItems(knownWords(words, vocabulary, fuzzyWords), itemBag)
+    return matches
+
+def describedItems(known, itemBag):
+    """Returns a list of the item IDs in itemBag that the desc words in the
+    list known describe, where the last one is the noun."""
+    if not known:
+        return []
+    adjectives = known[:-1]
+    items = itemBag.itemTable
+    return [item for item in itemBag.descIndex.words[known[-1]]
+            if all(adjective in items[item].descWords for adjective in adjectives)]
+
+
+"""
+Typos. If a player types "take donnut" or "go nroth", the words they typed
+aren't desc words or directions, but they are only one typo away from
+"donut" and "north". Comparing what was typed with every word the game knows
+would find them, but that takes longer the more words there are.
+
+Instead, a FuzzyIndex is made of the desc words of every item in the world
+(and another of the directions) when the world is loaded. It is a "symmetric
+delete" index: every word is stored under each string that deleting up to
+FUZZY_MAX_EDITS letters from it makes, so "north" is stored under "north",
+"orth", "nrth", "noth" and so on. Two words that are a few typos apart (a
+wrong, missing, extra or swapped letter) always have one of these deletes in
+common: "nroth" has "nrth" too. So looking up a typo is a handful of
+dictionary lookups for its own deletes, however many words the index has,
+and only the words found this way are checked with editDistance().
+
+Short words allow fewer typos (see allowedEdits()), since "up" is only one
+typo away from lots of words. Long words have a lot of deletes (a word of
+n letters has about n * n / 2 with two letters deleted), so words longer
+than FUZZY_MAX_LENGTH aren't indexed, and a typo more than a few letters
+longer than the longest word in the index isn't looked up at all. Otherwise
+a player could type a thousand letters and keep the server busy for
+seconds working out their deletes. A typo is only corrected when one word is
+closer to it than any other; "go est" could be "east" or "west", so the
+player is asked which they meant.
+"""
+FUZZY_MAX_EDITS = 2 # the most typos that are corrected in one word
+FUZZY_MAX_LENGTH = 32 # longer words aren't indexed or corrected, since they have too many deletes
+
+def allowedEdits(word):
+    """Returns how many typos can be corrected in word, depending on its length."""
+    if len(word) < 3:
+        return 0
+    if len(word) < 6:
+        return 1
+    return FUZZY_MAX_EDITS
+
+def deleteVariants(word, edits):
+    """Returns the set of strings made by deleting up to edits letters from word (and word itself)."""
+    variants = {word}
+    deleted = {word}
+    for i in range(edits):
+        deleted = {variant[:j] + variant[j + 1:] for variant in deleted for j in range(len(variant))}
+        variants |= deleted
+    return variants
+
+def editDistance(first, second, limit):
+    """Returns how many typos (letters changed, added, removed, or two
+    letters swapped) it takes to turn first into second, or limit + 1 if it
+    takes more than limit."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    # the usual dynamic programming table, one row at a time: row[j] is the
+    # distance between the first i letters of first and the first j of second
+    twoRowsAgo = None
+    lastRow = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        row = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            row[j] = min(lastRow[j] + 1, row[j - 1] + 1, lastRow[j - 1] + cost)
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                row[j] = min(row[j], twoRowsAgo[j - 2] + 1) # two letters swapped
+        if min(row) > limit:
+            return limit + 1
+        twoRowsAgo, lastRow = lastRow, row
+    return min(lastRow[-1], limit + 1)
+
+
+class FuzzyIndex:
+    """A symmetric delete index of a vocabulary of words (see above), which
+    finds the words that a typo could have meant. Words can be added and
+    removed at any time."""
+
+    def __init__(self, words=()):
+        self.words = set()
+        self.deletes = {} # a word with up to FUZZY_MAX_EDITS letters deleted -> {word: None}
+        self.lengths = collections.Counter() # word length -> how many words in the index are that long
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if word in self.words or len(word) > FUZZY_MAX_LENGTH:
+            return
+        self.words.add(word)
+        self.lengths[len(word)] += 1
+        for variant in deleteVariants(word, FUZZY_MAX_EDITS):
+            self.deletes.setdefault(variant, {})[word] = None
+
+    def remove(self, word):
+        if word not in self.words:
+            return
+        self.words.remove(word)
+        self.lengths[len(word)] -= 1
+        if self.lengths[len(word)] == 0:
+            del self.lengths[len(word)]
+        for variant in deleteVariants(word, FUZZY_MAX_EDITS):
+            words = self.deletes[variant]
+            del words[word]
+            if not words:
+                del self.deletes[variant]
+
+    def lookup(self, typo, vocabulary=None):
+        """Returns a list of (edits, word) pairs for the words within
+        allowedEdits(typo) typos of typo, closest first. If vocabulary is
+        given, only words in it are returned."""
+        edits = allowedEdits(typo)
+        if not self.lengths or len(typo) > max(self.lengths) + edits:
+            return [] # too long to be a typo of anything in the index
+        candidates = {}
+        for variant in deleteVariants(typo, edits):
+            for word in self.deletes.get(variant, ()):
+                if word not in candidates and (vocabulary is None or word in vocabulary):
+                    candidates[word] = editDistance(typo, word, edits)
+        return sorted((distance, word) for word, distance in candidates.items() if distance <= edits)
+
+def closestWords(fuzzy, typo, vocabulary=None):
+    """Returns a list of the words in the FuzzyIndex fuzzy (and in vocabulary,
+    if given) that are closest to typo, if any are close enough."""
+    matches = fuzzy.lookup(typo, vocabulary)
+    return [word for distance, word in matches if distance == matches[0][0]]
+
+def worldDescWords(world):
+    """Returns the set of every desc word of the items in world."""
+    return {descWord for item in world.items for descWord in item.descWords}
+
+def useFuzzyWords(world):
+    """Changes fuzzyWords to have the desc words of world, adding and
+    removing just the words that differ from the world it had before."""
+    words = worldDescWords(world)
+    for word in fuzzyWords.words - words:
+        fuzzyWords.remove(word)
+    for word in words - fuzzyWords.words:
+        fuzzyWords.add(word)
+
+def correctDirection(direction):
+    """Returns a list of the directions that direction (which isn't one)
+    could be a typo of: none, one, or several that are equally close."""
+    return closestWords(fuzzyDirections, direction)
+
+fuzzyWords = FuzzyIndex(worldDescWords(gameWorld))
+fuzzyDirections = FuzzyIndex(EXIT_DIRECTIONS)
+startupCheckpoint('fuzzy index')
+
+def formatMoney(coins):
+    return '1 coin' if coins == 1 else '%s coins' % (coins)
+
+def describeCount(item, count):
+    """Returns the item's short description, with how many if there is more than one."""
+    if count == 1:
+        return gameWorld.items[item].shortDesc
+    return '%s (x%s)' % (gameWorld.items[item].shortDesc, count)
+
+"""
+Searching. "search <words>" finds the areas and items that are described
+with the words, and "where <item>" says where an item is. Neither looks
+through the world to answer: a SearchIndex of the world is built once
+(which does go through every area and item), and from then on each search
+only looks at the areas and items that use its words. The servers build it
+when they start; in the terminal game the first search builds it.
+
+The SearchIndex is an inverted index: for each word, a list of the
+documents that use it, where the documents are each area's name and DESC
+and each item's name, desc words, GROUNDDESC, SHORTDESC and LONGDESC. The
+results are ranked with BM25: a document scores more for using a word
+more often, less for being long, and more for rare words than for common
+ones. Each word's list is sorted with the documents it counts for most
+first, and when a word is used by more than SEARCH_SCAN_LIMIT documents
+only that many of the best ones are kept, so a search for a common word in
+a huge world takes no longer than in a small one.
+
+The SearchIndex also has which areas each item is on the ground in (and
+for sale in) when the game starts. Players drop and take things, so each
+WorldState has a GroundIndex for the areas whose ground has changed. It is
+kept up to date as items are dropped and taken, by the onChange of the
+ground ItemBags that WorldState.setGround() gives the state.
+"""
+SEARCH_RESULTS = 5 # how many results "search" shows
+SEARCH_SCAN_LIMIT = 5000 # the most documents kept for each word, best first
+WHERE_RESULTS = 5 # how many areas "where" names for each kind of place
+BM25_K1 = 1.2 # how much less each extra use of a word in a document counts
+BM25_B = 0.75 # how much a document's length counts against it
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*(?:'[a-z]+)?")
+
+def tokenize(text):
+    """Returns the list of searchable words in text: lowercase, without
+    punctuation, "'s" or stop words."""
+    words = TOKEN_PATTERN.findall(text.lower())
+    if "'" in text:
+        words = [word[:-2] if word.endswith("'s") else word for word in words]
+    return [word for word in words if word not in STOP_WORDS]
+
+
+class SearchIndex:
+    """The inverted index of the descriptions in world (see above). Document
+    numbers below roomCount are room IDs, and the rest are item IDs plus
+    roomCount."""
+
+    def __init__(self, world):
+        self.world = world
+        self.roomCount = len(world.rooms)
+        wordDocuments = collections.defaultdict(list) # word -> list of (document, how many times it uses the word)
+        lengths = array.array('I') # how many words each document has
+        def addDocument(text):
+            document = len(lengths)
+            counts = collections.Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for word, count in counts.items():
+                wordDocuments[word].append((document, count))
+
+        self.itemRooms = {} # item ID -> array of the IDs of the rooms with it on the ground at the start
+        self.shopRooms = {} # item ID -> array of the IDs of the rooms that sell it
+        for loc, room in enumerate(world.rooms):
+            addDocument(room.name + ' ' + room.desc)
+            for bag, rooms in ((room.ground, self.itemRooms), (room.shop, self.shopRooms)):
+                if bag is not None:
+                    for item in bag.distinct():
+                        if item not in rooms:
+                            rooms[item] = array.array('I')
+                        rooms[item].append(loc)
+        for item in world.items:
+            addDocument(' '.join((item.name, ' '.join(item.descWords), item.groundDesc, item.shortDesc, item.longDesc)))
+
+        documentCount = len(lengths)
+        averageLength = max(1, sum(lengths) / max(1, documentCount))
+        self.postings = {} # word -> (IDF, array of documents, array of BM25 weights), the SEARCH_SCAN_LIMIT highest weights
+        lengthNorms = [BM25_K1 * (1 - BM25_B + BM25_B * length / averageLength) for length in lengths]
+        for word, documents in wordDocuments.items():
+            idf = math.log(1 + (documentCount - len(documents) + 0.5) / (len(documents) + 0.5))
+            weighted = sorted([(count * (BM25_K1 + 1) / (count + lengthNorms[document]), document)
+                               for document, count in documents], reverse=True)[:SEARCH_SCAN_LIMIT]
+            self.postings[word] = (idf, array.array('I', [document for weight, document in weighted]),
+                                   array.array('f', [weight for weight, document in weighted]))
+        self.allItems = ItemBag(world.items, range(len(world.items))) # for looking items up by desc words
+
+    def lookup(self, word):
+        """Returns the postings for word, or for its singular if it's a plural
+        the index doesn't have, or None."""
+        postings = self.postings.get(word)
+        if postings is None and word.endswith('es'):
+            postings = self.postings.get(word[:-2])
+        if postings is None and word.endswith('s'):
+            postings = self.postings.get(word[:-1])
+        return postings
+
+    def search(self, text, limit=SEARCH_RESULTS):
+        """Returns a list of up to limit (score, document) pairs for the
+        documents that match the words in text best, best first."""
+        scores = {}
+        for word in dict.fromkeys(tokenize(text)):
+            postings = self.lookup(word)
+            if postings is None:
+                continue
+            idf, documents, weights = postings
+            for document, weight in zip(documents, weights):
+                scores[document] = scores.get(document, 0.0) + idf * weight
+        return heapq.nlargest(limit, ((score, document) for document, score in scores.items()))
+
+searchIndex = None # the SearchIndex for the world being played, once something needs it
+
+def getSearchIndex(world):
+    """Returns the SearchIndex for world, building it if it hasn't been
+    built yet. That takes a while for a big world (about 10 seconds for
+    100,000 areas), so the servers call this before they let anyone in,
+    instead of making everyone wait while the first "search" builds it."""
+    global searchIndex
+    if searchIndex is None or searchIndex.world is not world:
+        searchIndex = SearchIndex(world)
+    return searchIndex
+
+
+class GroundIndex:
+    """Which rooms have each item on the ground in a WorldState: the rooms
+    in the SearchIndex's itemRooms, except for those whose ground the state
+    has changed, which are kept track of here instead.
+
+    A shard worker's state only keeps the ground of the shard's own rooms,
+    and never hears about changes anywhere else. So if the state has an
+    ownsRoom function, only the rooms it owns are counted, rather than
+    showing the other rooms as they were when the world was loaded."""
+
+    def __init__(self, state, searchIndex):
+        self.state = state
+        self.searchIndex = searchIndex
+        self.changedRooms = {} # item ID -> {room ID: count}, for the rooms in state.changedGround
+        self.hiddenRooms = collections.Counter() # item ID -> how many of its itemRooms are in state.changedGround
+        self.ownedRooms = {} # item ID -> how many of its itemRooms state.ownsRoom() is True for, once it is needed
+        for loc, ground in state.changedGround.items():
+            self.groundReplaced(loc, None, ground)
+
+    def groundReplaced(self, loc, oldGround, ground):
+        if oldGround is None:
+            # the first change to loc, so its ground in the SearchIndex no longer counts
+            for item in self.state.baseWorld.rooms[loc].ground.distinct():
+                self.hiddenRooms[item] += 1
+        else:
+            for item, count in list(oldGround.items()):
+                self.itemChanged(loc, item, -count)
+        for item, count in ground.items():
+            self.itemChanged(loc, item, count)
+
+    def itemChanged(self, loc, item, change):
+        rooms = self.changedRooms.setdefault(item, {})
+        count = rooms.get(loc, 0) + change
+        if count > 0:
+            rooms[loc] = count
+        else:
+            rooms.pop(loc, None)
+            if not rooms:
+                del self.changedRooms[item]
+
+    def rooms(self, item, limit):
+        """Returns (list of the IDs of up to limit rooms with item on the
+        ground, how many rooms have it), without looking at any more rooms
+        than it has to."""
+        changedGround = self.state.changedGround
+        ownsRoom = self.state.ownsRoom
+        changed = self.changedRooms.get(item, {})
+        baseRooms = self.searchIndex.itemRooms.get(item, ())
+        if ownsRoom is None:
+            baseCount = len(baseRooms)
+        else:
+            if item not in self.ownedRooms:
+                self.ownedRooms[item] = sum(1 for loc in baseRooms if ownsRoom(loc))
+            baseCount = self.ownedRooms[item]
+        rooms = list(itertools.islice(changed, limit))
+        if len(rooms) < limit:
+            rooms.extend(itertools.islice((loc for loc in baseRooms if loc not in changedGround
+                                           and (ownsRoom is None or ownsRoom(loc))), limit - len(rooms)))
+        return rooms, baseCount - self.hiddenRooms[item] + len(changed)
+
+
+def listRooms(rooms, total):
+    """Returns the names of the rooms with the IDs in the list rooms, out of
+    total rooms, such as "Bakery, Blacksmith and 3 other areas"."""
+    names = [gameWorld.rooms[loc].name for loc in rooms]
+    if total > len(rooms):
+        names.append('%s other areas' % (total - len(rooms)))
+    if len(names) == 1:
+        return names[0]
+    return ', '.join(names[:-1]) + ' and ' + names[-1]
+
+def itemWhereabouts(session, item, limit=WHERE_RESULTS):
+    """Returns a list of where item is, as far as session's player can tell:
+    in their inventory, on the ground, and for sale."""
+    places = []
+    if item in session.inventory:
+        places.append('in your inventory')
+    rooms, total = session.state.roomsWithItem(item, limit)
+    if rooms:
+        places.append('on the ground at ' + listRooms(rooms, total))
+    shops = getSearchIndex(session.state.baseWorld).shopRooms.get(item)
+    if shops:
+        places.append('for sale at ' + listRooms(list(shops[:limit]), len(shops)))
+    return places
+
+
+def buildCommandTable(cmdClass):
+    """Returns a dictionary that maps every command the player can type to the
+    do_*() method that runs it.
+
+    cmd.Cmd normally works out which method to call for every line the player
+    types, by calling getattr(self, 'do_' + command). Instead, this table is
+    made once when the class is created. Besides each command's full name and
+    its aliases (like "inv" and "n"), it also has every abbreviation that
+    could only mean one command, so "inve" or "qu" work too. (Abbreviations
+    that could mean two different commands, like "l" for "look" or "list",
+    aren't included, and neither are abbreviations that are also verb
+    synonyms, so "go" means "move" rather than "goto".)"""
+    commandTable = {}
+    for name in dir(cmdClass):
+        if name.startswith('do_'):
+            commandTable[name[3:]] = getattr(cmdClass, name)
+
+    abbreviations = {} # abbreviation -> set of the methods it could mean
+    for command, method in commandTable.items():
+        for i in range(1, len(command)):
+            abbreviations.setdefault(command[:i], set()).add(method)
+    for abbreviation, methods in abbreviations.items():
+        if abbreviation not in commandTable and abbreviation not in VERB_SYNONYMS and len(methods) == 1:
+            commandTable[abbreviation] = methods.pop()
+    return commandTable
+
+def buildVerbNames(commandTable):
+    """Returns (verbNames, verbIds) for a command table: the list of the full
+    names of its commands, sorted, after None for commands that aren't in
+    the table, and a dictionary that maps everything in the table (aliases
+    and abbreviations included) to its command's position in that list.
+    Recordings (see SessionRecorder) store commands as these numbers."""
+    verbNames = [None] + sorted(command for command, method in commandTable.items()
+                                if method.__name__ == 'do_' + command)
+    positions = {name: i for i, name in enumerate(verbNames)}
+    verbIds = {command: positions[method.__name__[3:]] for command, method in commandTable.items()}
+    return verbNames, verbIds
+
 
 class TextAdventureCmd(cmd.Cmd):
     prompt = '\n> '
 
+    def __init__(self, session=None, sink=None, **kwargs):
+        """session is the GameSession for the player giving the commands. If
+        it isn't given, a new player is made with their own WorldState.
+
+        Each command's output is sent to sink (see Response) in one write. If
+        sink isn't given, the output goes to the stdout keyword argument, or
+        to sys.stdout."""
+        super().__init__(**kwargs)
+        if session is None:
+            session = GameSession(WorldState(gameWorld))
+        self.session = session
+        if sink is None:
+            sink = TerminalSink(kwargs.get('stdout'))
+        self.response = Response(sink)
+        session.response = self.response
+        self.stdout = self.response # so cmd.Cmd's help output is part of the response
+        self.recorder = None # if this is a SessionRecorder, every command is recorded in it
+
+    def __init_subclass__(cls, **kwargs):
+        # subclasses can add or replace commands, so they get their own table
+        super().__init_subclass__(**kwargs)
+        cls.commandTable = buildCommandTable(cls)
+        cls.verbNames, cls.verbIds = buildVerbNames(cls.commandTable)
+        cls.parseCache = RenderCache(PARSE_CACHE_SIZE) # line -> (command, args), from parseCommand()
+
+    def get_names(self):
+        # cmd.Cmd's help and command name completion call this, and it calls
+        # dir() on the class every time. The names don't change, so they are
+        # looked up the first time help or completion needs them and kept
+        names = self.__class__.__dict__.get('methodNames')
+        if names is None:
+            names = dir(self.__class__)
+            self.__class__.methodNames = names
+        return names
+
+    def onecmd(self, line):
+        """Runs the command in line. This replaces cmd.Cmd's onecmd() so that
+        the command is looked up in commandTable instead of with getattr(),
+        after parseCommand() has handled any synonym for it."""
+        line = line.strip()
+        if line == '':
+            return self.emptyline()
+        if line[0] == '?':
+            line = 'help ' + line[1:]
+        self.lastcmd = line
+        if line == 'EOF':
+            self.lastcmd = ''
+        parsed = self.parseCache.get(line)
+        if parsed is None:
+            parsed = parseCommand(line, self.commandTable)
+            self.parseCache.put(line, parsed)
+        return self.dispatch(*parsed)
+
+    def dispatch(self, command, args=''):
+        """Runs command with args, the rest of the line as a string (which is
+        what every do_*() method takes). Programs that drive the game can call
+        this directly instead of putting together a line for onecmd() to take
+        apart again."""
+        method = self.commandTable.get(command.lower())
+        if method is None and args == '':
+            corrections = correctDirection(command.lower())
+            if len(corrections) == 1:
+                # a typo of a direction, like "nroth", which is recorded as
+                # the direction so that replaying it doesn't depend on this
+                command = corrections[0]
+                method = self.commandTable[command]
+        if self.recorder is not None:
+            if method is None:
+                self.recorder.record(0, [command] + args.split())
+            else:
+                self.recorder.record(self.verbIds[command.lower()], args.split())
+        if method is None:
+            return self.default(('%s %s' % (command, args)).strip())
+        return method(self, args)
+
     # The default() method is called when none of the other do_*() command methods match.
     def default(self, line):
-        print('I do not understand that command. Type "help" for a list of commands.')
+        self.response.say('I do not understand that command. Type "help" for a list of commands.')
 
     # A very simple "quit" command to terminate the program:
     def do_quit(self, line):
@@ -364,7 +3306,88 @@ class TextAdventureCmd(cmd.Cmd):
         return True # this exits the Cmd application loop in TextAdventureCmd.cmdloop()
 
     def help_combat(self):
-        print('Combat is not implemented in this program.')
+        self.response.say('Combat is not implemented in this program.')
+
+    def postcmd(self, stop, line):
+        # make sure the journal is on disk after each command, so that a
+        # crash loses at most the command that was running
+        if self.session.journal is not None:
+            self.session.journal.flush()
+        if self.recorder is not None:
+            self.recorder.flush()
+        self.response.send()
+        return stop
+
+    def precmd(self, line):
+        # without an asyncio event loop to run the simulation's events on
+        # time, run the ones that came due while the player was typing
+        scheduler = self.session.state.scheduler
+        if scheduler is not None and scheduler.loop is None:
+            scheduler.runDue()
+        return line
+
+    def do_stats(self, line):
+        """"stats" - Show how long each command has taken. "stats json" and "stats prometheus" show the
+full histograms, and "stats write" saves them to the stats file."""
+        if not commandStats.enabled:
+            self.response.say('Stats are not being collected. Start the game with --stats to collect them.')
+            return
+        line = line.lower().strip()
+        if line == 'json':
+            self.response.say(commandStats.toJson())
+        elif line == 'prometheus':
+            self.response.write(commandStats.toPrometheus())
+        elif line == 'write':
+            if statsFilename is None:
+                self.response.say('There is no stats file. Start the game with --stats-file to set one.')
+                return
+            commandStats.writeFile(statsFilename)
+            self.response.say('Stats written to %s.' % (statsFilename))
+        else:
+            self.response.say(commandStats.toTable())
+
+    def do_save(self, line):
+        """"save <name>" - Save your game. Every change after this is also recorded, until you save again."""
+        name = line.strip() or 'savegame'
+        filename = getSaveFilename(name)
+        if filename is None:
+            self.response.say('Save names can only have letters, numbers, - and _ in them.')
+            return
+        os.makedirs(SAVE_DIRECTORY, exist_ok=True)
+        saveGame(self.session, filename)
+        self.response.say('Game saved as "%s".' % (name))
+
+    def do_restore(self, line):
+        """"restore <name>" - Restore a game saved with "save <name>"."""
+        name = line.strip() or 'savegame'
+        filename = getSaveFilename(name)
+        if filename is None:
+            self.response.say('Save names can only have letters, numbers, - and _ in them.')
+            return
+        if not os.path.exists(filename):
+            self.response.say('There is no saved game called "%s".' % (name))
+            return
+        try:
+            session = loadGame(filename, self.session.state.baseWorld)
+        except ValueError as error:
+            self.response.say('The saved game could not be restored: %s' % (error))
+            return
+        if self.session.journal is not None:
+            self.session.journal.close()
+        if self.session.state.scheduler is not None:
+            # the simulation carries on with the restored state instead
+            startSimulation(session.state, stopSimulation(self.session.state))
+        session.state.removeSession(session)
+        self.session.state.removeSession(self.session)
+        self.session.state = session.state
+        self.session.location = session.location
+        self.session.state.addSession(self.session)
+        self.session.inventory = session.inventory
+        self.session.showFullExits = session.showFullExits
+        self.session.money = session.money
+        self.session.journal = session.journal
+        self.response.say('Game "%s" restored.\n' % (name))
+        displayLocation(self.session, self.session.location)
 
 
     def do_move(self, line):
@@ -376,76 +3399,45 @@ You can also just type in the direction for short."""
         directionNames = {'n': 'north', 's': 'south', 'e': 'east', 'w': 'west', 'u':'up', 'd':'down'}
         if direction in directionNames.keys():
             direction = directionNames[direction]
+        elif direction not in EXIT_DIRECTIONS:
+            corrections = correctDirection(direction)
+            if len(corrections) > 1:
+                self.response.say('Do you mean %s?' % (' or '.join(corrections)))
+                return
+            if corrections:
+                direction = corrections[0]
 
-        moveDirection(direction)
+        moveDirection(self.session, direction)
 
     def complete_move(self, text, line, begidx, endidx):
-        direction = text.lower().strip()
-
-        for d in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-            if line.startswith('move %s' % (d)):
-                return [] # command is complete
-
-        possibleDirections = []
-
-        # if the user has only typed "move" but no direction:
-        if direction == '':
-            if NORTH in world[location]:
-                possibleDirections.append(NORTH)
-            if SOUTH in world[location]:
-                possibleDirections.append(SOUTH)
-            if EAST in world[location]:
-                possibleDirections.append(EAST)
-            if WEST in world[location]:
-                possibleDirections.append(WEST)
-            if UP in world[location]:
-                possibleDirections.append(UP)
-            if DOWN in world[location]:
-                possibleDirections.append(DOWN)
-            return possibleDirections
-
-        # complete rest of the direction
-        if NORTH.startswith(direction):
-            possibleDirections.append(NORTH)
-        if SOUTH.startswith(direction):
-            possibleDirections.append(SOUTH)
-        if EAST.startswith(direction):
-            possibleDirections.append(EAST)
-        if WEST.startswith(direction):
-            possibleDirections.append(WEST)
-        if UP.startswith(direction):
-            possibleDirections.append(UP)
-        if DOWN.startswith(direction):
-            possibleDirections.append(DOWN)
-
-        return possibleDirections
+        return completeItemWords(text, line, [], exitsFrom=self.session.location)
 
     # These direction commands have a long (i.e. north) and show (i.e. n) form.
     # Since the code is basically the same, I put it in the moveDirection()
     # function.
     def do_north(self, line):
         """Go to the area to the north, if possible."""
-        moveDirection('north')
+        moveDirection(self.session, 'north')
 
     def do_south(self, line):
         """Go to the area to the south, if possible."""
-        moveDirection('south')
+        moveDirection(self.session, 'south')
 
     def do_east(self, line):
         """Go to the area to the east, if possible."""
-        moveDirection('east')
+        moveDirection(self.session, 'east')
 
     def do_west(self, line):
         """Go to the area to the west, if possible."""
-        moveDirection('west')
+        moveDirection(self.session, 'west')
 
     def do_up(self, line):
         """Go to the area upwards, if possible."""
-        moveDirection('up')
+        moveDirection(self.session, 'up')
 
     def do_down(self, line):
         """Go to the area downwards, if possible."""
-        moveDirection('down')
+        moveDirection(self.session, 'down')
 
     # Since the code is the exact same, we can just copy the
     # methods with shortened names:
@@ -456,37 +3448,59 @@ You can also just type in the direction for short."""
     do_u = do_up
     do_d = do_down
 
+    def do_goto(self, line):
+        """"goto <area>" - Walk to the named area by the shortest way there."""
+        name = line.strip()
+        if name == '':
+            self.response.say('Go to where? Type the name of an area, such as "goto town square".')
+            return
+
+        destination = gameWorld.findRoom(name)
+        if destination is None:
+            self.response.say('There is no area called "%s".' % (name))
+            return
+
+        directions = gameWorld.router.path(self.session.location, destination)
+        if directions is None:
+            self.response.say('You cannot find a way to get to %s from here.' % (gameWorld.rooms[destination].name))
+            return
+        if len(directions) == 0:
+            self.response.say('You are already there.')
+            return
+
+        self.response.say('You go %s.' % (', '.join(directions)))
+        enterRoom(self.session, destination)
+
+    def complete_goto(self, text, line, begidx, endidx):
+        # area names can have spaces in them, but text is only the last word
+        # of the line, so match against everything typed after "goto "
+        typed = line.split(None, 1)[1].lower() if ' ' in line.strip() else ''
+        typedBeforeText = len(typed) - len(text)
+        return [name[typedBeforeText:] for name in gameWorld.completeRoomNames(typed)]
+
     def do_exits(self, line):
         """Toggle showing full exit descriptions or brief exit descriptions."""
-        global showFullExits
-        showFullExits = not showFullExits
-        if showFullExits:
-            print('Showing full exit descriptions.')
+        self.session.showFullExits = not self.session.showFullExits
+        if self.session.showFullExits:
+            self.response.say('Showing full exit descriptions.')
         else:
-            print('Showing brief exit descriptions.')
+            self.response.say('Showing brief exit descriptions.')
 
     def do_inventory(self, line):
         """Display a list of the items in your possession."""
 
+        inventory = self.session.inventory
         if len(inventory) == 0:
-            print('Inventory:\n  (nothing)')
-            return
-
-        # first get a count of each distinct item in the inventory
-        itemCount = {}
-        for item in inventory:
-            if item in itemCount.keys():
-                itemCount[item] += 1
-            else:
-                itemCount[item] = 1
-
-        # get a list of inventory items with duplicates removed:
-        print('Inventory:')
-        for item in set(inventory):
-            if itemCount[item] > 1:
-                print('  %s (%s)' % (item, itemCount[item]))
-            else:
-                print('  ' + item)
+            self.response.say('Inventory:\n  (nothing)')
+        else:
+            # the inventory already keeps a count of each distinct item
+            self.response.say('Inventory:')
+            for item, count in inventory.items():
+                if count > 1:
+                    self.response.say('  %s (%s)' % (gameWorld.items[item].name, count))
+                else:
+                    self.response.say('  ' + gameWorld.items[item].name)
+        self.response.say('You have %s.' % (formatMoney(self.session.money)))
 
     do_inv = do_inventory
 
@@ -497,43 +3511,27 @@ You can also just type in the direction for short."""
         # put this value in a more suitably named variable
         itemToDrop = line.lower().strip()
 
-        # get a list of all "description words" for each item in the inventory
-        invDescWords = getAllDescWords(inventory)
+        # get the item name that the player's command describes
+        phrase = parseNounPhrase(itemToDrop)
+        if phrase.everything and not phrase.words:
+            # "drop all" drops everything in the inventory
+            if len(self.session.inventory) == 0:
+                self.response.say('You are not carrying anything.')
+            for item in list(self.session.inventory.distinct()):
+                dropItem(self.session, item, self.session.inventory.count(item))
+            return
+        matches = matchItems(phrase, self.session.inventory)
 
         # find out if the player doesn't have that item
-        if itemToDrop not in invDescWords:
-            print('You do not have "%s" in your inventory.' % (itemToDrop))
+        if not matches:
+            self.response.say('You do not have "%s" in your inventory.' % (itemToDrop))
             return
 
-        # get the item name that the player's command describes
-        item = getFirstItemMatchingDesc(itemToDrop, inventory)
-        if item != None:
-            print('You drop %s.' % (objects[item][SHORTDESC]))
-            inventory.remove(item) # remove from inventory
-            world[location][GROUND].append(item) # add to the ground
-            return
+        item = matches[0]
+        dropItem(self.session, item, phrase.howMany(self.session.inventory.count(item)))
 
     def complete_drop(self, text, line, begidx, endidx):
-        possibleItems = []
-        itemToDrop = text.lower().strip()
-
-        # get a list of all "description words" for each item in the inventory
-        invDescWords = getAllDescWords(inventory)
-
-        for descWord in invDescWords:
-            if line.startswith('drop %s' % (descWord)):
-                return [] # command is complete
-
-        # if the user has only typed "drop" but no item name:
-        if itemToDrop == '':
-            return getAllFirstDescWords(inventory)
-
-        # otherwise, get a list of all "description words" for inventory items matching the command text so far:
-        for descWord in invDescWords:
-            if descWord.startswith(text):
-                possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeItemWords(text, line, [self.session.inventory])
 
 
     def do_look(self, line):
@@ -543,93 +3541,54 @@ You can also just type in the direction for short."""
 "look exits" - display the description of all adjacent areas
 "look <object>" - display the description of an object on the ground or in your inventory"""
 
-        lookingAt = line.lower().strip()
+        phrase = parseNounPhrase(line)
+        lookingAt = ' '.join(phrase.words) # without words like "at" and "the"
         if lookingAt == '':
             # "look" will re-print the area description
-            displayLocation(location)
+            displayLocation(self.session, self.session.location)
             return
 
+        room = gameWorld.rooms[self.session.location]
         if lookingAt == 'exits':
-            for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-                if direction in world[location]:
-                    print('%s: %s' % (direction.title(), world[location][direction]))
+            for direction, destination in zip(EXIT_DIRECTIONS, room.exits):
+                if destination != NO_EXIT:
+                    self.response.say('%s: %s' % (direction.title(), gameWorld.rooms[destination].name))
             return
 
         if lookingAt in ('north', 'west', 'east', 'south', 'up', 'down', 'n', 'w', 'e', 's', 'u', 'd'):
-            if lookingAt.startswith('n') and NORTH in world[location]:
-                print(world[location][NORTH])
-            elif lookingAt.startswith('w') and WEST in world[location]:
-                print(world[location][WEST])
-            elif lookingAt.startswith('e') and EAST in world[location]:
-                print(world[location][EAST])
-            elif lookingAt.startswith('s') and SOUTH in world[location]:
-                print(world[location][SOUTH])
-            elif lookingAt.startswith('u') and UP in world[location]:
-                print(world[location][UP])
-            elif lookingAt.startswith('d') and DOWN in world[location]:
-                print(world[location][DOWN])
+            # each direction starts with a different letter, so the first
+            # letter is enough to know which one was meant
+            for direction in EXIT_DIRECTIONS:
+                if direction.startswith(lookingAt[0]):
+                    break
+            if room.exit(direction) != NO_EXIT:
+                self.response.say(gameWorld.rooms[room.exit(direction)].name)
             else:
-                print('There is nothing in that direction.')
+                self.response.say('There is nothing in that direction.')
             return
 
-        # see if the item being looked at is on the ground at this location
-        item = getFirstItemMatchingDesc(lookingAt, world[location][GROUND])
-        if item != None:
-            print('\n'.join(textwrap.wrap(objects[item][LONGDESC], SCREEN_WIDTH)))
-            return
+        # see if the item being looked at is on the ground at this location,
+        # and then if it is in the inventory
+        for itemBag in (self.session.state.ground(self.session.location), self.session.inventory):
+            matches = matchItems(phrase, itemBag)
+            if matches:
+                self.response.say(wrapText(('item', matches[0]), gameWorld.items[matches[0]].longDesc))
+                return
 
-        # see if the item being looked at is in the inventory
-        item = getFirstItemMatchingDesc(lookingAt, inventory)
-        if item != None:
-            print('\n'.join(textwrap.wrap(objects[item][LONGDESC], SCREEN_WIDTH)))
+        corrections = correctDirection(lookingAt)
+        if len(corrections) == 1:
+            self.do_look(corrections[0]) # a typo of a direction, like "look nroth"
             return
-
-        print('You do not see that nearby.')
+        self.response.say('You do not see that nearby.')
 
 
     def complete_look(self, text, line, begidx, endidx):
-        possibleItems = []
-        lookingAt = text.lower().strip()
-
-        # get a list of all "description words" for each item in the inventory
-        invDescWords = getAllDescWords(inventory)
-        groundDescWords = getAllDescWords(world[location][GROUND])
-        shopDescWords = getAllDescWords(world[location].get(SHOP, []))
-
-        for descWord in invDescWords + groundDescWords + shopDescWords + [NORTH, SOUTH, EAST, WEST, UP, DOWN]:
-            if line.startswith('look %s' % (descWord)):
-                return [] # command is complete
-
-        # if the user has only typed "look" but no item name, show all items on ground, shop and directions:
-        if lookingAt == '':
-            possibleItems.extend(getAllFirstDescWords(world[location][GROUND]))
-            possibleItems.extend(getAllFirstDescWords(world[location].get(SHOP, [])))
-            for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-                if direction in world[location]:
-                    possibleItems.append(direction)
-            return list(set(possibleItems)) # make list unique
-
-        # otherwise, get a list of all "description words" for ground items matching the command text so far:
-        for descWord in groundDescWords:
-            if descWord.startswith(lookingAt):
-                possibleItems.append(descWord)
-
-        # otherwise, get a list of all "description words" for items for sale at the shop (if this is one):
-        for descWord in shopDescWords:
-            if descWord.startswith(lookingAt):
-                possibleItems.append(descWord)
-
-        # check for matching directions
-        for direction in (NORTH, SOUTH, EAST, WEST, UP, DOWN):
-            if direction.startswith(lookingAt):
-                possibleItems.append(direction)
-
-        # get a list of all "description words" for inventory items matching the command text so far:
-        for descWord in invDescWords:
-            if descWord.startswith(lookingAt):
-                possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        # you can look at items on the ground, in the shop, or in your
+        # inventory, as well as in a direction
+        loc = self.session.location
+        return completeItemWords(text, line,
+                                 [self.session.state.ground(loc), gameWorld.rooms[loc].shop or NO_ITEMS, self.session.inventory],
+                                 exitsFrom=loc)
 
 
     def do_take(self, line):
@@ -639,144 +3598,139 @@ You can also just type in the direction for short."""
         itemToTake = line.lower().strip()
 
         if itemToTake == '':
-            print('Take what? Type "look" the items on the ground here.')
+            self.response.say('Take what? Type "look" the items on the ground here.')
             return
 
         cantTake = False
 
         # get the item name that the player's command describes
-        for item in getAllItemsMatchingDesc(itemToTake, world[location][GROUND]):
-            if objects[item].get(TAKEABLE, True) == False:
+        phrase = parseNounPhrase(itemToTake)
+        ground = self.session.state.ground(self.session.location)
+        if phrase.everything and not phrase.words:
+            # "take all" takes everything on the ground that can be taken
+            items = [item for item in ground.distinct() if gameWorld.items[item].takeable]
+            if not items:
+                self.response.say('There is nothing here you can take.')
+            for item in items:
+                takeItem(self.session, item, ground.count(item))
+            return
+        for item in matchItems(phrase, ground):
+            if gameWorld.items[item].takeable == False:
                 cantTake = True
                 continue # there may be other items named this that you can take, so we continue checking
-            print('You take %s.' % (objects[item][SHORTDESC]))
-            world[location][GROUND].remove(item) # remove from the ground
-            inventory.append(item) # add to inventory
+            takeItem(self.session, item, phrase.howMany(ground.count(item)))
             return
 
         if cantTake:
-            print('You cannot take "%s".' % (itemToTake))
+            self.response.say('You cannot take "%s".' % (itemToTake))
         else:
-            print('That is not on the ground.')
+            self.response.say('That is not on the ground.')
 
 
     def complete_take(self, text, line, begidx, endidx):
-        possibleItems = []
-        text = text.lower().strip()
-
-        # if the user has only typed "take" but no item name:
-        if not text:
-            return getAllFirstDescWords(world[location][GROUND])
-
-        # otherwise, get a list of all "description words" for ground items matching the command text so far:
-        for item in list(set(world[location][GROUND])):
-            for descWord in objects[item][DESCWORDS]:
-                if descWord.startswith(text) and objects[item].get(TAKEABLE, True):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeItemWords(text, line, [self.session.state.ground(self.session.location)], isTakeable)
 
 
     def do_list(self, line):
         """List the items for sale at the current location's shop. "list full" will show details of the items."""
-        if SHOP not in world[location]:
-            print('This is not a shop.')
+        if gameWorld.rooms[self.session.location].shop is None:
+            self.response.say('This is not a shop.')
             return
 
         line = line.lower().strip()
 
-        print('For sale:')
-        for item in world[location][SHOP]:
-            print('  - %s' % (item))
+        self.response.say('For sale:')
+        for item in gameWorld.rooms[self.session.location].shop.distinct():
+            stock = self.session.state.stock(self.session.location, item)
+            price = formatMoney(self.session.state.price(self.session.location, item))
+            if stock is None:
+                self.response.say('  - %s (%s)' % (gameWorld.items[item].name, price))
+            elif stock == 0:
+                self.response.say('  - %s (sold out)' % (gameWorld.items[item].name))
+            else:
+                self.response.say('  - %s (%s, %s left)' % (gameWorld.items[item].name, price, stock))
             if line == 'full':
-                print('\n'.join(textwrap.wrap(objects[item][LONGDESC], SCREEN_WIDTH)))
+                self.response.say(wrapText(('item', item), gameWorld.items[item].longDesc))
 
 
     def do_buy(self, line):
         """"buy <item>" - buy an item at the current location's shop."""
-        if SHOP not in world[location]:
-            print('This is not a shop.')
+        if gameWorld.rooms[self.session.location].shop is None:
+            self.response.say('This is not a shop.')
             return
 
         itemToBuy = line.lower().strip()
 
         if itemToBuy == '':
-            print('Buy what? Type "list" or "list full" to see a list of items for sale.')
+            self.response.say('Buy what? Type "list" or "list full" to see a list of items for sale.')
             return
 
-        item = getFirstItemMatchingDesc(itemToBuy, world[location][SHOP])
-        if item != None:
-            # NOTE - If you wanted to implement money, here is where you would add
-            # code that checks if the player has enough, then deducts the price
-            # from their money.
-            print('You have purchased %s' % (objects[item][SHORTDESC]))
-            inventory.append(item)
+        phrase = parseNounPhrase(itemToBuy)
+        matches = matchItems(phrase, gameWorld.rooms[self.session.location].shop)
+        if matches:
+            item = matches[0]
+            stock = self.session.state.stock(self.session.location, item)
+            if stock == 0:
+                self.response.say('The shop has sold out of %s. Come back later.' % (gameWorld.items[item].shortDesc))
+                return
+            count = (phrase.quantity or 1) if stock is None else phrase.howMany(stock)
+            price = self.session.state.price(self.session.location, item)
+            if self.session.money < price:
+                self.response.say('You cannot afford %s. It costs %s, and you have %s.'
+                                  % (gameWorld.items[item].shortDesc, formatMoney(price), formatMoney(self.session.money)))
+                return
+            count = min(count, self.session.money // price) # as many as the player can afford
+            self.session.money -= price * count
+            self.response.say('You have purchased %s for %s' % (describeCount(item, count), formatMoney(price * count)))
+            self.session.inventory.add(item, count)
+            self.session.state.changeStock(self.session.location, item, -count)
+            self.session.record(JOURNAL_BUY, item, count)
+            self.session.record(JOURNAL_MONEY, self.session.money)
             return
 
-        print('"%s" is not sold here. Type "list" or "list full" to see a list of items for sale.' % (itemToBuy))
+        self.response.say('"%s" is not sold here. Type "list" or "list full" to see a list of items for sale.' % (itemToBuy))
 
 
     def complete_buy(self, text, line, begidx, endidx):
-        if SHOP not in world[location]:
+        if gameWorld.rooms[self.session.location].shop is None:
             return []
-
-        itemToBuy = text.lower().strip()
-        possibleItems = []
-
-        # if the user has only typed "buy" but no item name:
-        if not itemToBuy:
-            return getAllFirstDescWords(world[location][SHOP])
-
-        # otherwise, get a list of all "description words" for shop items matching the command text so far:
-        for item in list(set(world[location][SHOP])):
-            for descWord in objects[item][DESCWORDS]:
-                if descWord.startswith(text):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeItemWords(text, line, [gameWorld.rooms[self.session.location].shop])
 
 
     def do_sell(self, line):
         """"sell <item>" - sell an item at the current location's shop."""
-        if SHOP not in world[location]:
-            print('This is not a shop.')
+        if gameWorld.rooms[self.session.location].shop is None:
+            self.response.say('This is not a shop.')
             return
 
         itemToSell = line.lower().strip()
 
         if itemToSell == '':
-            print('Sell what? Type "inventory" or "inv" to see your inventory.')
+            self.response.say('Sell what? Type "inventory" or "inv" to see your inventory.')
             return
 
-        for item in inventory:
-            if itemToSell in objects[item][DESCWORDS]:
-                # NOTE - If you wanted to implement money, here is where you would add
-                # code that gives the player money for selling the item.
-                print('You have sold %s' % (objects[item][SHORTDESC]))
-                inventory.remove(item)
-                return
+        phrase = parseNounPhrase(itemToSell)
+        matches = matchItems(phrase, self.session.inventory)
+        if matches:
+            item = matches[0]
+            count = phrase.howMany(self.session.inventory.count(item))
+            price = self.session.state.sellPrice(self.session.location, item)
+            self.session.money += price * count
+            self.response.say('You have sold %s for %s' % (describeCount(item, count), formatMoney(price * count)))
+            self.session.inventory.remove(item, count)
+            if item in gameWorld.rooms[self.session.location].shop:
+                self.session.state.changeStock(self.session.location, item, count)
+            self.session.record(JOURNAL_SELL, item, count)
+            self.session.record(JOURNAL_MONEY, self.session.money)
+            return
 
-        print('You do not have "%s". Type "inventory" or "inv" to see your inventory.' % (itemToSell))
+        self.response.say('You do not have "%s". Type "inventory" or "inv" to see your inventory.' % (itemToSell))
 
 
     def complete_sell(self, text, line, begidx, endidx):
-        if SHOP not in world[location]:
+        if gameWorld.rooms[self.session.location].shop is None:
             return []
-
-        itemToSell = text.lower().strip()
-        possibleItems = []
-
-        # if the user has only typed "sell" but no item name:
-        if not itemToSell:
-            return getAllFirstDescWords(inventory)
-
-        # otherwise, get a list of all "description words" for inventory items matching the command text so far:
-        for item in list(set(inventory)):
-            for descWord in objects[item][DESCWORDS]:
-                if descWord.startswith(text):
-                    possibleItems.append(descWord)
-
-        return list(set(possibleItems)) # make list unique
+        return completeItemWords(text, line, [self.session.inventory])
 
 
     def do_eat(self, line):
@@ -784,53 +3738,487 @@ You can also just type in the direction for short."""
         itemToEat = line.lower().strip()
 
         if itemToEat == '':
-            print('Eat what? Type "inventory" or "inv" to see your inventory.')
+            self.response.say('Eat what? Type "inventory" or "inv" to see your inventory.')
             return
 
-        # get a unique list of all description words for all items in your inventory
-        itemDescWords = getAllDescWords(inventory)
-
         cantEat = False
 
-        for item in getAllItemsMatchingDesc(itemToEat, inventory):
-            if objects[item].get(EDIBLE, False) == False:
+        phrase = parseNounPhrase(itemToEat)
+        for item in matchItems(phrase, self.session.inventory):
+            if gameWorld.items[item].edible == False:
                 cantEat = True
                 continue # there may be other items named this that you can eat, so we continue checking
+            count = phrase.howMany(self.session.inventory.count(item))
             # NOTE - If you wanted to implement hunger levels, here is where
             # you would add code that changes the player's hunger level.
-            print('You eat %s' % (objects[item][SHORTDESC]))
-            inventory.remove(item)
+            self.response.say('You eat %s' % (describeCount(item, count)))
+            self.session.inventory.remove(item, count)
+            self.session.record(JOURNAL_EAT, item, count)
             return
 
         if cantEat:
-            print('You cannot eat that.')
+            self.response.say('You cannot eat that.')
         else:
-            print('You do not have "%s". Type "inventory" or "inv" to see your inventory.' % (itemToEat))
+            self.response.say('You do not have "%s". Type "inventory" or "inv" to see your inventory.' % (itemToEat))
 
 
     def complete_eat(self, text, line, begidx, endidx):
-        itemToEat = text.lower().strip()
-        possibleItems = []
+        return completeItemWords(text, line, [self.session.inventory], isEdible)
+
+
+    def do_search(self, line):
+        """"search <words>" - Find the areas and items that are described with the words."""
+        words = line.strip()
+        if not tokenize(words):
+            self.response.say('Search for what? Type some words from the description of an area or item.')
+            return
+
+        index = getSearchIndex(gameWorld)
+        results = index.search(words)
+        if not results:
+            self.response.say('Nothing is described with "%s".' % (words))
+            return
+        self.response.say('Best matches for "%s":' % (words))
+        for score, document in results:
+            if document < index.roomCount:
+                self.response.say('  %s (an area)' % (gameWorld.rooms[document].name))
+            else:
+                item = document - index.roomCount
+                places = itemWhereabouts(self.session, item, 1)
+                self.response.say('  %s (an item, %s)' % (gameWorld.items[item].name, '; '.join(places) or 'nowhere to be found'))
+
+
+    def do_where(self, line):
+        """"where <item>" - Find out where an item is: in your inventory, on the ground, or for sale."""
+        itemToFind = line.lower().strip()
+        phrase = parseNounPhrase(itemToFind)
+        if not phrase.words:
+            self.response.say('Where is what? Type the name of an item.')
+            return
+
+        index = getSearchIndex(gameWorld)
+        items = matchItems(phrase, index.allItems)
+        if not items:
+            # not an item's desc words, so try its descriptions
+            items = [document - index.roomCount for score, document in index.search(itemToFind)
+                     if document >= index.roomCount][:1]
+        if not items:
+            self.response.say('There is no item called "%s".' % (itemToFind))
+            return
+        for item in items:
+            places = itemWhereabouts(self.session, item)
+            if places:
+                self.response.say('%s: %s.' % (gameWorld.items[item].name, '; '.join(places)))
+            else:
+                self.response.say('%s: nowhere to be found.' % (gameWorld.items[item].name))
+        if self.session.state.ownsRoom is not None:
+            self.response.say('(Only the ground in this part of the world was searched.)')
+
+    def complete_where(self, text, line, begidx, endidx):
+        return completeItemWords(text, line, [getSearchIndex(gameWorld).allItems])
 
-        # if the user has only typed "eat" but no item name:
-        if itemToEat == '':
-            return getAllFirstDescWords(inventory)
 
-        # otherwise, get a list of all "description words" for edible inventory items matching the command text so far:
-        for item in list(set(inventory)):
-            for descWord in objects[item][DESCWORDS]:
-                if descWord.startswith(text) and objects[item].get(EDIBLE, False):
-                    possibleItems.append(descWord)
+TextAdventureCmd.commandTable = buildCommandTable(TextAdventureCmd)
+TextAdventureCmd.verbNames, TextAdventureCmd.verbIds = buildVerbNames(TextAdventureCmd.commandTable)
+TextAdventureCmd.parseCache = RenderCache(PARSE_CACHE_SIZE)
 
-        return list(set(possibleItems)) # make list unique
+
+class SharedWorldCmd(TextAdventureCmd):
+    """The commands for a player in a world shared with other players, as in
+    textadventureserver.py and textadventureshards.py. A saved game has the
+    ground of every area, and the journal only has this player's changes, so
+    restoring one would undo (or fail on) what the other players did since,
+    and would move the player into a world of their own. So saving and
+    restoring are turned off."""
+
+    def do_save(self, line):
+        """Saving is not available on this server."""
+        self.response.say('Saving is not available on this server.')
+
+    def do_restore(self, line):
+        """Restoring is not available on this server."""
+        self.response.say('Restoring is not available on this server.')
+startupCheckpoint('command table')
+
+
+"""
+Instrumentation. When it is turned on with enableStats(), every call to
+onecmd() and to each do_*() and complete_*() method is timed, counted, and
+(optionally) checked for how much memory it allocated with the tracemalloc
+module. The times and allocations are counted in histogram buckets, and
+can be exported as JSON or in the Prometheus text format.
+
+When it is turned off (the default), the original methods are used as they
+are, so the instrumentation costs nothing. enableStats() works by replacing
+the methods in the class and its commandTable with wrappers that record the
+stats, and disableStats() puts the originals back. Subclasses (like the
+servers' command classes) have commandTables of their own, so theirs are
+wrapped too; a subclass has to be defined before enableStats() is called
+for its commands to be counted.
+"""
+STATS_TIME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                      0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0) # seconds
+STATS_ALLOCATION_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576) # bytes
+
+class HandlerStats:
+    """The stats for one method: how many times it was called, the total
+    time and memory allocated, and the histograms of each."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.timeBuckets = [0] * (len(STATS_TIME_BUCKETS) + 1) # the last bucket is for anything slower
+        self.allocatedBytes = 0
+        self.allocationBuckets = [0] * (len(STATS_ALLOCATION_BUCKETS) + 1)
+
+    def record(self, seconds, allocatedBytes=None):
+        self.calls += 1
+        self.seconds += seconds
+        self.timeBuckets[bisect.bisect_left(STATS_TIME_BUCKETS, seconds)] += 1
+        if allocatedBytes is not None:
+            self.allocatedBytes += allocatedBytes
+            self.allocationBuckets[bisect.bisect_left(STATS_ALLOCATION_BUCKETS, allocatedBytes)] += 1
+
+
+class CommandStats:
+    """Collects HandlerStats for the methods of a cmd.Cmd class."""
+
+    def __init__(self):
+        self.enabled = False
+        self.traceAllocations = False
+        self.startedTracing = False # whether enable() started tracemalloc, so disable() should stop it
+        self.handlers = {} # method name -> HandlerStats
+        self.originals = [] # (object, key, original value) for everything replaced by enable()
+
+    def wrap(self, name, method):
+        """Returns a function that calls method and records its stats under
+        name."""
+        import tracemalloc
+        handlerStats = self.handlers.setdefault(name, HandlerStats())
+        traceAllocations = self.traceAllocations
+        def instrumented(*args, **kwargs):
+            if traceAllocations:
+                allocatedBefore = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                if traceAllocations:
+                    handlerStats.record(seconds, max(0, tracemalloc.get_traced_memory()[0] - allocatedBefore))
+                else:
+                    handlerStats.record(seconds)
+        instrumented.__name__ = method.__name__
+        instrumented.__doc__ = method.__doc__ # so that "help" still works
+        instrumented.__wrapped__ = method
+        return instrumented
+
+    def replace(self, obj, key, value):
+        if isinstance(obj, dict):
+            self.originals.append((obj, key, obj[key]))
+            obj[key] = value
+        else:
+            self.originals.append((obj, key, obj.__dict__.get(key)))
+            setattr(obj, key, value)
+
+    def enable(self, cmdClass, traceAllocations=False):
+        if self.enabled:
+            return
+        import tracemalloc
+        self.enabled = True
+        self.traceAllocations = traceAllocations
+        if traceAllocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+
+        wrapped = {} # original method -> its wrapper, since aliases and subclasses share methods
+        def wrapMethod(method):
+            if method not in wrapped:
+                wrapped[method] = self.wrap(method.__name__, method)
+            return wrapped[method]
+
+        classes = [cmdClass]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+            # cmdClass's inherited methods are wrapped in cmdClass, so its
+            # subclasses get the wrappers too unless they have their own
+            names = dir(cls) if cls is cmdClass else list(cls.__dict__)
+            for name in names:
+                if name == 'onecmd' or name.startswith('complete_'):
+                    self.replace(cls, name, wrapMethod(getattr(cls, name)))
+            if 'commandTable' in cls.__dict__:
+                for command, method in list(cls.commandTable.items()):
+                    self.replace(cls.commandTable, command, wrapMethod(method))
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for obj, key, original in reversed(self.originals):
+            if isinstance(obj, dict):
+                obj[key] = original
+            elif original is None:
+                delattr(obj, key) # it was inherited, so just remove the wrapper
+            else:
+                setattr(obj, key, original)
+        import tracemalloc
+        self.originals = []
+        self.enabled = False
+        if self.startedTracing:
+            tracemalloc.stop()
+            self.startedTracing = False
+
+    def reset(self):
+        for handlerStats in self.handlers.values():
+            handlerStats.__init__()
+
+    def toJson(self):
+        stats = {}
+        for name, handlerStats in sorted(self.handlers.items()):
+            if handlerStats.calls == 0:
+                continue
+            stats[name] = {'calls': handlerStats.calls,
+                           'seconds': handlerStats.seconds,
+                           'timeBuckets': dict(zip([str(bucket) for bucket in STATS_TIME_BUCKETS] + ['+Inf'], handlerStats.timeBuckets))}
+            if self.traceAllocations:
+                stats[name]['allocatedBytes'] = handlerStats.allocatedBytes
+                stats[name]['allocationBuckets'] = dict(zip([str(bucket) for bucket in STATS_ALLOCATION_BUCKETS] + ['+Inf'],
+                                                            handlerStats.allocationBuckets))
+        import json
+        return json.dumps(stats, indent=2)
+
+    def toPrometheus(self):
+        lines = []
+        def histogram(metric, helpText, buckets, getCounts, getSum):
+            lines.append('# HELP %s %s' % (metric, helpText))
+            lines.append('# TYPE %s histogram' % (metric))
+            for name, handlerStats in sorted(self.handlers.items()):
+                if handlerStats.calls == 0:
+                    continue
+                total = 0
+                for bucket, count in zip(list(buckets) + ['+Inf'], getCounts(handlerStats)):
+                    total += count # Prometheus buckets count everything up to and including le
+                    lines.append('%s_bucket{handler="%s",le="%s"} %s' % (metric, name, bucket, total))
+                lines.append('%s_sum{handler="%s"} %s' % (metric, name, getSum(handlerStats)))
+                lines.append('%s_count{handler="%s"} %s' % (metric, name, handlerStats.calls))
+        histogram('textadventure_handler_seconds', 'Time spent running each command method.',
+                  STATS_TIME_BUCKETS, lambda h: h.timeBuckets, lambda h: h.seconds)
+        if self.traceAllocations:
+            histogram('textadventure_handler_allocated_bytes', 'Memory allocated (net) by each command method.',
+                      STATS_ALLOCATION_BUCKETS, lambda h: h.allocationBuckets, lambda h: h.allocatedBytes)
+        return '\n'.join(lines) + '\n'
+
+    def toTable(self):
+        lines = ['%-18s %9s %12s %12s %12s' % ('method', 'calls', 'total ms', 'mean us', 'mean bytes')]
+        for name, handlerStats in sorted(self.handlers.items(), key=lambda x: -x[1].seconds):
+            if handlerStats.calls == 0:
+                continue
+            meanBytes = '%12d' % (handlerStats.allocatedBytes / handlerStats.calls) if self.traceAllocations else '%12s' % ('-')
+            lines.append('%-18s %9d %12.3f %12.2f %s' % (name, handlerStats.calls, handlerStats.seconds * 1000,
+                                                         handlerStats.seconds / handlerStats.calls * 1000000, meanBytes))
+        return '\n'.join(lines)
+
+    def writeFile(self, filename):
+        """Writes the stats to filename, as Prometheus text if the filename
+        ends with .prom and as JSON otherwise."""
+        with open(filename, 'w') as statsFile:
+            statsFile.write(self.toPrometheus() if filename.endswith('.prom') else self.toJson())
+
+commandStats = CommandStats()
+statsFilename = None # if set, the "stats write" command writes the stats here
+
+def enableStats(traceAllocations=False, cmdClass=TextAdventureCmd):
+    """Starts collecting stats for cmdClass's methods in commandStats. If
+    traceAllocations is True, memory allocations are measured too (which
+    makes everything slower while it's on)."""
+    commandStats.enable(cmdClass, traceAllocations)
+
+def disableStats():
+    commandStats.disable()
+
+
+def runBatch(commandLines, out=None, echo=True, session=None, recorder=None):
+    """Runs the game without a terminal, for scripts and automated tests.
+
+    Each line in commandLines (which can be a file or a list of strings) is
+    run as if the player typed it. Blank lines and lines starting with # are
+    skipped. Instead of each command's output being written straight to the
+    terminal, it is sent to a MemorySink that is written to out (which
+    defaults to sys.stdout) in large chunks. If echo is True, each command is
+    written to the output after the prompt, like a transcript.
+
+    The commands are given by a new player, or by session if it is given,
+    and are recorded by recorder if it is given (see SessionRecorder).
+
+    Returns a dictionary of timings: for each command (the first word of the
+    line), a list of [number of times run, total seconds, slowest seconds]."""
+    if out is None:
+        out = sys.stdout
+    sink = MemorySink()
+    cmdObj = TextAdventureCmd(session, sink=sink)
+    cmdObj.recorder = recorder
+    timings = {}
+    displayLocation(cmdObj.session, cmdObj.session.location)
+    cmdObj.response.send()
+    for line in commandLines:
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        if echo:
+            cmdObj.response.say(cmdObj.prompt + line)
+
+        start = time.perf_counter()
+        line = cmdObj.precmd(line)
+        stop = cmdObj.onecmd(line)
+        stop = cmdObj.postcmd(stop, line)
+        elapsed = time.perf_counter() - start
+
+        command = line.split(None, 1)[0].lower()
+        if command not in timings:
+            timings[command] = [0, 0.0, 0.0]
+        timings[command][0] += 1
+        timings[command][1] += elapsed
+        timings[command][2] = max(timings[command][2], elapsed)
+
+        if sink.size >= BATCH_FLUSH_SIZE:
+            out.write(sink.take())
+        if stop:
+            break
+    out.write(sink.take())
+    out.flush()
+    return timings
+
+
+def printTimings(timings, file=None):
+    """Displays the timings returned by runBatch() as a table."""
+    if file is None:
+        file = sys.stderr
+    print('%-12s %10s %12s %12s %12s' % ('command', 'count', 'total ms', 'mean us', 'max us'), file=file)
+    for command, (count, total, slowest) in sorted(timings.items(), key=lambda x: -x[1][1]):
+        print('%-12s %10d %12.3f %12.2f %12.2f' % (command, count, total * 1000, total / count * 1000000, slowest * 1000000), file=file)
+
+
+def printStartupTimes(file=None):
+    """Displays how long each part of starting up took, on stderr. (This
+    doesn't include starting Python itself; "python -X importtime" can show
+    more about the imports.)"""
+    if file is None:
+        file = sys.stderr
+    print('%-20s %10s' % ('startup', 'ms'), file=file)
+    for (name, when), (previousName, previous) in zip(startupTimes[1:], startupTimes):
+        print('%-20s %10.3f' % (name, (when - previous) * 1000), file=file)
+    print('%-20s %10.3f' % ('total', (startupTimes[-1][1] - startupTimes[0][1]) * 1000), file=file)
+
+startupCheckpoint('rest of module')
 
 
 if __name__ == '__main__':
-    print('Text Adventure Demo!')
-    print('====================')
-    print()
-    print('(Type "help" for commands.)')
-    print()
-    displayLocation(location)
-    TextAdventureCmd().cmdloop()
-    print('Thanks for playing!')
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Text Adventure Demo')
+    parser.add_argument('--batch', nargs='+', metavar='SCRIPT',
+                        help='run the commands in the script files, one after another as the same player (use - for stdin), '
+                             'instead of playing interactively')
+    parser.add_argument('--timings', action='store_true',
+                        help='with --batch, display how long each command took on stderr')
+    parser.add_argument('--no-echo', action='store_true',
+                        help='with --batch, do not echo each command in the output')
+    parser.add_argument('--world', metavar='WORLDFILE',
+                        help='play the world in a world file instead of the built-in world')
+    parser.add_argument('--write-world', metavar='WORLDFILE',
+                        help='write the built-in world to a world file and exit')
+    parser.add_argument('--events', action='store_true',
+                        help='simulate the world: timed events happen and shops can sell out and restock')
+    parser.add_argument('--stats', action='store_true',
+                        help='collect timing stats for every command (see the "stats" command)')
+    parser.add_argument('--stats-alloc', action='store_true',
+                        help='with --stats, also measure memory allocations with tracemalloc')
+    parser.add_argument('--stats-file', metavar='FILE',
+                        help='with --stats, write the stats to FILE when the game ends (Prometheus text if FILE ends with .prom, otherwise JSON)')
+    parser.add_argument('--record', metavar='RECORDING',
+                        help='record every command to the file RECORDING, to be replayed later with --replay')
+    parser.add_argument('--replay', metavar='RECORDING',
+                        help='start the game where the player in RECORDING (made with --record) left off')
+    parser.add_argument('--replay-to', type=int, metavar='N',
+                        help='with --replay, stop after the first N commands of the recording')
+    parser.add_argument('--validate', action='store_true', # handled before the world is compiled (see printValidation())
+                        help='check the built-in world for mistakes, print a JSON report and exit (with status 1 if there are errors)')
+    parser.add_argument('--startup-times', action='store_true',
+                        help='display how long each part of starting up took, on stderr')
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error('a recording has to start at the beginning of the game, so --record cannot be used with --replay')
+    startupCheckpoint('arguments')
+
+    if args.stats:
+        enableStats(args.stats_alloc)
+        statsFilename = args.stats_file
+
+    if args.write_world:
+        report = validateWorld(world, objects)
+        if report['errors']:
+            sys.exit(summarizeReport(report) + ' Run with --validate to see them.')
+        writeWorldFile(args.write_world, world, objects)
+        sys.exit()
+    if args.world:
+        useWorld(openWorldFile(args.world))
+        startupCheckpoint('open world file')
+
+    session = None
+    if args.replay:
+        start = time.perf_counter()
+        try:
+            session, replayed, playTime = replayRecording(args.replay, limit=args.replay_to)
+        except (OSError, ValueError) as error:
+            sys.exit('The recording could not be replayed: %s' % (error))
+        print('Replayed %s commands (%.1f seconds of play) in %.3f seconds.'
+              % (replayed, playTime, time.perf_counter() - start), file=sys.stderr)
+        startupCheckpoint('replay')
+    recorder = None
+    if args.record:
+        recorder = SessionRecorder(args.record, gameWorld, TextAdventureCmd, args.events)
+    if session is None:
+        session = GameSession(WorldState(gameWorld)) # with --batch, each script carries on where the last one left off
+    if args.events and session.state.scheduler is None:
+        startSimulation(session.state)
+
+    if args.batch:
+        if args.startup_times:
+            printStartupTimes()
+        timings = {}
+        for script in args.batch:
+            if script == '-':
+                scriptTimings = runBatch(sys.stdin, echo=not args.no_echo, session=session, recorder=recorder)
+            else:
+                with open(script) as scriptFile:
+                    scriptTimings = runBatch(scriptFile, echo=not args.no_echo, session=session, recorder=recorder)
+            for command, (count, total, slowest) in scriptTimings.items():
+                if command not in timings:
+                    timings[command] = [0, 0.0, 0.0]
+                timings[command][0] += count
+                timings[command][1] += total
+                timings[command][2] = max(timings[command][2], slowest)
+        if args.timings:
+            printTimings(timings)
+        if statsFilename is not None:
+            commandStats.writeFile(statsFilename)
+        if recorder is not None:
+            recorder.close()
+        sys.exit()
+
+    cmdObj = TextAdventureCmd(session)
+    cmdObj.recorder = recorder
+    cmdObj.response.say('Text Adventure Demo!')
+    cmdObj.response.say('====================')
+    cmdObj.response.say()
+    cmdObj.response.say('(Type "help" for commands.)')
+    cmdObj.response.say()
+    displayLocation(cmdObj.session, cmdObj.session.location)
+    cmdObj.response.send()
+    startupCheckpoint('first display')
+    if args.startup_times:
+        printStartupTimes()
+    cmdObj.cmdloop()
+    if recorder is not None:
+        recorder.close()
+    if statsFilename is not None:
+        commandStats.writeFile(statsFilename)
+    print('Thanks for playing!')
@@ -0,0 +1,313 @@
+#! python3
+"""
+Text Adventure Demo Server
+
+This program lets many players play the text adventure demo at the same time
+by connecting to it over the network with a telnet-style client (such as
+telnet or netcat). It uses the asyncio module so that one program running on
+one CPU core can look after thousands of connections, most of which are
+waiting for their player to type something, without starting a thread for
+each player.
+
+All of the players share one WorldState, so they see the items each other
+drop and take. Each connection has its own GameSession and SharedWorldCmd,
+and each line the player sends is run by the same do_*() methods that the
+terminal version of the game uses (except for "save" and "restore", which
+don't work in a shared world).
+
+To run the server:
+
+    python textadventureserver.py serve --port 4000
+
+With --record-dir, every player's commands are recorded in a file of their
+own in that directory, which "python textadventuredemo.py --replay FILE"
+can replay. The files are named after when the server started and the
+player's number, such as "20260117-093000-player-12.rec", so restarting
+the server doesn't overwrite the last run's recordings.
+
+This file also has a load-generating client for testing the server on your
+own computer. It opens many connections to the server and has them all send
+commands as fast as the server answers:
+
+    python textadventureserver.py load --port 4000 --clients 1000 --commands 50
+"""
+
+import argparse, asyncio, contextlib, os, random, sys, time
+
+import textadventuredemo
+from textadventuredemo import (GameSession, SessionRecorder, SharedWorldCmd, TextAdventureCmd, WorldState,
+                               enableStats, encodeOutput, gameWorld, getSearchIndex, startSimulation)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 4000
+PROMPT = encodeOutput(TextAdventureCmd.prompt)
+MAX_LINE_LENGTH = 1024 # longer lines than this disconnect the player
+WRITE_BUFFER_HIGH = 64 * 1024 # stop reading commands from a player whose output isn't being read
+
+"""
+Telnet clients send "IAC" (interpret as command) sequences to negotiate
+options. These start with the byte 255 and are followed by a command byte
+and, for the option commands 251-254, an option byte. The game doesn't
+negotiate anything, so these are just removed.
+"""
+IAC = 255
+NOP = 241 # the "no operation" command, which telnet clients ignore
+
+"""
+Notifications (what other players do, sent while the player is waiting at
+the prompt) start with NOTIFY_MARKER, an IAC NOP that telnet clients don't
+display, so that programs like the load-generating client below can tell
+them apart from the answers to their commands.
+"""
+NOTIFY_MARKER = bytes([IAC, NOP])
+
+def stripTelnetCommands(data):
+    """Returns the bytes data with any telnet IAC sequences removed."""
+    if IAC not in data:
+        return data
+    stripped = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i] == IAC and i + 1 < len(data):
+            if data[i + 1] == IAC:
+                stripped.append(IAC) # an escaped 255 byte
+                i += 2
+            elif 251 <= data[i + 1] <= 254:
+                i += 3 # WILL, WONT, DO, DONT and their option byte
+            else:
+                i += 2
+        else:
+            stripped.append(data[i])
+            i += 1
+    return bytes(stripped)
+
+
+class WriterSink:
+    """A sink that sends a player's output to their asyncio StreamWriter."""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        self.writer.write(encodeOutput(text))
+
+
+def runCommand(cmdObj, line):
+    """Runs one command for a player and returns True if the player quit.
+
+    Everything the command displays, followed by the prompt (or a goodbye if
+    the player quit), is sent to the player as a single write when postcmd()
+    sends the response."""
+    line = cmdObj.precmd(line)
+    stop = cmdObj.onecmd(line)
+    if stop:
+        cmdObj.response.say('Thanks for playing!')
+    else:
+        cmdObj.response.write(cmdObj.prompt)
+    return cmdObj.postcmd(stop, line)
+
+
+class GameServer:
+    """Accepts connections and runs a game session for each one. If simulate
+    is True, the world's timed events (see startSimulation()) run on the
+    event loop, and players see them as they happen. If recordDir is given,
+    each player's commands are recorded in a file there (see
+    SessionRecorder)."""
+
+    def __init__(self, state=None, idleTimeout=None, simulate=False, recordDir=None):
+        if state is None:
+            state = WorldState(gameWorld)
+        self.state = state # shared by every player
+        self.idleTimeout = idleTimeout # seconds, or None to wait forever
+        self.connections = 0
+        self.commandsRun = 0
+        self.playersJoined = 0
+        self.lastNotifyText = None # the text notify() sent last, and the bytes it sent for it
+        self.lastNotifyData = None
+        self.notificationsDropped = 0 # because the player wasn't reading their output
+        self.recordDir = recordDir
+        self.simulate = simulate
+        self.started = time.monotonic()
+        self.runName = time.strftime('%Y%m%d-%H%M%S') # recordings are named after this
+        if simulate:
+            startSimulation(state).attach(asyncio.get_running_loop())
+
+    async def handleConnection(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        cmdObj = SharedWorldCmd(GameSession(self.state), sink=WriterSink(writer))
+        self.playersJoined += 1
+        cmdObj.session.name = 'Player %s' % (self.playersJoined)
+        cmdObj.session.onNotify = lambda session, text: self.notify(writer, text)
+        if self.recordDir is not None:
+            filename = os.path.join(self.recordDir, '%s-player-%s.rec' % (self.runName, self.playersJoined))
+            try:
+                cmdObj.recorder = SessionRecorder(filename, gameWorld, SharedWorldCmd, self.simulate,
+                                                  started=self.started if self.simulate else None, overwrite=False)
+            except FileExistsError:
+                print('Not recording %s, since %s already exists' % (cmdObj.session.name, filename), file=sys.stderr)
+        self.connections += 1
+        try:
+            cmdObj.response.say('Text Adventure Demo!\n====================\n\n(Type "help" for commands.)\n')
+            runCommand(cmdObj, 'look')
+            await writer.drain()
+
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.readline(), self.idleTimeout)
+                except asyncio.TimeoutError:
+                    cmdObj.response.say('\nYou have been idle too long. Goodbye!', end='')
+                    cmdObj.response.send()
+                    break
+                except (ValueError, asyncio.LimitOverrunError):
+                    break # the line was longer than MAX_LINE_LENGTH
+                if not data:
+                    break # the player disconnected
+
+                line = stripTelnetCommands(data).decode('utf-8', 'replace').strip()
+                stop = runCommand(cmdObj, line)
+                self.commandsRun += 1
+                if stop:
+                    break
+
+                # if the player isn't reading their output, drain() waits
+                # until they do instead of letting the output pile up
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            self.state.removeSession(cmdObj.session) # so that nothing is sent to them after this
+            if cmdObj.recorder is not None:
+                cmdObj.recorder.close()
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    def notify(self, writer, text):
+        """Sends text, followed by a new prompt, to a player who is waiting
+        at the prompt. (Commands never wait for anything, so the player can't
+        be in the middle of one.)
+
+        WorldState.broadcast() gives every player in a room the same string,
+        so it is only turned into bytes for the first of them.
+
+        Nothing waits for a notification to be sent, so if a player has more
+        than WRITE_BUFFER_HIGH bytes of output they haven't read yet, the
+        notification is dropped rather than piling up in memory."""
+        if writer.transport.is_closing() or writer.transport.get_write_buffer_size() > WRITE_BUFFER_HIGH:
+            self.notificationsDropped += 1
+            return
+        if text is not self.lastNotifyText:
+            self.lastNotifyText = text
+            self.lastNotifyData = NOTIFY_MARKER + encodeOutput('\n' + text + '\n') + PROMPT
+        writer.write(self.lastNotifyData)
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, idleTimeout=None, simulate=False, recordDir=None):
+    getSearchIndex(gameWorld) # now, instead of the first "search" or "where" holding up every player
+    server = GameServer(idleTimeout=idleTimeout, simulate=simulate, recordDir=recordDir)
+    listener = await asyncio.start_server(server.handleConnection, host, port,
+                                          limit=MAX_LINE_LENGTH, backlog=1024)
+    print('Serving the text adventure demo on %s:%s' % (host, port), file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+"""
+The load-generating client. Each simulated player connects, waits for the
+prompt, and then sends commands picked at random from LOAD_COMMANDS, waiting
+for the prompt after each one before sending the next. Players also get
+told what other players in the same area do (see GameServer.notify()); these
+messages start with NOTIFY_MARKER, unlike the answers to LOAD_COMMANDS, so
+the client can tell them apart and skip them.
+"""
+LOAD_COMMANDS = ['look', 'north', 'south', 'east', 'west', 'up', 'down', 'inventory',
+                 'take sign', 'take book', 'drop donut', 'drop sword', 'take sword', 'look sword',
+                 'list', 'buy donut', 'eat donut', 'sell sword', 'buy sword', 'exits']
+
+async def runLoadClient(host, port, commands, latencies, rng):
+    reader, writer = await asyncio.open_connection(host, port, limit=2 ** 20)
+    try:
+        await reader.readuntil(PROMPT)
+        for i in range(commands):
+            command = rng.choice(LOAD_COMMANDS)
+            start = time.perf_counter()
+            writer.write(command.encode() + b'\r\n')
+            await writer.drain()
+            while (await reader.readuntil(PROMPT)).startswith(NOTIFY_MARKER):
+                pass # something another player did
+            latencies.append(time.perf_counter() - start)
+        writer.write(b'quit\r\n')
+        await writer.drain()
+        await reader.read()
+    finally:
+        writer.close()
+
+
+async def runLoadTest(host=DEFAULT_HOST, port=DEFAULT_PORT, clients=100, commands=50, seed=0):
+    """Connects clients players at once, each sending commands commands, and
+    returns a list of how many seconds each command took to be answered."""
+    latencies = []
+    rng = random.Random(seed)
+    tasks = [runLoadClient(host, port, commands, latencies, random.Random(rng.random()))
+             for i in range(clients)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        print('%s of %s clients failed, for example: %r' % (len(failures), clients, failures[0]), file=sys.stderr)
+    return latencies
+
+
+def printLatencies(latencies, elapsed):
+    if not latencies:
+        print('No commands were answered.')
+        return
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print('%s commands in %.2f seconds (%.0f commands/second)' % (len(latencies), elapsed, len(latencies) / elapsed))
+    print('latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % (percentile(0.5), percentile(0.9), percentile(0.99), latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Text Adventure Demo Server')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    serveParser = subparsers.add_parser('serve', help='run the game server')
+    serveParser.add_argument('--host', default=DEFAULT_HOST)
+    serveParser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serveParser.add_argument('--idle-timeout', type=float, default=None,
+                             help='disconnect players who send nothing for this many seconds')
+    serveParser.add_argument('--events', action='store_true',
+                             help='simulate the world: timed events happen and shops can sell out and restock')
+    serveParser.add_argument('--record-dir', metavar='DIR',
+                             help='record each player\'s commands in a file in DIR, to be replayed with textadventuredemo.py --replay')
+    serveParser.add_argument('--stats', action='store_true',
+                             help='collect timing stats for every command (players can see them with "stats")')
+    serveParser.add_argument('--stats-alloc', action='store_true',
+                             help='with --stats, also measure memory allocations with tracemalloc')
+    serveParser.add_argument('--stats-file', metavar='FILE',
+                             help='with --stats, write the stats to FILE when the server stops')
+    loadParser = subparsers.add_parser('load', help='run the load-generating client against a server')
+    loadParser.add_argument('--host', default=DEFAULT_HOST)
+    loadParser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    loadParser.add_argument('--clients', type=int, default=100, help='how many players connect at once')
+    loadParser.add_argument('--commands', type=int, default=50, help='how many commands each player sends')
+    loadParser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        if args.stats:
+            enableStats(args.stats_alloc)
+            textadventuredemo.statsFilename = args.stats_file
+        if args.record_dir:
+            os.makedirs(args.record_dir, exist_ok=True)
+        try:
+            asyncio.run(serve(args.host, args.port, args.idle_timeout, args.events, args.record_dir))
+        except KeyboardInterrupt:
+            pass
+        if args.stats and args.stats_file:
+            textadventuredemo.commandStats.writeFile(args.stats_file)
+    else:
+        start = time.perf_counter()
+        latencies = asyncio.run(runLoadTest(args.host, args.port, args.clients, args.commands, args.seed))
+        printLatencies(latencies, time.perf_counter() - start)
@@ -0,0 +1,391 @@
+#! python3
+"""
+Text Adventure Demo Shards
+
+textadventureserver.py runs every player's commands in one Python process,
+so however many players connect, the server only ever uses one CPU core.
+This program splits the world's areas into shards and starts a worker
+process for each shard. Each worker looks after the players in its own
+areas (and the items on the ground there), so the workers can run commands
+on different cores at the same time.
+
+The front end is the process the players connect to. It keeps track of
+which shard each player is in and passes their commands to that shard's
+worker over a multiprocessing pipe. When a player walks out of a shard's
+areas into another shard's, the worker hands them back to the front end
+(with their location, inventory, money and settings), and the front end passes
+them on to the worker that owns the area they walked into. That worker
+displays the area, so the player sees the items on the ground there.
+
+To run the sharded server with four workers:
+
+    python textadventureshards.py serve --shards 4 --port 4000
+
+It speaks the same protocol as textadventureserver.py, so its load client
+can test it:
+
+    python textadventureserver.py load --port 4000 --clients 1000 --commands 50
+"""
+
+import argparse, asyncio, collections, contextlib, multiprocessing, sys
+
+import textadventuredemo
+from textadventuredemo import (GameSession, MemorySink, SharedWorldCmd, TextAdventureCmd, WorldState,
+                               displayLocation, encodeOutput, getSearchIndex, openWorldFile, packItemBag, unpackItemBag, useWorld)
+from textadventureserver import (DEFAULT_HOST, DEFAULT_PORT, MAX_LINE_LENGTH, WRITE_BUFFER_HIGH,
+                                 stripTelnetCommands)
+
+DEFAULT_SHARDS = 4
+
+def partitionRooms(world, shardCount):
+    """Returns a bytearray with the shard number (0 to shardCount - 1) of
+    each room in world.
+
+    The rooms are put in breadth-first order, following exits both ways, and
+    the order is cut into shardCount runs of about the same length. Rooms
+    that are near each other end up next to each other in this order, so
+    most exits lead to a room in the same shard and players are handed off
+    only when they cross the edge of a shard."""
+    if not 1 <= shardCount <= 255:
+        raise ValueError('shardCount must be between 1 and 255')
+    roomCount = len(world.rooms)
+    neighbours = [[] for i in range(roomCount)]
+    for loc in range(roomCount):
+        for destination in world.roomExits(loc):
+            if destination != textadventuredemo.NO_EXIT:
+                neighbours[loc].append(destination)
+                neighbours[destination].append(loc)
+
+    order = []
+    seen = bytearray(roomCount)
+    for start in range(roomCount): # more than one start if some rooms can't be reached
+        if seen[start]:
+            continue
+        seen[start] = 1
+        queue = collections.deque([start])
+        while queue:
+            loc = queue.popleft()
+            order.append(loc)
+            for neighbour in neighbours[loc]:
+                if not seen[neighbour]:
+                    seen[neighbour] = 1
+                    queue.append(neighbour)
+
+    shardOf = bytearray(roomCount)
+    for i, loc in enumerate(order):
+        shardOf[loc] = i * shardCount // roomCount
+    return shardOf
+
+
+"""
+The workers. The front end and each worker send each other tuples over a
+pipe. The front end sends:
+
+    ('join', playerId, location, inventory, money, showFullExits, text)
+        a player arrives in this shard. inventory is packed with
+        packItemBag(), and text is what they have been told so far by the
+        command that brought them here.
+    ('command', playerId, line)
+        run a command for a player.
+    ('leave', playerId)
+        a player disconnected.
+    ('stop',)
+        the server is shutting down.
+
+and the worker answers 'join' and 'command' with one of:
+
+    ('output', playerId, text, stop)
+        the command's output. stop is True if the player quit.
+    ('handoff', playerId, shard, location, inventory, money, showFullExits, text)
+        the player walked into shard's areas, and should be sent there with
+        a 'join' message.
+"""
+
+class ShardCmd(SharedWorldCmd):
+    """The commands a worker runs. (Saved games would also need the ground
+    items of the whole world, which are spread over all of the workers.)"""
+
+
+def runShard(shardNumber, shardOf, conn, worldFile=None):
+    """The main function of a worker process: runs commands for the players
+    in the rooms where shardOf[room] is shardNumber, until it is told to stop.
+    worldFile is the world file to play, unless the worker was forked from a
+    front end that already has the world open."""
+    if worldFile is not None:
+        useWorld(openWorldFile(worldFile))
+    getSearchIndex(textadventuredemo.gameWorld) # a forked worker already has the front end's
+    state = WorldState(textadventuredemo.gameWorld)
+    state.ownsRoom = lambda loc: shardOf[loc] == shardNumber # only the ground in this shard's rooms is ever changed
+    players = {} # player ID -> ShardCmd
+    handoffs = {} # player ID -> the room they walked into in another shard
+
+    def onEnter(session, loc):
+        if shardOf[loc] == shardNumber:
+            return False
+        handoffs[session.playerId] = loc
+        return True # the player is leaving, so the other shard displays the area
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break # the front end has gone
+        kind = message[0]
+        playerId = message[1] if len(message) > 1 else None
+
+        if kind == 'command':
+            cmdObj = players.get(playerId)
+            if cmdObj is None:
+                # the front end waits for an answer to every command, so
+                # answer even for a player this shard doesn't have
+                conn.send(('output', playerId, 'Your game could not be found on this server.\n', True))
+                continue
+            line = cmdObj.precmd(message[2])
+            stop = cmdObj.onecmd(line)
+            stop = cmdObj.postcmd(stop, line)
+        elif kind == 'join':
+            location, inventory, money, showFullExits, text = message[2:]
+            session = GameSession(state, location, ())
+            session.inventory = unpackItemBag(inventory, 0, state.baseWorld.items)[0]
+            session.money = money
+            session.showFullExits = showFullExits
+            session.playerId = playerId
+            session.onEnter = onEnter
+            session.name = 'Player %s' % (playerId + 1)
+            cmdObj = ShardCmd(session, sink=MemorySink())
+            players[playerId] = cmdObj
+            cmdObj.response.write(text)
+            displayLocation(session, location)
+            cmdObj.response.send()
+            state.broadcast(location, '%s arrives.' % (session.name), exclude=session)
+            stop = False
+        elif kind == 'leave':
+            cmdObj = players.pop(playerId, None)
+            if cmdObj is not None:
+                state.removeSession(cmdObj.session)
+            continue
+        else: # 'stop'
+            break
+
+        session = cmdObj.session
+        text = cmdObj.response.sink.take()
+        if playerId in handoffs:
+            location = handoffs.pop(playerId)
+            del players[playerId]
+            state.removeSession(session)
+            conn.send(('handoff', playerId, shardOf[location], location, packItemBag(session.inventory),
+                       session.money, session.showFullExits, text))
+        else:
+            if stop:
+                del players[playerId]
+                state.removeSession(session)
+            conn.send(('output', playerId, text, stop))
+    conn.close()
+
+
+class ShardRouter:
+    """Starts the workers and passes each player's commands to the worker
+    for the shard they are in.
+
+    Each player has at most one request waiting for an answer at a time, so
+    answers are matched up with requests by player ID."""
+
+    def __init__(self, shardCount=DEFAULT_SHARDS, worldFile=None):
+        self.shardCount = shardCount
+        self.worldFile = worldFile
+        if worldFile is not None:
+            useWorld(openWorldFile(worldFile))
+        self.shardOf = partitionRooms(textadventuredemo.gameWorld, shardCount)
+        self.startShard = self.shardOf[textadventuredemo.gameWorld.roomId(textadventuredemo.startLocation)]
+        self.conns = []
+        self.processes = []
+        self.playerShards = {} # player ID -> the shard they are in
+        self.waiting = {} # player ID -> the Future for their answer
+        self.nextPlayerId = 0
+        self.handoffs = 0
+
+    def start(self):
+        # The search index takes a while to build for a big world (see
+        # getSearchIndex()), so it is built once, here, before the workers
+        # start. Where workers are forked (as on Linux), each one gets the
+        # world and the index along with the rest of this process's memory.
+        # Elsewhere, each worker has to open the world file and build the
+        # index for itself.
+        getSearchIndex(textadventuredemo.gameWorld)
+        worldFile = None if multiprocessing.get_start_method() == 'fork' else self.worldFile
+        loop = asyncio.get_running_loop()
+        for shardNumber in range(self.shardCount):
+            conn, workerConn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=runShard, daemon=True,
+                                              args=(shardNumber, bytes(self.shardOf), workerConn, worldFile))
+            process.start()
+            workerConn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+            loop.add_reader(conn.fileno(), self.receive, conn)
+
+    def stop(self):
+        loop = asyncio.get_running_loop()
+        for conn in self.conns:
+            loop.remove_reader(conn.fileno())
+            with contextlib.suppress(OSError):
+                conn.send(('stop',))
+        for process in self.processes:
+            process.join(5)
+        for conn in self.conns:
+            conn.close()
+
+    def receive(self, conn):
+        """Called by the event loop when a worker has sent an answer."""
+        while conn.poll():
+            try:
+                message = conn.recv()
+            except EOFError:
+                asyncio.get_running_loop().remove_reader(conn.fileno())
+                return # the worker died; its players stay waiting until they disconnect
+            future = self.waiting.pop(message[1], None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    def request(self, shardNumber, message):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[message[1]] = future
+        self.conns[shardNumber].send(message)
+        return future
+
+    async def answer(self, shardNumber, message):
+        """Sends message to a worker and returns (text, stop) from its answer,
+        following the player from shard to shard if they are handed off."""
+        answer = await self.request(shardNumber, message)
+        while answer[0] == 'handoff':
+            playerId, shardNumber, location, inventory, money, showFullExits, text = answer[1:]
+            self.playerShards[playerId] = shardNumber
+            self.handoffs += 1
+            answer = await self.request(shardNumber, ('join', playerId, location, inventory, money, showFullExits, text))
+        return answer[2], answer[3]
+
+    async def join(self, text=''):
+        """Adds a new player in the start location and returns (player ID,
+        the text they see first)."""
+        playerId = self.nextPlayerId
+        self.nextPlayerId += 1
+        world = textadventuredemo.gameWorld
+        session = GameSession(WorldState(world)) # just to get the starting inventory and money
+        self.playerShards[playerId] = self.startShard
+        output, stop = await self.answer(self.startShard, ('join', playerId, session.location, packItemBag(session.inventory),
+                                                            session.money, session.showFullExits, text))
+        return playerId, output
+
+    async def command(self, playerId, line):
+        """Runs a command for a player and returns (text, stop)."""
+        output, stop = await self.answer(self.playerShards[playerId], ('command', playerId, line))
+        if stop:
+            del self.playerShards[playerId]
+        return output, stop
+
+    def leave(self, playerId):
+        shardNumber = self.playerShards.pop(playerId, None)
+        self.waiting.pop(playerId, None)
+        if shardNumber is not None:
+            self.conns[shardNumber].send(('leave', playerId))
+
+
+class ShardedServer:
+    """Accepts connections like textadventureserver's GameServer, but runs
+    the players' commands in the ShardRouter's workers."""
+
+    def __init__(self, router, idleTimeout=None):
+        self.router = router
+        self.idleTimeout = idleTimeout
+        self.connections = 0
+
+    async def handleConnection(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        self.connections += 1
+        playerId = None
+        try:
+            playerId, output = await self.router.join('Text Adventure Demo!\n====================\n\n(Type "help" for commands.)\n\n')
+            self.send(writer, output)
+            await writer.drain()
+
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.readline(), self.idleTimeout)
+                except asyncio.TimeoutError:
+                    self.send(writer, '\nYou have been idle too long. Goodbye!', prompt=False)
+                    break
+                except (ValueError, asyncio.LimitOverrunError):
+                    break # the line was longer than MAX_LINE_LENGTH
+                if not data:
+                    break # the player disconnected
+
+                line = stripTelnetCommands(data).decode('utf-8', 'replace').strip()
+                output, stop = await self.router.command(playerId, line)
+                if stop:
+                    self.send(writer, output + 'Thanks for playing!\n', prompt=False)
+                    playerId = None
+                    break
+                self.send(writer, output)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            if playerId is not None:
+                self.router.leave(playerId)
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    def send(self, writer, text, prompt=True):
+        """Writes text (and the prompt) to the player as a single write."""
+        if prompt:
+            text += TextAdventureCmd.prompt
+        writer.write(encodeOutput(text))
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, shardCount=DEFAULT_SHARDS, worldFile=None, idleTimeout=None):
+    router = ShardRouter(shardCount, worldFile)
+    router.start()
+    server = ShardedServer(router, idleTimeout)
+    try:
+        listener = await asyncio.start_server(server.handleConnection, host, port,
+                                              limit=MAX_LINE_LENGTH, backlog=1024)
+        print('Serving the text adventure demo on %s:%s with %s shards' % (host, port, shardCount), file=sys.stderr)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        router.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Text Adventure Demo Sharded Server')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    serveParser = subparsers.add_parser('serve', help='run the sharded game server')
+    serveParser.add_argument('--host', default=DEFAULT_HOST)
+    serveParser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serveParser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help='how many worker processes to start')
+    serveParser.add_argument('--world', metavar='WORLDFILE',
+                             help='serve the world in a world file instead of the built-in world')
+    serveParser.add_argument('--idle-timeout', type=float, default=None,
+                             help='disconnect players who send nothing for this many seconds')
+    partitionParser = subparsers.add_parser('partition', help='display which shard each area is in')
+    partitionParser.add_argument('--shards', type=int, default=DEFAULT_SHARDS)
+    partitionParser.add_argument('--world', metavar='WORLDFILE')
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        try:
+            asyncio.run(serve(args.host, args.port, args.shards, args.world, args.idle_timeout))
+        except KeyboardInterrupt:
+            pass
+    else:
+        if args.world:
+            useWorld(openWorldFile(args.world))
+        world = textadventuredemo.gameWorld
+        shardOf = partitionRooms(world, args.shards)
+        for loc in sorted(range(len(world.rooms)), key=lambda loc: (shardOf[loc], loc)):
+            print('%3d  %s' % (shardOf[loc], world.rooms[loc].name))
+        crossing = sum(1 for loc in range(len(world.rooms)) for destination in world.roomExits(loc)
+                       if destination != textadventuredemo.NO_EXIT and shardOf[destination] != shardOf[loc])
+        print('%s exits cross from one shard to another' % (crossing))